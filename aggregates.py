@@ -0,0 +1,576 @@
+"""
+Aggregate store for WooCommerce Dashboard
+
+Every view the pages need (daily revenue per course, order status counts,
+monthly product pivots, per-customer totals, per-month and per-fiscal-year
+course metrics, per-fiscal-year product metrics) is computed in a single pass over the orders into a
+"partial". Refunds count against the order they refund: line-item refunds
+(see refunds.py) against the daily course revenue, and the order's refunded
+amount against its course metrics and its customer, which give net revenue
+next to the gross figures. Partials of disjoint sets of orders can be merged exactly:
+money is summed in integer cents, and "first seen" values remember the
+order's position in the store, so merging never depends on how the orders
+were split up. aggregation_engine uses this to aggregate partitions in
+parallel; build_aggregates below is the serial path. Products are matched to
+courses and exclusions by the compiled product rules (see product_rules.py).
+
+Customers are keyed by customer id, and guest checkouts (customer 0) by a
+hash of their normalized billing email. Each partial also keeps an
+identity index, email hash -> registered customer, from the completed
+orders of registered customers; it merges like everything else. When the
+aggregates are finalized, each guest is merged into the registered customer
+who ordered with the same email (a dictionary lookup per guest), so guest
+orders count towards their customer's lifetime value, and guests who never
+registered are customers of their own.
+
+The finalized aggregates are computed once per data version at sync time and
+saved next to the store, so pages and charts never scan raw orders.
+"""
+import hashlib
+import json
+import os
+import re
+from datetime import datetime
+from collections import defaultdict, Counter
+import pandas as pd
+from config import DATA_FILES
+
+
+def normalize_product_name(name):
+    """Normalize a product name for comparisons (case and whitespace insensitive)"""
+    return ' '.join((name or '').lower().split())
+
+SEATS_RE = re.compile(r'(\d+)\s*seats?')
+
+# Bumped when the shape of the saved aggregates changes, so older files are rebuilt
+AGGREGATES_FORMAT = 4
+
+# Users key of guest checkouts: the prefix and the hash of their email
+GUEST_KEY_PREFIX = 'guest:'
+
+
+def email_key(email):
+    """Hash of a normalized email address (None if it is empty)"""
+    email = (email or '').strip().lower()
+    if not email:
+        return None
+    return hashlib.blake2b(email.encode(), digest_size=8).hexdigest()
+
+
+def parse_order_date(date_str):
+    """Parse a WooCommerce order date (with or without the 'T' separator)"""
+    if 'T' in date_str:
+        return datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S")
+    return datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S")
+
+
+def fiscal_year_of(date_str):
+    """Return the fiscal year (September 1 - August 31) of an order date string, or None if it isn't a date"""
+    try:
+        year, month = int(date_str[:4]), int(date_str[5:7])
+    except (TypeError, ValueError):
+        return None
+    return year + 1 if month >= 9 else year
+
+
+def fiscal_year_months(fiscal_year):
+    """The months ('YYYY-MM') of a fiscal year, September to August"""
+    return [f"{fiscal_year - 1}-{month:02d}" for month in range(9, 13)] + [f"{fiscal_year}-{month:02d}" for month in range(1, 9)]
+
+
+def to_cents(value):
+    """Convert a WooCommerce money string (or number) to integer cents"""
+    return int(round(float(value) * 100))
+
+
+def group_seats(item_name, order_cents):
+    """Seat count of a group product, from its name or else estimated from the order total"""
+    seat_match = SEATS_RE.search(item_name)
+    if seat_match:
+        return int(seat_match.group(1))
+    # Fallback: estimate seats based on total
+    if order_cents <= 30000:
+        return 2
+    if order_cents <= 50000:
+        return 4
+    if order_cents <= 70000:
+        return 6
+    if order_cents <= 90000:
+        return 8
+    return 10
+
+
+def _item_cents(item):
+    """Line item total in cents (missing totals count as zero)"""
+    return 0 if item.total is None else to_cents(item.total)
+
+
+def _new_course_metrics():
+    return {
+        'total_orders': 0, 'total_revenue': 0,
+        'new_orders': 0, 'new_revenue': 0,
+        'recurring_orders': 0, 'recurring_revenue': 0,
+        'individual_orders': 0, 'individual_monthly': 0, 'individual_annual': 0, 'individual_revenue': 0,
+        'group_orders': 0, 'group_revenue': 0, 'group_by_seats': Counter(),
+        # Line-item revenue split used by the dashboard's Initial/Recurring lines
+        'individual_new_item_revenue': 0, 'individual_recurring_item_revenue': 0,
+        'group_new_item_revenue': 0, 'group_recurring_item_revenue': 0,
+        # Refunded amount of the course's completed orders
+        'refunded_revenue': 0
+    }
+
+
+def _new_product_metrics():
+    return {
+        'revenue': 0, 'order_count': 0,
+        'individual_revenue': 0, 'group_revenue': 0, 'individual_count': 0, 'group_count': 0,
+        'new_revenue': 0, 'recurring_revenue': 0, 'new_count': 0, 'recurring_count': 0
+    }
+
+
+# Money fields (kept in cents inside partials)
+COURSE_REVENUE_KEYS = [k for k in _new_course_metrics() if k.endswith('revenue')]
+PRODUCT_REVENUE_KEYS = [k for k in _new_product_metrics() if k.endswith('revenue')]
+
+
+def _new_cell():
+    return [0, 0]
+
+
+def _new_daily_cell():
+    return [0, 0, 0]
+
+
+def new_partial():
+    """Return an empty partial"""
+    return {
+        'status_counts': Counter(),
+        # (day, course) -> [cents, order count, refunded cents]; revenue and refunds from line items
+        'daily': defaultdict(_new_daily_cell),
+        # Every month with a completed order
+        'months': set(),
+        # normalized product name -> (store position, display name) where it was first seen
+        'product_names': {},
+        # (normalized product name, month) -> [cents, new (non-subscription) order line count]
+        'product_month': defaultdict(_new_cell),
+        # customer_id (or guest key) -> running totals for the Users page
+        'users': {},
+        # email hash -> smallest registered customer_id with a completed order from that email
+        'identities': {},
+        # (month, course) -> course metrics, like the dashboard's course breakdown (summed into fiscal years when finalized)
+        'course_month_metrics': defaultdict(_new_course_metrics),
+        # (fiscal year, product name) -> product metrics
+        'product_metrics': defaultdict(_new_product_metrics)
+    }
+
+
+def _add_course_metrics(partial, month, order_cents, refunded_cents, is_recurring, items, rules):
+    """Accumulate one completed order into the per-course metrics of its month"""
+    items_by_course = {}
+    for item in items:
+        for course in rules.courses_in(item.name):
+            items_by_course.setdefault(course, []).append(item)
+    for course, course_items in items_by_course.items():
+        metrics = partial['course_month_metrics'][(month, course)]
+        metrics['total_orders'] += 1
+        metrics['total_revenue'] += order_cents
+        metrics['refunded_revenue'] += refunded_cents
+        if is_recurring:
+            metrics['recurring_orders'] += 1
+            metrics['recurring_revenue'] += order_cents
+        else:
+            metrics['new_orders'] += 1
+            metrics['new_revenue'] += order_cents
+
+        is_individual = is_monthly = is_annual = is_group = False
+        for item in course_items:
+            item_name = item.name.lower()
+            if 'individual' in item_name:
+                is_individual = True
+                # Monthly vs annual from the payment term, falling back to the product name
+                payment_term = item.payment_term.lower() if item.payment_term is not None else None
+                if payment_term == 'monthly' or 'monthly' in item_name:
+                    is_monthly = True
+                elif payment_term == 'annual' or 'annual' in item_name:
+                    is_annual = True
+            elif 'group' in item_name or 'seats' in item_name:
+                is_group = True
+                metrics['group_by_seats'][group_seats(item_name, order_cents)] += 1
+
+            # Initial vs recurring line-item revenue
+            if 'individual' in item_name:
+                metrics['individual_recurring_item_revenue' if is_recurring else 'individual_new_item_revenue'] += _item_cents(item)
+            if 'group' in item_name or 'seats' in item_name:
+                metrics['group_recurring_item_revenue' if is_recurring else 'group_new_item_revenue'] += _item_cents(item)
+
+        if is_individual:
+            metrics['individual_orders'] += 1
+            metrics['individual_revenue'] += order_cents
+        if is_monthly:
+            metrics['individual_monthly'] += 1
+        if is_annual:
+            metrics['individual_annual'] += 1
+        if is_group:
+            metrics['group_orders'] += 1
+            metrics['group_revenue'] += order_cents
+
+
+def _add_product_metrics(partial, fiscal_year, order_cents, is_recurring, items):
+    """Accumulate one completed order into the per-product metrics of its fiscal year"""
+    products_in_order = set()
+    for item in items:
+        if item.total is None:
+            continue
+        partial['product_metrics'][(fiscal_year, item.name)]['revenue'] += to_cents(item.total)
+        products_in_order.add(item.name)
+
+    # Individual vs group is decided by the order total
+    is_group_order = order_cents > 20000
+    for name in products_in_order:
+        metrics = partial['product_metrics'][(fiscal_year, name)]
+        metrics['order_count'] += 1
+        if is_group_order:
+            metrics['group_revenue'] += order_cents
+            metrics['group_count'] += 1
+        else:
+            metrics['individual_revenue'] += order_cents
+            metrics['individual_count'] += 1
+        if is_recurring:
+            metrics['recurring_revenue'] += order_cents
+            metrics['recurring_count'] += 1
+        else:
+            metrics['new_revenue'] += order_cents
+            metrics['new_count'] += 1
+
+
+def aggregate_partition(orders, positions, rules):
+    """Aggregate the Order records at the given store positions into a partial"""
+    partial = new_partial()
+    # email -> email_key(email); customers usually order more than once
+    email_hashes = {}
+
+    for position in positions:
+        order = orders[position]
+        # Same validity rule as calculate_stats: only orders with a numeric total are counted
+        if order.total is None:
+            continue
+        order_cents = to_cents(order.total)
+        partial['status_counts'][order.status] += 1
+        if order.status != 'completed':
+            continue
+
+        is_recurring = order.created_via == 'subscription'
+        date_str = order.date_created
+        fiscal_year = fiscal_year_of(date_str)
+        items = order.line_items
+
+        if fiscal_year is not None:
+            day, month = date_str[:10], date_str[:7]
+
+            # Daily revenue per course (an order counts once per course it contains)
+            order_courses = set()
+            for item in items:
+                if item.total is None:
+                    continue
+                course = rules.course(item.name)
+                cell = partial['daily'][(day, course)]
+                cell[0] += to_cents(item.total)
+                cell[2] += item.refunded
+                order_courses.add(course)
+            for course in order_courses:
+                partial['daily'][(day, course)][1] += 1
+
+            # Monthly product tables (demo/beta/test products excluded)
+            partial['months'].add(month)
+            for item in items:
+                if rules.is_excluded(item.name):
+                    continue
+                name = item.name.strip()
+                norm = normalize_product_name(name)
+                if norm not in partial['product_names']:
+                    partial['product_names'][norm] = (position, name)
+                cell = partial['product_month'][(norm, month)]
+                cell[0] += _item_cents(item)
+                if not is_recurring:
+                    cell[1] += 1
+
+            _add_course_metrics(partial, month, order_cents, order.refunded, is_recurring, items, rules)
+            _add_product_metrics(partial, fiscal_year, order_cents, is_recurring, items)
+
+        # Users: orders with at least one included product; guests are keyed by their email's hash
+        customer_id = order.customer_id
+        email_hash = email_hashes.get(order.email, False)
+        if email_hash is False:
+            email_hash = email_hashes[order.email] = email_key(order.email)
+        if email_hash is None:
+            if not customer_id:
+                continue
+        elif customer_id:
+            registered = partial['identities'].get(email_hash)
+            if registered is None or customer_id < registered:
+                partial['identities'][email_hash] = customer_id
+        else:
+            customer_id = GUEST_KEY_PREFIX + email_hash
+        included_products = [
+            item.name.strip() for item in items
+            if not rules.is_excluded(item.name)
+        ]
+        if not included_products:
+            continue
+        user = partial['users'].get(customer_id)
+        if user is None:
+            user = partial['users'][customer_id] = {
+                'first_position': position,
+                'name': f"{order.first_name} {order.last_name}".strip(),
+                'email': order.email,
+                'first_order_date': date_str,
+                'last_order_date': date_str,
+                'total_revenue': 0,
+                'refunded': 0,
+                'order_count': 0,
+                'subscription_orders': 0,
+                'new_orders': 0,
+                'guest_orders': 0,
+                'products_purchased': set()
+            }
+        user['total_revenue'] += order_cents
+        user['refunded'] += order.refunded
+        user['order_count'] += 1
+        if is_recurring:
+            user['subscription_orders'] += 1
+        else:
+            user['new_orders'] += 1
+        if not order.customer_id:
+            user['guest_orders'] += 1
+        user['first_order_date'] = min(user['first_order_date'], date_str)
+        user['last_order_date'] = max(user['last_order_date'], date_str)
+        user['products_purchased'].update(included_products)
+
+    return partial
+
+
+def _merge_metrics(into, other):
+    for key, value in other.items():
+        into[key] = into[key] + value
+
+
+def _merge_user(existing, user):
+    """Add a customer's running totals into existing (name and email come from their first order in the store)"""
+    if user['first_position'] < existing['first_position']:
+        for key in ('first_position', 'name', 'email'):
+            existing[key] = user[key]
+    for key in ('total_revenue', 'refunded', 'order_count', 'subscription_orders', 'new_orders', 'guest_orders'):
+        existing[key] += user[key]
+    existing['first_order_date'] = min(existing['first_order_date'], user['first_order_date'])
+    existing['last_order_date'] = max(existing['last_order_date'], user['last_order_date'])
+    existing['products_purchased'] |= user['products_purchased']
+
+
+def merge_partials(partials):
+    """Merge partials of disjoint order sets into one (the inputs may be modified)"""
+    merged = new_partial()
+    for partial in partials:
+        merged['status_counts'].update(partial['status_counts'])
+        for key, (cents, count, refunded) in partial['daily'].items():
+            cell = merged['daily'][key]
+            cell[0] += cents
+            cell[1] += count
+            cell[2] += refunded
+        merged['months'] |= partial['months']
+        for norm, seen in partial['product_names'].items():
+            if norm not in merged['product_names'] or seen < merged['product_names'][norm]:
+                merged['product_names'][norm] = seen
+        for key, (cents, count) in partial['product_month'].items():
+            cell = merged['product_month'][key]
+            cell[0] += cents
+            cell[1] += count
+        for key, metrics in partial['course_month_metrics'].items():
+            _merge_metrics(merged['course_month_metrics'][key], metrics)
+        for key, metrics in partial['product_metrics'].items():
+            _merge_metrics(merged['product_metrics'][key], metrics)
+        for customer_id, user in partial['users'].items():
+            existing = merged['users'].get(customer_id)
+            if existing is None:
+                merged['users'][customer_id] = user
+            else:
+                _merge_user(existing, user)
+        for email_hash, customer_id in partial['identities'].items():
+            registered = merged['identities'].get(email_hash)
+            if registered is None or customer_id < registered:
+                merged['identities'][email_hash] = customer_id
+    return merged
+
+
+def resolve_identities(users, identities):
+    """Users with every guest merged into the registered customer who ordered with the same email
+
+    The partial's users are left as they are: a customer a guest is merged
+    into is copied first.
+    """
+    resolved = {}
+    guests = []
+    for key, user in users.items():
+        if isinstance(key, str) and key.startswith(GUEST_KEY_PREFIX):
+            customer_id = identities.get(key[len(GUEST_KEY_PREFIX):])
+            if customer_id is not None:
+                guests.append((customer_id, user))
+                continue
+        resolved[key] = user
+    for customer_id, user in guests:
+        existing = resolved.get(customer_id)
+        if existing is None:
+            # The customer's own orders had no included product
+            resolved[customer_id] = user
+            continue
+        existing = resolved[customer_id] = dict(existing, products_purchased=set(existing['products_purchased']))
+        _merge_user(existing, user)
+    return resolved
+
+
+def _finalize_course_metrics(metrics):
+    """Course metrics in dollars, with net revenue"""
+    metrics = dict(metrics)
+    metrics['net_revenue'] = (metrics['total_revenue'] - metrics['refunded_revenue']) / 100
+    for key in COURSE_REVENUE_KEYS:
+        metrics[key] = metrics[key] / 100
+    metrics['group_by_seats'] = dict(sorted(metrics['group_by_seats'].items()))
+    return metrics
+
+
+def finalize_aggregates(partial, rules):
+    """Turn a (merged) partial into the aggregate store: dollars instead of cents, sorted and display-ready"""
+    daily = [[day, course, cents / 100, count, refunded / 100]
+             for (day, course), (cents, count, refunded) in sorted(partial['daily'].items())]
+
+    # Monthly product tables: products grouped by course, then by name
+    months = sorted(partial['months'])
+    product_names = {norm: name for norm, (_, name) in partial['product_names'].items()}
+    product_courses = {name: rules.course(name) for name in product_names.values()}
+    ordered = sorted(product_names.items(), key=lambda x: (rules.courses.index(product_courses[x[1]]) if product_courses[x[1]] in rules.courses else 99, x[1]))
+    product_month = partial['product_month']
+    monthly_products = {
+        'months': months,
+        'products': [name for _, name in ordered],
+        'revenue': [[product_month[(norm, month)][0] / 100 if (norm, month) in product_month else 0 for month in months] for norm, _ in ordered],
+        'new_orders': [[product_month[(norm, month)][1] if (norm, month) in product_month else 0 for month in months] for norm, _ in ordered]
+    }
+
+    users = {}
+    for customer_id, user in resolve_identities(partial['users'], partial['identities']).items():
+        # Subscription duration in months between first and last order
+        try:
+            first_date = parse_order_date(user['first_order_date'])
+            last_date = parse_order_date(user['last_order_date'])
+            subscription_months = max(0, (last_date.year - first_date.year) * 12 + (last_date.month - first_date.month))
+        except Exception:
+            subscription_months = 0
+        users[customer_id] = {
+            'name': user['name'],
+            'email': user['email'],
+            'first_order_date': user['first_order_date'],
+            'last_order_date': user['last_order_date'],
+            'total_revenue': user['total_revenue'] / 100,
+            'refunded': user['refunded'] / 100,
+            'net_revenue': (user['total_revenue'] - user['refunded']) / 100,
+            'order_count': user['order_count'],
+            'subscription_orders': user['subscription_orders'],
+            'new_orders': user['new_orders'],
+            'guest_orders': user['guest_orders'],
+            'subscription_months': subscription_months,
+            'products_purchased': sorted(user['products_purchased'])
+        }
+
+    # Fiscal years are the sums of their months
+    fiscal_year_metrics = defaultdict(_new_course_metrics)
+    course_month_metrics = defaultdict(dict)
+    for (month, course), metrics in sorted(partial['course_month_metrics'].items()):
+        _merge_metrics(fiscal_year_metrics[(fiscal_year_of(month), course)], metrics)
+        course_month_metrics[month][course] = _finalize_course_metrics(metrics)
+    course_metrics = defaultdict(dict)
+    for (fiscal_year, course), metrics in sorted(fiscal_year_metrics.items()):
+        course_metrics[fiscal_year][course] = _finalize_course_metrics(metrics)
+
+    product_metrics = defaultdict(dict)
+    for (fiscal_year, name), metrics in sorted(partial['product_metrics'].items()):
+        metrics = dict(metrics)
+        for key in PRODUCT_REVENUE_KEYS:
+            metrics[key] = metrics[key] / 100
+        product_metrics[fiscal_year][name] = metrics
+
+    return {
+        'daily_course_revenue': daily,
+        'status_counts': dict(sorted(partial['status_counts'].items())),
+        'monthly_products': monthly_products,
+        'users': users,
+        'course_metrics': dict(course_metrics),
+        'course_month_metrics': dict(course_month_metrics),
+        'product_metrics': dict(product_metrics)
+    }
+
+
+def build_aggregates(orders, rules):
+    """Build the aggregate store serially (a single partition holding every order)"""
+    return finalize_aggregates(aggregate_partition(orders, range(len(orders)), rules), rules)
+
+
+def build_monthly_pivots(aggregates):
+    """Build the monthly product pivots (revenue and new-order counts) with a Total row at the bottom
+
+    Returns None when there are no completed orders.
+    """
+    monthly = aggregates['monthly_products']
+    months = monthly['months']
+    if not months:
+        return None
+
+    def pivot(rows):
+        data = {"Product": monthly['products']}
+        for i, month in enumerate(months):
+            data[month] = [row[i] for row in rows]
+        df = pd.DataFrame(data)
+        total_row = {"Product": "Total"}
+        for month in months:
+            total_row[month] = df[month].sum()
+        return pd.concat([df, pd.DataFrame([total_row])], ignore_index=True)
+
+    return {
+        'months': months,
+        'revenue': pivot(monthly['revenue']),
+        'new_orders': pivot(monthly['new_orders'])
+    }
+
+
+def save_aggregates(aggregates, data_version):
+    """Persist the aggregate store, tagged with the data version it was built from"""
+    # JSON object keys must be strings; integer keys are restored on load
+    data = dict(aggregates)
+    data['users'] = list(aggregates['users'].items())
+    data['course_metrics'] = list(aggregates['course_metrics'].items())
+    data['product_metrics'] = list(aggregates['product_metrics'].items())
+    tmp_path = f"{DATA_FILES['aggregates']}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({'data_version': data_version, 'format': AGGREGATES_FORMAT, 'aggregates': data}, f)
+    os.replace(tmp_path, DATA_FILES['aggregates'])
+
+
+def load_aggregates(data_version):
+    """Load the persisted aggregate store, or None if it is missing or stale"""
+    try:
+        with open(DATA_FILES['aggregates'], "r") as f:
+            data = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if data.get('data_version') != data_version or data.get('format') != AGGREGATES_FORMAT:
+        return None
+    aggregates = data['aggregates']
+    aggregates['users'] = dict((customer_id, user) for customer_id, user in aggregates['users'])
+    def course_metrics(periods):
+        return {
+            period: {course: dict(metrics, group_by_seats={int(k): v for k, v in metrics['group_by_seats'].items()})
+                     for course, metrics in courses.items()}
+            for period, courses in periods
+        }
+    aggregates['course_metrics'] = course_metrics(aggregates['course_metrics'])
+    aggregates['course_month_metrics'] = course_metrics(aggregates['course_month_metrics'].items())
+    aggregates['product_metrics'] = dict((fiscal_year, products) for fiscal_year, products in aggregates['product_metrics'])
+    return aggregates
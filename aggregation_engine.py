@@ -0,0 +1,109 @@
+"""
+Partitioned aggregation engine for full-history recomputes
+
+Splits the order store into partitions (fiscal years or months), aggregates
+each partition into a partial in a ProcessPoolExecutor and merges the
+partials. Because partials merge exactly (see aggregates.py), the result is
+identical to the serial build_aggregates, whatever the partitioning.
+
+Where the platform supports fork and the process runs a single thread,
+worker processes inherit the order list (handed to each pool through its
+initializer) and only receive partition positions, so orders are never
+pickled. Forking a process with other threads running (the dashboard, the
+webhook receiver) could copy locks they hold into the workers, so there the
+workers are started with forkserver or spawn and are sent their
+partition's orders instead.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from config import APP_CONFIG
+from aggregates import aggregate_partition, merge_partials, finalize_aggregates, fiscal_year_of
+
+# Orders inherited by a forked worker (set by the pool's initializer, in the worker only)
+_shared_orders = None
+
+
+def partition_orders(orders, partition_by='fiscal_year'):
+    """Group store positions by fiscal year or month ('YYYY-MM'); orders without a valid date go in partition None"""
+    partitions = {}
+    for position, order in enumerate(orders):
+        date_str = order.date_created
+        if fiscal_year_of(date_str) is None:
+            key = None
+        elif partition_by == 'month':
+            key = date_str[:7]
+        else:
+            key = fiscal_year_of(date_str)
+        partitions.setdefault(key, []).append(position)
+    return partitions
+
+
+def _share_orders(orders):
+    """Pool initializer of forked workers: keep the inherited order list"""
+    global _shared_orders
+    _shared_orders = orders
+
+
+def _aggregate_shared(positions, rules):
+    """Worker entry point for forked workers: aggregate positions of the inherited order list"""
+    return aggregate_partition(_shared_orders, positions, rules)
+
+
+def _aggregate_slice(orders, rules):
+    """Worker entry point without fork: the partition's orders are sent to the worker"""
+    return aggregate_partition(orders, range(len(orders)), rules)
+
+
+def aggregate_partitions(orders, partitions, rules, workers=None):
+    """Aggregate each partition into a partial, in parallel when there is more than one worker
+
+    Returns {partition key: partial}.
+    """
+    workers = workers or APP_CONFIG.get('aggregation_workers') or os.cpu_count() or 1
+    workers = min(workers, len(partitions))
+    if workers <= 1:
+        return {key: aggregate_partition(orders, positions, rules) for key, positions in partitions.items()}
+
+    start_methods = multiprocessing.get_all_start_methods()
+    if 'fork' in start_methods and threading.active_count() == 1:
+        # The initializer's arguments are inherited by the forked workers, not pickled; each pool gets its own
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'),
+                                 initializer=_share_orders, initargs=(orders,)) as pool:
+            futures = {key: pool.submit(_aggregate_shared, positions, rules) for key, positions in partitions.items()}
+            return {key: future.result() for key, future in futures.items()}
+
+    if 'forkserver' in start_methods:
+        context = multiprocessing.get_context('forkserver')
+        # The fork server imports this module once; workers forked from it start without importing it again
+        context.set_forkserver_preload([__name__])
+    else:
+        context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {
+            key: pool.submit(_aggregate_slice, [orders[p] for p in positions], rules)
+            for key, positions in partitions.items()
+        }
+        partials = {key: future.result() for key, future in futures.items()}
+
+    # Partials built from slices know positions within the slice; map them back to store positions
+    for key, partial in partials.items():
+        positions = partitions[key]
+        for norm, (position, name) in partial['product_names'].items():
+            partial['product_names'][norm] = (positions[position], name)
+        for user in partial['users'].values():
+            user['first_position'] = positions[user['first_position']]
+    return partials
+
+
+def run_partial(orders, rules, partition_by='fiscal_year', workers=None):
+    """Aggregate every order into one merged partial (not finalized): partition, aggregate in parallel and merge"""
+    partitions = partition_orders(orders, partition_by)
+    partials = aggregate_partitions(orders, partitions, rules, workers)
+    return merge_partials(partials.values())
+
+
+def run_aggregation(orders, rules, partition_by='fiscal_year', workers=None):
+    """Recompute the full aggregate store: partition, aggregate in parallel, merge and finalize"""
+    return finalize_aggregates(run_partial(orders, rules, partition_by, workers), rules)
@@ -0,0 +1,320 @@
+"""
+Streaming anomaly alerts for WooCommerce Dashboard
+
+Every store write (a dashboard sync or a webhook flush, see shards.py)
+passes the orders it applied, and the versions they replace, to
+check_alerts. Each order contributes to a few signals:
+
+    revenue:<course>   cents of completed line items of the course
+    refunds:<course>   refunded cents, split over the order's items
+    orders:<status>    orders entering the status
+
+and an applied order adds what its new version contributes beyond its
+previous one (a pending order that completes adds its revenue, an order
+refunded adds the refund), at the time it changed: date_created for a new
+order, date_modified for a changed one. Amounts are summed per period of
+ALERT_CONFIG['bucket_hours']; a period is closed once it is grace_hours
+old, and its value is compared with the signal's exponentially weighted
+mean and variance (EWMA over `span` periods) before being folded into
+them. Periods without any order count as zero.
+
+Only falls are alerted for revenue and completed orders (revenue drop,
+order-rate drop), only rises for refunds and the other statuses (refund
+surge, a spike of failed or cancelled orders), once a signal has seen
+min_periods periods and is `threshold` deviations away from its mean.
+
+The state (Woo.alerts.state.json) holds the mean, variance and open periods
+of each signal: its size depends on the number of courses and statuses, not
+on the orders, and the history is never scanned again. When there is no
+state yet it is seeded once from the orders of the last 4 * span periods,
+without alerting. Alerts are appended to Woo.alerts.jsonl with the state
+and, if ALERT_CONFIG['webhook_url'] is set, POSTed there as JSON by the
+writer once it has released the store lock (send_alerts), so a slow webhook
+never holds up other writes; a failing webhook is reported and never fails
+the write.
+
+Usage:
+    python alerts.py            # signals with their expected value per period, and the latest alerts
+"""
+import json
+import math
+import os
+import sys
+from datetime import datetime, timedelta
+import requests
+from config import ALERT_CONFIG, DATA_FILES
+from models import Order
+from aggregates import parse_order_date, to_cents
+from refunds import split_cents
+
+STATE_FORMAT = 1
+
+# Deviations are measured against at least this much spread, so a quiet signal doesn't alert on a single order:
+# a tenth of the mean, and one order or ten dollars
+RELATIVE_DEVIATION_FLOOR = 0.1
+ABSOLUTE_DEVIATION_FLOOR = {'orders': 1.0, 'revenue': 1000.0, 'refunds': 1000.0}
+
+# Alert raised by a signal kind (statuses other than 'completed' alert on rises)
+ALERT_TYPES = {
+    'revenue': ('revenue_drop', -1),
+    'refunds': ('refund_surge', 1),
+    'orders:completed': ('order_rate_drop', -1),
+    'orders': ('order_rate_spike', 1)
+}
+
+
+def order_signals(order, rules):
+    """{signal: amount} an Order record contributes in its current state"""
+    signals = {f"orders:{order.status}": 1}
+    if order.total is None:
+        return signals
+    items = [item for item in order.line_items if item.total is not None]
+    if order.status == 'completed':
+        for item in items:
+            key = f"revenue:{rules.course(item.name)}"
+            signals[key] = signals.get(key, 0) + to_cents(item.total)
+    if order.refunded and items:
+        shares = split_cents(order.refunded, [max(0, to_cents(item.total)) for item in items])
+        for item, share in zip(items, shares):
+            key = f"refunds:{rules.course(item.name)}"
+            signals[key] = signals.get(key, 0) + share
+    return signals
+
+
+def period_of(date_str, bucket_hours):
+    """Index of the period holding an order date ('' or unparseable dates give None)"""
+    try:
+        moment = parse_order_date(date_str)
+    except (TypeError, ValueError):
+        return None
+    return int((moment - datetime(1970, 1, 1)).total_seconds() // (bucket_hours * 3600))
+
+
+def period_start(period, bucket_hours):
+    """Start of a period, as an order date string"""
+    return (datetime(1970, 1, 1) + timedelta(hours=period * bucket_hours)).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def new_state(closed_through, config):
+    """An empty detector state whose periods are closed through closed_through"""
+    return {'format': STATE_FORMAT, 'bucket_hours': config['bucket_hours'], 'closed_through': closed_through,
+            'signals': {}}
+
+
+def load_state(config=None):
+    """The detector state, or None if there is none (or it was kept with another period length)"""
+    config = config or ALERT_CONFIG
+    try:
+        with open(DATA_FILES['alert_state'], "r") as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if state.get('format') != STATE_FORMAT or state.get('bucket_hours') != config['bucket_hours']:
+        return None
+    return state
+
+
+def save_state(state):
+    """Persist the detector state"""
+    path = DATA_FILES['alert_state']
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def add_signals(state, period, signals):
+    """Add signal amounts to an open period (periods already closed go to the oldest open one)"""
+    period = max(period, state['closed_through'] + 1)
+    for key, amount in signals.items():
+        signal = state['signals'].setdefault(key, {'mean': 0.0, 'var': 0.0, 'periods': 0, 'open': {}})
+        signal['open'][str(period)] = signal['open'].get(str(period), 0) + amount
+
+
+def observe(state, previous_orders, applied_orders, rules, config=None):
+    """Add what the applied raw orders changed, relative to their previous versions, to the open periods"""
+    config = config or ALERT_CONFIG
+    previous = {order['id']: Order.from_dict(order) for order in previous_orders or () if isinstance(order, dict)}
+    for raw in applied_orders:
+        if not isinstance(raw, dict):
+            continue
+        order = Order.from_dict(raw)
+        signals = order_signals(order, rules)
+        old = previous.get(order.id)
+        if old is None:
+            period = period_of(order.date_created, config['bucket_hours'])
+        else:
+            period = period_of(raw.get('date_modified') or order.date_created, config['bucket_hours'])
+            for key, amount in order_signals(old, rules).items():
+                signals[key] = signals.get(key, 0) - amount
+            # Only what the change added counts (a completed order refunded adds a refund, not negative revenue)
+            signals = {key: amount for key, amount in signals.items() if amount > 0}
+        if period is not None and signals:
+            add_signals(state, period, signals)
+
+
+def deviation(signal, key):
+    """Spread a period of the signal is measured against"""
+    kind = key.split(':', 1)[0]
+    return max(math.sqrt(signal['var']), RELATIVE_DEVIATION_FLOOR * signal['mean'], ABSOLUTE_DEVIATION_FLOOR[kind])
+
+
+def deviation_score(signal, key, value):
+    """Deviations of a period's value from the signal's mean
+
+    Order counts are skewed when they are small (ten failed orders on a day
+    that usually has three is less rare than the normal curve says), so
+    they are compared on a square-root scale, where counts spread evenly.
+    """
+    if key.split(':', 1)[0] == 'orders':
+        score = 2 * (math.sqrt(value + 0.375) - math.sqrt(signal['mean'] + 0.125))
+        # Counts spread wider than that (var above mean) are scaled down accordingly
+        return score * min(1.0, math.sqrt(signal['mean'] / signal['var'])) if signal['var'] > 0 else score
+    return (value - signal['mean']) / deviation(signal, key)
+
+
+def check_period(key, signal, value, period, config):
+    """The alert a closed period's value raises for a signal, or None"""
+    if signal['periods'] < config['min_periods']:
+        return None
+    kind = key.split(':', 1)[0]
+    alert_type, direction = ALERT_TYPES.get(key) or ALERT_TYPES[kind]
+    score = deviation_score(signal, key, value)
+    if score * direction < config['threshold']:
+        return None
+    name = key.split(':', 1)[1]
+    money = kind != 'orders'
+    shown = (lambda amount: f"${amount / 100:,.2f}") if money else (lambda amount: f"{amount:,.0f}")
+    label = {'revenue': f"{name} revenue", 'refunds': f"{name} refunds"}.get(kind, f"{name} orders")
+    return {
+        'type': alert_type,
+        'signal': key,
+        'period_start': period_start(period, config['bucket_hours']),
+        'period_hours': config['bucket_hours'],
+        'value': value / 100 if money else value,
+        'expected': round(signal['mean'] / 100 if money else signal['mean'], 2),
+        'score': round(score, 2),
+        'message': f"{label}: {shown(value)} in the {config['bucket_hours']}h from "
+                   f"{period_start(period, config['bucket_hours']).replace('T', ' ')}, "
+                   f"expected about {shown(signal['mean'])} ({score:+.1f} deviations)"
+    }
+
+
+def close_periods(state, now=None, alert=True, config=None):
+    """Close the periods that ended grace_hours before now; returns the alerts they raised
+
+    Each closed period is checked against every signal's mean and variance,
+    then folded into them (a period without orders counts as zero).
+    """
+    config = config or ALERT_CONFIG
+    now = now or datetime.now()
+    last = period_of(now.strftime("%Y-%m-%dT%H:%M:%S"), config['bucket_hours']) - 1
+    last -= int(math.ceil(config['grace_hours'] / config['bucket_hours']))
+    alpha = 2.0 / (config['span'] + 1)
+    alerts = []
+    for period in range(state['closed_through'] + 1, last + 1):
+        for key, signal in state['signals'].items():
+            value = signal['open'].pop(str(period), 0)
+            if alert:
+                raised = check_period(key, signal, value, period, config)
+                if raised is not None:
+                    alerts.append(raised)
+            # Exponentially weighted mean and variance
+            difference = value - signal['mean']
+            increment = alpha * difference
+            signal['mean'] += increment
+            signal['var'] = (1 - alpha) * (signal['var'] + difference * increment)
+            signal['periods'] += 1
+    state['closed_through'] = max(state['closed_through'], last)
+    return alerts
+
+
+def seed_state(records, rules, now=None, config=None):
+    """A state warmed up on the Order records created in the last 4 * span periods (no alerts are raised)"""
+    config = config or ALERT_CONFIG
+    now = now or datetime.now()
+    first = period_of(now.strftime("%Y-%m-%dT%H:%M:%S"), config['bucket_hours']) - 4 * config['span']
+    state = new_state(first - 1, config)
+    for order in records:
+        period = period_of(order.date_created, config['bucket_hours'])
+        if period is not None and period >= first:
+            add_signals(state, period, order_signals(order, rules))
+    close_periods(state, now, alert=False, config=config)
+    return state
+
+
+def log_alerts(alerts):
+    """Append alerts to the alert log"""
+    raised_at = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    with open(DATA_FILES['alert_log'], "a") as f:
+        for alert in alerts:
+            f.write(json.dumps(dict(alert, raised_at=raised_at)) + "\n")
+
+
+def send_alerts(alerts, config=None):
+    """POST alerts to the webhook, if one is configured (call after releasing store_lock: it may block for seconds)"""
+    config = config or ALERT_CONFIG
+    if alerts and config['webhook_url']:
+        try:
+            response = requests.post(config['webhook_url'], json={'alerts': alerts}, timeout=10)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            print(f"Alert webhook failed: {e}", file=sys.stderr)
+
+
+def check_alerts(previous_orders, applied_orders, records, rules, now=None):
+    """Run the detector over a store write; returns the alerts raised
+
+    Call under store_lock. previous_orders and applied_orders are the raw
+    orders the write replaces and applies (applied_orders is None for a
+    full write, which only closes periods). records is called only when
+    there is no state yet, and returns the Order records to seed it from.
+    The alerts are logged here; pass them to send_alerts once the lock is
+    released.
+    """
+    if not ALERT_CONFIG['enabled']:
+        return []
+    state = load_state()
+    if state is None:
+        save_state(seed_state(records(), rules, now))
+        return []
+    if applied_orders is not None:
+        observe(state, previous_orders, applied_orders, rules)
+    alerts = close_periods(state, now)
+    save_state(state)
+    if alerts:
+        log_alerts(alerts)
+    return alerts
+
+
+def latest_alerts(count=20):
+    """The last alerts of the alert log, oldest first"""
+    try:
+        with open(DATA_FILES['alert_log'], "r") as f:
+            lines = f.readlines()[-count:]
+    except FileNotFoundError:
+        return []
+    return [json.loads(line) for line in lines if line.strip()]
+
+
+def main():
+    state = load_state()
+    if state is None:
+        print("No alert state yet: it is seeded on the next store write")
+    else:
+        print(f"Periods of {state['bucket_hours']}h closed up to "
+              f"{period_start(state['closed_through'] + 1, state['bucket_hours']).replace('T', ' ')}")
+        for key, signal in sorted(state['signals'].items()):
+            kind = key.split(':', 1)[0]
+            scale = 1 if kind == 'orders' else 100
+            print(f"  {key:<45} expected {signal['mean'] / scale:>12,.2f} ± {deviation(signal, key) / scale:>10,.2f}"
+                  f"  ({signal['periods']} periods)")
+    alerts = latest_alerts()
+    print(f"{len(alerts)} latest alerts:" if alerts else "No alerts raised")
+    for alert in alerts:
+        print(f"  [{alert['raised_at']}] {alert['type']}: {alert['message']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
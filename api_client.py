@@ -0,0 +1,177 @@
+"""
+WooCommerce REST API client shared by the syncs
+
+Every sync (orders, subscriptions) talks to the store the same way: one
+authenticated requests session that retries server errors, an adaptive
+rate limiter (rate_limiter.py) pacing every request, throttled responses
+retried after Retry-After, and pages fetched by offset with up to the
+limiter's concurrency in flight. iter_pages yields the pages in offset
+order, so callers can stage or merge them as they arrive; iter_responses
+does the same for many single-page endpoints (one per order).
+"""
+import base64
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from config import WOOCOMMERCE_CONFIG, APP_CONFIG
+from rate_limiter import AdaptiveRateLimiter, THROTTLE_STATUSES, parse_retry_after
+
+
+class ApiError(Exception):
+    """A non-200 response from the WooCommerce API"""
+
+    def __init__(self, status_code, text):
+        super().__init__(f"Status code {status_code} - {text}")
+        self.status_code = status_code
+        self.text = text
+
+
+def api_url(endpoint, config=None):
+    """Full URL of a wc/v3 REST endpoint (e.g. 'orders', 'subscriptions')"""
+    config = config or WOOCOMMERCE_CONFIG
+    return f"{config['base_url']}/wp-json/wc/v3/{endpoint}"
+
+
+def auth_headers(config=None):
+    """Basic-auth headers for the WooCommerce REST API"""
+    config = config or WOOCOMMERCE_CONFIG
+    credentials = f"{config['consumer_key']}:{config['consumer_secret']}"
+    encoded_credentials = base64.b64encode(credentials.encode()).decode()
+    return {
+        "Authorization": f"Basic {encoded_credentials}",
+        "Content-Type": "application/json",
+        "User-Agent": "curl/8.7.1"
+    }
+
+
+def create_session():
+    """Session with connection pooling for the sync's concurrency and retries of server errors"""
+    # Configure retry strategy (429/503 and Retry-After are left to the adaptive limiter)
+    retry_strategy = Retry(
+        total=3,
+        backoff_factor=1,
+        status_forcelist=[500, 502, 504],
+        respect_retry_after_header=False,
+    )
+
+    session = requests.Session()
+    adapter = HTTPAdapter(max_retries=retry_strategy, pool_maxsize=APP_CONFIG['api_max_concurrency'])
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def create_limiter():
+    """Adaptive rate limiter configured from APP_CONFIG"""
+    # Paces requests and tunes concurrency and page size from latency and errors
+    return AdaptiveRateLimiter(
+        rate=APP_CONFIG['api_rate'],
+        max_rate=APP_CONFIG['api_max_rate'],
+        max_concurrency=APP_CONFIG['api_max_concurrency'],
+        per_page=APP_CONFIG.get('api_per_page', 100),
+        min_per_page=APP_CONFIG['api_min_per_page'],
+        target_latency=APP_CONFIG['api_target_latency']
+    )
+
+
+def fetch_page(session, limiter, url, headers, params, offset, per_page):
+    """Fetch one page through the limiter, retrying throttled responses (runs in a worker thread)"""
+    page_params = dict(params, offset=offset, per_page=per_page)
+    for attempt in range(APP_CONFIG['api_throttle_retries'] + 1):
+        limiter.acquire()
+        sent = time.monotonic()
+        try:
+            response = session.get(url, headers=headers, params=page_params, timeout=APP_CONFIG['api_timeout'])
+        except requests.exceptions.RequestException:
+            limiter.record(time.monotonic() - sent, failed=True)
+            raise
+        limiter.record(time.monotonic() - sent, response.status_code,
+                       parse_retry_after(response.headers.get('Retry-After')))
+        if response.status_code not in THROTTLE_STATUSES:
+            break
+    return response
+
+
+def iter_pages(session, limiter, url, headers, params, offset=0, total_estimate=None):
+    """Yield (items, total estimate) for consecutive pages from offset until the last page
+
+    Until the total is known (X-WP-Total) one request is in flight; after
+    that up to the limiter's concurrency, never starting past the expected
+    end. Pages are yielded in offset order. Changes the caller makes to
+    params between pages (such as a snapshot filter) apply to requests
+    started afterwards. Raises requests exceptions, or ApiError for a
+    non-200 response.
+    """
+    pool = ThreadPoolExecutor(max_workers=limiter.max_concurrency)
+    try:
+        # Pages in flight, oldest offset first: (page size, future)
+        in_flight = deque()
+        next_offset = offset
+        while True:
+            max_in_flight = limiter.concurrency if total_estimate else 1
+            while len(in_flight) < max_in_flight and (not in_flight or next_offset < total_estimate):
+                per_page = limiter.per_page
+                in_flight.append((per_page, pool.submit(fetch_page, session, limiter, url, headers, dict(params), next_offset, per_page)))
+                next_offset += per_page
+
+            per_page, future = in_flight.popleft()
+            response = future.result()
+            if response.status_code != 200:
+                raise ApiError(response.status_code, response.text[:200])
+
+            # Try to get total count from headers (if available)
+            if total_estimate is None:
+                try:
+                    total_estimate = int(response.headers.get('X-WP-Total'))
+                except (TypeError, ValueError):
+                    total_estimate = None
+
+            items = response.json()
+            if not items:
+                return
+            yield items, total_estimate
+            if len(items) < per_page:
+                return
+    finally:
+        # Don't wait for requests still in flight after an error
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_responses(session, limiter, urls, headers, params=None):
+    """Yield (url, response) for each URL's first page, with up to the limiter's concurrency in flight
+
+    Used for per-order endpoints (such as refunds) where each URL is one
+    small request. Responses are yielded in the order of urls; non-200
+    responses are yielded too, for the caller to handle.
+    """
+    params = params or {}
+    pool = ThreadPoolExecutor(max_workers=limiter.max_concurrency)
+    try:
+        in_flight = deque()
+        pending = iter(urls)
+        while True:
+            while len(in_flight) < limiter.concurrency:
+                url = next(pending, None)
+                if url is None:
+                    break
+                in_flight.append((url, pool.submit(fetch_page, session, limiter, url, headers, params, 0, limiter.max_per_page)))
+            if not in_flight:
+                return
+            url, future = in_flight.popleft()
+            yield url, future.result()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def request_error_message(error, hint=""):
+    """User-facing message for a failed sync request"""
+    if isinstance(error, requests.exceptions.Timeout):
+        return f"Request timed out after {APP_CONFIG['api_timeout']} seconds. The server is taking too long to respond.{hint}"
+    if isinstance(error, requests.exceptions.ConnectionError):
+        return f"Connection error. Please check your internet connection and try again.{hint}"
+    if isinstance(error, ApiError):
+        return f"API Error: Status code {error.status_code} - {error.text}{hint}"
+    return f"Network error: {str(error)}{hint}"
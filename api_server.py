@@ -0,0 +1,192 @@
+"""
+Read-only JSON API over the aggregate store
+
+Serves the same numbers as the dashboard (fiscal-year course and product
+metrics, monthly sales, top users, status counts, daily revenue) to other
+internal tools:
+
+    python api_server.py    # listens on API_HOST:API_PORT (default 127.0.0.1:5002)
+
+Nothing is computed per request. The aggregates saved at sync time are
+loaded once per data version, and each response body is serialized and
+gzipped once and then reused until the data version changes. Responses
+carry a strong ETag made of the data version and a hash of the body, and
+Cache-Control: no-cache, so clients revalidate with If-None-Match and get
+an empty 304 while the data hasn't changed.
+"""
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from flask import Flask, Response, request, jsonify
+from config import API_CONFIG
+from order_store import get_data_version, load_store_meta
+from aggregates import load_aggregates, save_aggregates
+from shards import merged_aggregates
+from product_rules import current_rules
+
+USER_RANKINGS = {
+    'lifetime_value': 'net_revenue',
+    'months': 'subscription_months',
+    'orders': 'order_count'
+}
+
+MAX_USERS_LIMIT = 1000
+
+
+class MaterializedResponse:
+    """A response body serialized once, with its gzipped form, ETag and the data version it was built from"""
+    __slots__ = ('body', 'gzipped', 'etag', 'data_version')
+
+    def __init__(self, data, data_version):
+        self.data_version = data_version
+        self.body = json.dumps(data, separators=(',', ':')).encode()
+        self.gzipped = gzip.compress(self.body, compresslevel=6)
+        self.etag = f"{data_version}-{hashlib.sha256(self.body).hexdigest()[:20]}"
+
+
+class ResponseCache:
+    """Aggregates and materialized responses for the current data version (thread safe)"""
+
+    def __init__(self, max_responses):
+        self.max_responses = max_responses
+        self.data_version = None
+        self.aggregates = None
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        """Load the aggregates when the store's data version has moved on (called with the lock held)"""
+        data_version = get_data_version()
+        if data_version == self.data_version:
+            return
+        aggregates = load_aggregates(data_version)
+        if aggregates is None:
+            # Saved aggregates are missing or stale: build them once for this version
+            aggregates = merged_aggregates()
+            save_aggregates(aggregates, data_version)
+        self.data_version = data_version
+        self.aggregates = aggregates
+        self._responses.clear()
+
+    def get(self, key, build):
+        """Return the materialized response for key, calling build(aggregates) only on a miss"""
+        with self._lock:
+            self._refresh()
+            response = self._responses.get(key)
+            if response is None:
+                response = MaterializedResponse(build(self.aggregates), self.data_version)
+                self._responses[key] = response
+                # Keep the number of distinct query variants bounded
+                if len(self._responses) > self.max_responses:
+                    self._responses.popitem(last=False)
+            else:
+                self._responses.move_to_end(key)
+            return response
+
+
+def fiscal_year_arg():
+    """The optional ?fiscal_year= argument as an int, None when absent, or False when malformed"""
+    value = request.args.get('fiscal_year')
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return False
+
+
+def create_app(cache=None):
+    """Flask app serving the materialized aggregates"""
+    cache = cache or ResponseCache(API_CONFIG['cached_responses'])
+    app = Flask(__name__)
+
+    def send(key, build):
+        """Serve a cached response, gzipped when the client accepts it, honouring If-None-Match"""
+        materialized = cache.get(key, build)
+        use_gzip = request.accept_encodings['gzip'] > 0
+        response = Response(materialized.gzipped if use_gzip else materialized.body, mimetype='application/json')
+        # A strong ETag names exact bytes, so the gzipped variant gets its own
+        response.set_etag(f"{materialized.etag}-gzip" if use_gzip else materialized.etag)
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Data-Version'] = str(materialized.data_version)
+        return response.make_conditional(request)
+
+    def per_fiscal_year(section):
+        fiscal_year = fiscal_year_arg()
+        if fiscal_year is False:
+            return jsonify({'error': 'fiscal_year must be a year, e.g. 2025'}), 400
+        if fiscal_year is None:
+            return send((section,), lambda aggregates: aggregates[section])
+
+        def build(aggregates):
+            return {'fiscal_year': fiscal_year, section: aggregates[section].get(fiscal_year, {})}
+        return send((section, fiscal_year), build)
+
+    @app.get("/api/v1/meta")
+    def meta():
+        # The courses come from the applied product rules, which can change without a new data version
+        rules = current_rules()
+
+        def build(aggregates):
+            store_meta = load_store_meta()
+            return {
+                # build runs under the cache's lock, for the version being materialized
+                'data_version': cache.data_version,
+                'updated_at': store_meta.get('updated_at'),
+                'rules_version': rules.version,
+                'courses': rules.courses,
+                'fiscal_years': sorted(aggregates['course_metrics'])
+            }
+        return send(('meta', rules.version), build)
+
+    @app.get("/api/v1/course-metrics")
+    def course_metrics():
+        return per_fiscal_year('course_metrics')
+
+    @app.get("/api/v1/product-metrics")
+    def product_metrics():
+        return per_fiscal_year('product_metrics')
+
+    @app.get("/api/v1/monthly-sales")
+    def monthly_sales():
+        return send(('monthly_products',), lambda aggregates: aggregates['monthly_products'])
+
+    @app.get("/api/v1/status-counts")
+    def status_counts():
+        return send(('status_counts',), lambda aggregates: aggregates['status_counts'])
+
+    @app.get("/api/v1/daily-revenue")
+    def daily_revenue():
+        def build(aggregates):
+            return [
+                {'date': day, 'course': course, 'revenue': revenue, 'order_count': count, 'refunded': refunded}
+                for day, course, revenue, count, refunded in aggregates['daily_course_revenue']
+            ]
+        return send(('daily_course_revenue',), build)
+
+    @app.get("/api/v1/users/top")
+    def top_users():
+        by = request.args.get('by', 'lifetime_value')
+        if by not in USER_RANKINGS:
+            return jsonify({'error': f"by must be one of {', '.join(USER_RANKINGS)}"}), 400
+        try:
+            limit = min(max(int(request.args.get('limit', 20)), 1), MAX_USERS_LIMIT)
+        except ValueError:
+            return jsonify({'error': 'limit must be a number'}), 400
+
+        def build(aggregates):
+            field = USER_RANKINGS[by]
+            ranked = sorted(aggregates['users'].items(), key=lambda x: x[1][field], reverse=True)[:limit]
+            return [dict(user, customer_id=customer_id) for customer_id, user in ranked]
+        return send(('users', by, limit), build)
+
+    return app
+
+
+if __name__ == "__main__":
+    create_app().run(host=API_CONFIG['host'], port=API_CONFIG['port'], threaded=True)
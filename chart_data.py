@@ -0,0 +1,82 @@
+"""
+Chart data for WooCommerce Dashboard
+
+Turns the aggregate store into small, pre-bucketed frames for Plotly. The
+bucket size (day/week/month/quarter/year) is picked from the selected date
+range so that no series ever has more than APP_CONFIG['chart_max_points']
+points, however much history the store holds.
+"""
+import pandas as pd
+from config import APP_CONFIG
+
+# (pandas period frequency, label, approximate bucket length in days), smallest first
+BUCKETS = [
+    ('D', 'Daily', 1),
+    ('W', 'Weekly', 7),
+    ('M', 'Monthly', 30.44),
+    ('Q', 'Quarterly', 91.31),
+    ('Y', 'Yearly', 365.25)
+]
+
+
+def daily_revenue_frame(aggregates):
+    """Build the daily revenue per course frame from the aggregate store (gross, refunded and net revenue)"""
+    frame = pd.DataFrame(aggregates['daily_course_revenue'], columns=['Date', 'Course', 'Revenue', 'Orders', 'Refunded'])
+    frame['Date'] = pd.to_datetime(frame['Date'])
+    frame['Net Revenue'] = frame['Revenue'] - frame['Refunded']
+    return frame
+
+
+def choose_bucket(start, end, max_points=None):
+    """Return the smallest bucket (frequency, label) that keeps the range within max_points buckets"""
+    max_points = max_points or APP_CONFIG['chart_max_points']
+    days = max((pd.Timestamp(end) - pd.Timestamp(start)).days + 1, 1)
+    for freq, label, bucket_days in BUCKETS:
+        if days / bucket_days <= max_points:
+            return freq, label
+    return BUCKETS[-1][0], BUCKETS[-1][1]
+
+
+def revenue_series(daily_frame, start=None, end=None, courses=None, freq=None):
+    """Return revenue, refunds and order counts per course per bucket between start and end (inclusive)
+
+    Returns (frame, bucket label); the frame has one row per (Period, Course) with empty buckets filled with zero.
+    An explicit freq finer than the range allows (more than chart_max_points buckets) is coarsened to the
+    smallest bucket that does, so the series stay bounded whichever bucket is asked for.
+    """
+    frame = daily_frame
+    if courses:
+        frame = frame[frame['Course'].isin(courses)]
+    if start is not None:
+        frame = frame[frame['Date'] >= pd.Timestamp(start)]
+    if end is not None:
+        frame = frame[frame['Date'] <= pd.Timestamp(end)]
+    if frame.empty:
+        return frame.rename(columns={'Date': 'Period'}), None
+
+    freqs = [bucket_freq for bucket_freq, _, _ in BUCKETS]
+    auto_freq, label = choose_bucket(frame['Date'].min(), frame['Date'].max())
+    if freq is None or freqs.index(freq) < freqs.index(auto_freq):
+        freq = auto_freq
+    else:
+        label = BUCKETS[freqs.index(freq)][1]
+
+    periods = frame['Date'].dt.to_period(freq)
+    grouped = frame.groupby([periods, 'Course'])[['Revenue', 'Orders', 'Refunded', 'Net Revenue']].sum()
+
+    # Fill empty buckets so lines drop to zero instead of interpolating across gaps
+    all_periods = pd.period_range(periods.min(), periods.max(), freq=freq)
+    grouped = grouped.reindex(
+        pd.MultiIndex.from_product([all_periods, grouped.index.get_level_values('Course').unique()], names=['Period', 'Course']),
+        fill_value=0
+    ).reset_index()
+    grouped['Period'] = grouped['Period'].dt.start_time
+    return grouped, label
+
+
+def status_counts_frame(aggregates):
+    """Return the order status counts from the aggregate store as a frame for the status pie"""
+    return pd.DataFrame(
+        sorted(aggregates['status_counts'].items(), key=lambda x: x[1], reverse=True),
+        columns=['Status', 'Count']
+    )
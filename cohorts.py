@@ -0,0 +1,136 @@
+"""
+Customer cohorts for WooCommerce Dashboard
+
+Customers are grouped per course by acquisition month (the month of their
+first completed order containing the course). For every cohort and every
+month since acquisition the matrices hold how many of the cohort's customers
+ordered the course again that month (and what share of the cohort that is)
+and the course revenue they brought in.
+
+The orders are reduced to a compact table once per data version: one row
+per (completed order, course) with the customer, the month as a month
+number and the course's line-item revenue in cents. The matrices are then
+built from that table with NumPy (np.unique and np.bincount over encoded
+cohort/age cells), without a Python loop over customers or orders.
+Only registered customers are included, as on the Users page; courses are
+matched like the revenue trends (by the product rules' course).
+"""
+import numpy as np
+import pandas as pd
+from aggregates import to_cents
+
+
+def month_number(date_str):
+    """Months since year 0 of a WooCommerce date string ('YYYY-MM...'), or None if it isn't a date"""
+    try:
+        year, month = int(date_str[:4]), int(date_str[5:7])
+    except (TypeError, ValueError):
+        return None
+    if not 1 <= month <= 12:
+        return None
+    return year * 12 + month - 1
+
+
+def month_label(number):
+    """'YYYY-MM' label of a month number"""
+    return f"{number // 12:04d}-{number % 12 + 1:02d}"
+
+
+def build_course_order_table(orders, rules):
+    """Reduce completed orders of registered customers to arrays: customer, month, course, cents
+
+    Returns a dict of equal-length NumPy arrays with one entry per (order, course);
+    'course' indexes into the rules' courses (items of other products are left out).
+    """
+    course_codes = {course: code for code, course in enumerate(rules.courses)}
+    customers, months, codes, cents = [], [], [], []
+    for order in orders:
+        if order.status != 'completed' or order.total is None or not order.customer_id:
+            continue
+        month = month_number(order.date_created)
+        if month is None:
+            continue
+        order_cents = {}
+        for item in order.line_items:
+            code = course_codes.get(rules.course(item.name))
+            if code is None:
+                continue
+            order_cents[code] = order_cents.get(code, 0) + (0 if item.total is None else to_cents(item.total))
+        for code, item_cents in order_cents.items():
+            customers.append(order.customer_id)
+            months.append(month)
+            codes.append(code)
+            cents.append(item_cents)
+
+    return {
+        'customer': np.array(customers, dtype=np.int64),
+        'month': np.array(months, dtype=np.int32),
+        'course': np.array(codes, dtype=np.int32),
+        'cents': np.array(cents, dtype=np.int64)
+    }
+
+
+def cohort_matrices(table, course_code):
+    """Cohort x months-since-acquisition matrices for one course
+
+    Returns None if the course has no orders, else a dict with 'cohorts'
+    (acquisition month labels), 'sizes' (customers per cohort), 'active'
+    (customers ordering in each month since acquisition), 'retention'
+    (active / size) and 'revenue' (dollars). Cells after the last month in
+    the data are NaN in 'retention' and 'revenue'.
+    """
+    selected = table['course'] == course_code
+    if not selected.any():
+        return None
+    customers = table['customer'][selected]
+    months = table['month'][selected]
+    cents = table['cents'][selected]
+
+    # Acquisition month per customer: the minimum month over the customer's rows
+    customer_ids, customer_rows = np.unique(customers, return_inverse=True)
+    first_month = np.full(len(customer_ids), np.iinfo(np.int32).max, dtype=np.int32)
+    np.minimum.at(first_month, customer_rows, months)
+
+    first, last = int(first_month.min()), int(months.max())
+    n_cohorts = n_ages = last - first + 1
+    cohort = first_month[customer_rows] - first
+    age = months - first_month[customer_rows]
+    cells = cohort.astype(np.int64) * n_ages + age
+
+    sizes = np.bincount(first_month - first, minlength=n_cohorts)
+    revenue = np.bincount(cells, weights=cents, minlength=n_cohorts * n_ages).reshape(n_cohorts, n_ages) / 100
+    # A customer counts once per month however many orders they placed
+    customer_ages = np.unique(customer_rows.astype(np.int64) * n_ages + age)
+    active_customers, active_ages = customer_ages // n_ages, customer_ages % n_ages
+    active_cells = (first_month[active_customers] - first).astype(np.int64) * n_ages + active_ages
+    active = np.bincount(active_cells, minlength=n_cohorts * n_ages).reshape(n_cohorts, n_ages)
+
+    # Cohort c can only be observed for (n_ages - c) months
+    observed = np.arange(n_ages)[None, :] < (n_ages - np.arange(n_cohorts))[:, None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        retention = np.where(observed, active / sizes[:, None], np.nan)
+    revenue = np.where(observed, revenue, np.nan)
+
+    # Only months in which someone was acquired are cohorts
+    has_customers = sizes > 0
+    return {
+        'cohorts': [month_label(first + c) for c in np.flatnonzero(has_customers)],
+        'sizes': sizes[has_customers],
+        'active': active[has_customers],
+        'retention': retention[has_customers],
+        'revenue': revenue[has_customers]
+    }
+
+
+def build_cohorts(orders, rules):
+    """Cohort matrices for every course ({course: matrices or None})"""
+    table = build_course_order_table(orders, rules)
+    return {course: cohort_matrices(table, code) for code, course in enumerate(rules.courses)}
+
+
+def cohort_frame(matrices, values):
+    """DataFrame of one matrix ('retention', 'revenue' or 'active') with a Cohort and Customers column"""
+    frame = pd.DataFrame(matrices[values], columns=[str(age) for age in range(matrices[values].shape[1])])
+    frame.insert(0, 'Customers', matrices['sizes'])
+    frame.insert(0, 'Cohort', matrices['cohorts'])
+    return frame
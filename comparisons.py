@@ -0,0 +1,93 @@
+"""
+Period-over-period comparisons for WooCommerce Dashboard
+
+The dashboard compares each course's metrics (orders, revenue, and the
+individual/group tiers) for a fiscal year with the previous fiscal year, or
+for a month with the same month a year earlier. Both periods are read from
+the per-month course metrics of the aggregate store (see aggregates.py),
+which is built once per data version: the months of closed fiscal years come
+from their frozen rollups (tiers.py) and only the open years are aggregated
+at sync time. A comparison is a lookup plus a sum over at most twelve months
+per course, never another scan of the orders.
+
+A fiscal year in progress is compared with the same months of the previous
+fiscal year (September through the current month), so that a partial year
+isn't measured against a complete one.
+"""
+from datetime import date, datetime
+from aggregates import fiscal_year_months, COURSE_REVENUE_KEYS
+
+# Dollar amounts in finalized course metrics
+MONEY_KEYS = COURSE_REVENUE_KEYS + ['net_revenue']
+
+
+def sum_course_metrics(metrics_list):
+    """Sum finalized course metrics of several periods (dollar amounts are rounded to cents)"""
+    total = {}
+    for metrics in metrics_list:
+        for key, value in metrics.items():
+            if key == 'group_by_seats':
+                seats = total.setdefault(key, {})
+                for seat_count, orders in value.items():
+                    seats[seat_count] = seats.get(seat_count, 0) + orders
+            else:
+                total[key] = total.get(key, 0) + value
+    for key in MONEY_KEYS:
+        if key in total:
+            total[key] = round(total[key], 2)
+    return total
+
+
+def same_month_last_year(month):
+    """The month ('YYYY-MM') a year before"""
+    return f"{int(month[:4]) - 1}{month[4:]}"
+
+
+def month_label(month, fmt="%B %Y"):
+    """Display label of a month ('YYYY-MM')"""
+    return datetime.strptime(month, "%Y-%m").strftime(fmt)
+
+
+def elapsed_months(fiscal_year, today=None):
+    """Months of a fiscal year up to today's month (all twelve for a past fiscal year, none for a future one)"""
+    months = fiscal_year_months(fiscal_year)
+    current = (today or date.today()).strftime("%Y-%m")
+    return [month for month in months if month <= current]
+
+
+def period_course_metrics(aggregates, months):
+    """{course: metrics} summed over months"""
+    by_course = {}
+    for month in months:
+        for course, metrics in aggregates['course_month_metrics'].get(month, {}).items():
+            by_course.setdefault(course, []).append(metrics)
+    return {course: sum_course_metrics(metrics_list) for course, metrics_list in by_course.items()}
+
+
+def compare_fiscal_years(aggregates, fiscal_year, today=None):
+    """({course: metrics} of a fiscal year, {course: metrics} of the previous one, label of the previous period)
+
+    A fiscal year in progress is compared with the same months of the
+    previous fiscal year.
+    """
+    current = aggregates['course_metrics'].get(fiscal_year, {})
+    months = elapsed_months(fiscal_year, today)
+    if not months or len(months) == 12:
+        return current, aggregates['course_metrics'].get(fiscal_year - 1, {}), f"FY{fiscal_year - 1}"
+    previous_months = [same_month_last_year(month) for month in months]
+    label = f"FY{fiscal_year - 1} through {month_label(previous_months[-1], '%b %Y')}"
+    return current, period_course_metrics(aggregates, previous_months), label
+
+
+def compare_months(aggregates, month):
+    """({course: metrics} of a month, {course: metrics} of the same month last year, label of the previous month)"""
+    previous_month = same_month_last_year(month)
+    return (aggregates['course_month_metrics'].get(month, {}),
+            aggregates['course_month_metrics'].get(previous_month, {}),
+            month_label(previous_month))
+
+
+def growth(current, previous):
+    """(change, growth rate) from previous to current; the rate is None when previous is zero"""
+    change = current - previous
+    return change, (change / previous if previous else None)
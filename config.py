@@ -4,6 +4,7 @@ Configuration file for WooCommerce Dashboard
 from dotenv import load_dotenv
 load_dotenv()
 import os
+import json
 import streamlit as st
 
 # Debug: Print environment variables to check if they are loaded
@@ -36,6 +37,43 @@ WOOCOMMERCE_CONFIG = {
     'consumer_secret': get_secret('WOOCOMMERCE_CONSUMER_SECRET')
 }
 
+# Storefronts synced into the dashboard, each into its own shard of the order store (shards.py).
+# The store above is always the first; more stores come from WOOCOMMERCE_STORES, either [[WOOCOMMERCE_STORES]]
+# tables in secrets.toml or a JSON list in the environment, each with a short file-safe name, base_url,
+# consumer_key and consumer_secret. Add new stores at the end: a store's position keys its order and customer ids.
+_extra_stores = get_secret('WOOCOMMERCE_STORES') or []
+if isinstance(_extra_stores, str):
+    _extra_stores = json.loads(_extra_stores)
+WOOCOMMERCE_STORES = [dict(WOOCOMMERCE_CONFIG, name=get_secret('WOOCOMMERCE_STORE_NAME', 'default'))]
+WOOCOMMERCE_STORES += [dict(store) for store in _extra_stores]
+
+# Webhook receiver (webhook_server.py) for WooCommerce order.created/updated/deleted
+WEBHOOK_CONFIG = {
+    'secret': get_secret('WOOCOMMERCE_WEBHOOK_SECRET'),  # Secret set on the WooCommerce webhooks, used to verify signatures
+    'host': os.getenv('WEBHOOK_HOST', '127.0.0.1'),
+    'port': int(os.getenv('WEBHOOK_PORT', '5001')),
+    'flush_interval': 5.0,  # Seconds between writes of queued events to the store
+    'max_batch': 500  # Queued orders that trigger an immediate write
+}
+
+# Read-only aggregates API (api_server.py)
+API_CONFIG = {
+    'host': os.getenv('API_HOST', '127.0.0.1'),
+    'port': int(os.getenv('API_PORT', '5002')),
+    'cached_responses': 64  # Serialized responses kept per data version (distinct paths/query strings)
+}
+
+# Anomaly alerts (alerts.py), checked over the orders each sync or webhook flush applies
+ALERT_CONFIG = {
+    'enabled': True,
+    'webhook_url': get_secret('ALERT_WEBHOOK_URL'),  # Alerts are POSTed here as JSON, if set (they are always appended to the alert log)
+    'bucket_hours': 24,  # Length of the periods compared (changing it reseeds the detector)
+    'grace_hours': 12,  # A period is checked this long after it ends, so orders synced late still land in it
+    'span': 28,  # Periods the exponentially weighted mean and variance mostly reflect
+    'threshold': 3.0,  # Deviations from the mean that raise an alert
+    'min_periods': 14  # Periods a signal is observed for before it can alert
+}
+
 # Debug Streamlit secrets
 st.sidebar.write("**Debug - Streamlit Secrets:**")
 st.sidebar.write(f"Consumer Key: {'Set' if get_secret('WOOCOMMERCE_CONSUMER_KEY') else 'Not Set'}")
@@ -50,11 +88,41 @@ APP_CONFIG = {
     'cache_ttl': 300,  # 5 minutes
     'items_per_page': 50,
     'api_timeout': 60,  # Increased from 10 to 60 seconds
-    'api_delay': 0.05,  # Reduced delay between API calls (from 0.1 to 0.05)
-    'api_per_page': 100  # WooCommerce API maximum is 100 orders per request
+    'api_per_page': 100,  # WooCommerce API maximum is 100 orders per request (the limiter shrinks pages when responses are slow)
+    'api_min_per_page': 25,  # Smallest page size the adaptive limiter will use
+    'api_rate': 5.0,  # Requests per second the adaptive limiter starts at
+    'api_max_rate': 20.0,  # Requests per second the adaptive limiter never exceeds
+    'api_max_concurrency': 4,  # Most requests the sync keeps in flight at once
+    'api_target_latency': 5.0,  # Seconds; slower responses make the limiter back off
+    'api_throttle_retries': 5,  # Retries of a 429/503 response (after waiting for Retry-After)
+    'chart_max_points': 180,  # Max buckets per series sent to Plotly (bucket size adapts to the date range)
+    'export_chunk_rows': 5000,  # Rows written per chunk when streaming CSV/Parquet exports
+    'aggregation_workers': None,  # Processes for full aggregate rebuilds (None = one per CPU core)
+    'sync_subscriptions': True,  # Also sync the WooCommerce Subscriptions endpoint on every refresh
+    'result_cache_max_mb': 256,  # Size bound of the on-disk result cache (least recently used entries are evicted)
+    'result_cache_warm_up': True,  # Compute every page's cached results right after a refresh
+    'refund_window_days': 120  # Days after a fiscal year ends before it is frozen into the archive (tiers.py; None keeps every year hot)
 }
 
 # Data file paths
 DATA_FILES = {
-    'orders_json': 'Woo.json'
+    'orders_json': 'Woo.json',
+    'store_meta': 'Woo.meta.json',  # Data version, bumped on every store write
+    'search_index': 'Woo.search.json',  # Customer/product search index, rebuilt or updated at sync time
+    'aggregates': 'Woo.aggregates.json',  # Pre-aggregated chart data, rebuilt at sync time
+    'shard_partial': 'Woo.partial.pkl',  # Per-store aggregate partial, merged into the aggregates
+    'result_cache': 'Woo.cache',  # Directory of derived page results kept across restarts (result_cache.py)
+    'archive': 'Woo.archive.json',  # Orders of closed fiscal years, moved out of Woo.json (tiers.py)
+    'rollup': 'Woo.rollup.pkl',  # Aggregate partial per closed fiscal year, built once from the archive
+    # Courses and excluded products (product_rules.py); the rules file ships with the app, the applied copy lives with the store
+    'product_rules': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'product_rules.json'),
+    'applied_rules': 'Woo.rules.json',  # The rules the store is classified with, replaced by `python product_rules.py apply`
+    'recurring_revenue': 'Woo.mrr.json',  # MRR series per course and tier, updated incrementally at sync time
+    'refunds': 'Woo.refunds.json',  # Refunds with their line items, fetched for orders whose refunds changed
+    'subscriptions': 'Woo.subscriptions.json',  # Compact WooCommerce Subscriptions table, synced incrementally
+    'sync_staging': 'Woo.staging',  # Page batches and checkpoint of an unfinished full sync
+    'webhook_journal': 'Woo.webhooks.jsonl',  # Webhook events received but not yet written to the store
+    'alert_state': 'Woo.alerts.state.json',  # Mean, variance and open periods of every alert signal (alerts.py)
+    'alert_log': 'Woo.alerts.jsonl',  # Alerts raised, one JSON object per line
+    'store_lock': 'Woo.lock'  # Lock file serializing store writes between the dashboard and the webhook receiver
 } 
\ No newline at end of file
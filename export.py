@@ -0,0 +1,109 @@
+"""
+Streaming exports for WooCommerce Dashboard
+
+Tables are written chunk by chunk (APP_CONFIG['export_chunk_rows'] rows at a
+time) into a temporary file, and the open file is handed to
+st.download_button. The full export is never held as one Python string, and
+the work only happens when the download button is clicked.
+"""
+import io
+import tempfile
+import pandas as pd
+from config import APP_CONFIG
+
+# Parquet output needs pyarrow; CSV works without it
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+EXPORT_FORMATS = ["CSV", "Parquet"] if PARQUET_AVAILABLE else ["CSV"]
+
+MIME_TYPES = {
+    "CSV": "text/csv",
+    "Parquet": "application/vnd.apache.parquet"
+}
+
+
+def iter_chunks(rows, chunk_rows=None):
+    """Group an iterable of row dicts into DataFrames of at most chunk_rows rows"""
+    chunk_rows = chunk_rows or APP_CONFIG['export_chunk_rows']
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_rows:
+            yield pd.DataFrame(chunk)
+            chunk = []
+    if chunk:
+        yield pd.DataFrame(chunk)
+
+
+def iter_frame_chunks(frame, chunk_rows=None):
+    """Split an existing DataFrame into row chunks"""
+    chunk_rows = chunk_rows or APP_CONFIG['export_chunk_rows']
+    for start in range(0, len(frame), chunk_rows):
+        yield frame.iloc[start:start + chunk_rows]
+
+
+def user_rows(user_data):
+    """Yield one export row per customer from aggregate_users output, highest lifetime value first"""
+    for user_id, user in sorted(user_data.items(), key=lambda x: x[1]['net_revenue'], reverse=True):
+        yield {
+            'Customer ID': user_id,
+            'Customer': user['name'],
+            'Email': user['email'],
+            'First Order': user['first_order_date'],
+            'Last Order': user['last_order_date'],
+            'Months': user['subscription_months'],
+            'Lifetime Value': round(user['net_revenue'], 2),
+            'Refunded': round(user['refunded'], 2),
+            'Orders': user['order_count'],
+            'Subscription Orders': user['subscription_orders'],
+            'New Orders': user['new_orders'],
+            'Guest Orders': user['guest_orders'],
+            'Products': ', '.join(sorted(user['products_purchased']))
+        }
+
+
+def order_rows(orders):
+    """Yield one flat export row per Order record"""
+    for order in orders:
+        yield {
+            'Order #': order.id,
+            'Date': order.date_created,
+            'Status': order.status,
+            'Total': order.total,
+            'Refunded': order.refunded / 100,
+            'Customer ID': order.customer_id,
+            'First Name': order.first_name,
+            'Last Name': order.last_name,
+            'Email': order.email,
+            'Created Via': order.created_via,
+            'Products': ', '.join(item.name for item in order.line_items)
+        }
+
+
+def write_export(chunks, export_format):
+    """Write DataFrame chunks to a temporary file in the given format and return it, rewound, for download"""
+    out = tempfile.TemporaryFile()
+
+    if export_format == "Parquet":
+        writer = None
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(out, table.schema)
+            writer.write_table(table.cast(writer.schema))
+        if writer is not None:
+            writer.close()
+    else:
+        text = io.TextIOWrapper(out, encoding="utf-8", newline="")
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(text, header=(i == 0), index=False)
+        text.flush()
+        text.detach()
+
+    out.seek(0)
+    return out
@@ -0,0 +1,223 @@
+"""
+Concurrent-session load test for WooCommerce Dashboard
+
+Drives simulated sessions through the login page, the Dashboard, Monthly
+Sales and Users with Streamlit's AppTest, all open at once in one process
+like the sessions of one server (so they share st.cache_resource and the
+result cache). AppTest runs one script at a time, so the sessions take
+turns rerun by rerun. The data is a synthetic store written to a scratch
+directory, or an existing data directory.
+
+Reported:
+- p50/p95/max latency of every rerun step, over all sessions (the first
+  session, which fills the shared caches, is reported on its own)
+- the memory each session keeps while it stays open: growth of the
+  process's RSS, and with --tracemalloc of the Python heap, divided by the
+  number of sessions. This is what session state costs on top of the shared
+  caches (a copied order list would show up here and grow with the store)
+- total RSS with every session open
+
+Usage:
+    python load_test.py --sessions 20 --orders 50000
+    python load_test.py --sessions 10 --data-dir /path/to/dashboard   # an existing Woo.json
+"""
+import argparse
+import gc
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "streamlit_app.py")
+
+# Pages visited after logging in, in order; the Dashboard is shown first and revisited last
+PAGES = ["Monthly Sales", "Users", "Dashboard"]
+
+# Product name suffixes of the synthetic store: (suffix, item total)
+TIERS = [(" - Individual - Monthly", 25), (" - Individual - Annual", 250), (" - 10 Seats", 600), (" - 25 Seats", 1200)]
+
+
+def synthetic_orders(count, courses, seed=0):
+    """WooCommerce-shaped order dicts over the last five years (newest first), for the courses and a few excluded products"""
+    rnd = random.Random(seed)
+    products = [(course + suffix, total) for course in courses for suffix, total in TIERS]
+    products += [("Demo Product", 10), ("Aequora", 50)]
+    start = datetime.now() - timedelta(days=5 * 365)
+    orders = []
+    for i in range(count):
+        created = (start + timedelta(seconds=i * 5 * 365 * 86400 // count)).strftime("%Y-%m-%dT%H:%M:%S")
+        customer = rnd.randint(1, max(1, count // 4))
+        items = []
+        for name, total in rnd.sample(products, rnd.choice([1, 1, 1, 2])):
+            items.append({"id": i * 10 + len(items), "name": name, "quantity": 1, "total": f"{total:.2f}"})
+        orders.append({
+            "id": 1000 + i,
+            "status": rnd.choice(["completed"] * 8 + ["refunded", "processing", "cancelled"]),
+            "date_created": created,
+            "date_modified": created,
+            "total": f"{sum(float(item['total']) for item in items):.2f}",
+            "customer_id": 0 if customer % 9 == 0 else customer,
+            "created_via": rnd.choice(["checkout", "subscription"]),
+            "billing": {"first_name": f"First{customer}", "last_name": f"Last{customer}",
+                        "email": f"customer{customer}@example.com"},
+            "line_items": items
+        })
+    orders.reverse()
+    return orders
+
+
+def rss_bytes():
+    """Resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # Peak rather than current RSS where /proc isn't available (kilobytes on Linux, bytes on macOS)
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def session_steps(at, username, password):
+    """The reruns of one session as (step, run) pairs: log in (landing on the Dashboard), then visit PAGES"""
+    yield "Login page", at.run
+    at.text_input[0].input(username)
+    at.text_input[1].input(password)
+    yield "Login → Dashboard", at.button[0].click().run
+    for page in PAGES:
+        navigation = next(box for box in at.sidebar.selectbox if box.label == "Choose a page")
+        yield page, navigation.select(page).run
+
+
+def run_sessions(count, username, password, timeout):
+    """Open count sessions and run their steps round-robin; returns (app tests, [(step, seconds)], [errors])
+
+    AppTest runs one script at a time per process, so the sessions take
+    turns rerun by rerun, all of them open at once as they would be on a
+    server.
+    """
+    # Imported here so config is only loaded once the working directory and secrets are set up
+    from streamlit.testing.v1 import AppTest
+    apps = [AppTest.from_file(APP_PATH, default_timeout=timeout) for _ in range(count)]
+    pending = [(at, session_steps(at, username, password)) for at in apps]
+    timings, errors = [], []
+    while pending:
+        still_running = []
+        for at, steps in pending:
+            try:
+                step, run = next(steps)
+                started = time.perf_counter()
+                run()
+                timings.append((step, time.perf_counter() - started))
+                if at.exception:
+                    raise RuntimeError(f"{step}: {at.exception[0].message}")
+            except StopIteration:
+                continue
+            except Exception as e:
+                errors.append(str(e))
+                continue
+            still_running.append((at, steps))
+        pending = still_running
+    return apps, timings, errors
+
+
+def percentile(values, share):
+    """Nearest-rank percentile of a list of values"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(share * len(ordered)) - 1))]
+
+
+def print_latencies(title, timings):
+    """Table of p50/p95/max milliseconds per step"""
+    steps = {}
+    for step, seconds in timings:
+        steps.setdefault(step, []).append(seconds * 1000)
+    print(title)
+    print(f"  {'step':<20} {'runs':>5} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    for step, values in steps.items():
+        print(f"  {step:<20} {len(values):>5} {statistics.median(values):>9.1f} "
+              f"{percentile(values, 0.95):>9.1f} {max(values):>9.1f}")
+
+
+def prepare_store(orders):
+    """Write a synthetic store to the working directory and build its indexes and aggregates"""
+    from order_store import store_lock
+    from product_rules import current_rules
+    from shards import write_shard
+    with store_lock():
+        write_shard(None, synthetic_orders(orders, current_rules().courses))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for the dashboard")
+    parser.add_argument("--sessions", type=int, default=10, help="Sessions to simulate")
+    parser.add_argument("--orders", type=int, default=20000, help="Orders in the synthetic store")
+    parser.add_argument("--data-dir", help="Existing data directory to use instead of a synthetic store")
+    parser.add_argument("--username", default="Paideia")
+    parser.add_argument("--password", default="Admin")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds a single rerun may take")
+    parser.add_argument("--tracemalloc", action="store_true", help="Also measure Python heap growth (slows reruns)")
+    args = parser.parse_args()
+
+    # The app reads its data files and secrets relative to the working directory
+    scratch = None
+    if args.data_dir:
+        os.chdir(args.data_dir)
+    else:
+        scratch = tempfile.TemporaryDirectory(prefix="dashboard-load-test-")
+        os.chdir(scratch.name)
+        # Placeholder API keys get the app past its setup check; nothing is fetched
+        os.makedirs(".streamlit")
+        with open(os.path.join(".streamlit", "secrets.toml"), "w") as f:
+            f.write('WOOCOMMERCE_CONSUMER_KEY = "load-test"\nWOOCOMMERCE_CONSUMER_SECRET = "load-test"\n')
+
+    if scratch is not None:
+        started = time.perf_counter()
+        prepare_store(args.orders)
+        print(f"Synthetic store of {args.orders:,} orders written in {time.perf_counter() - started:.1f}s")
+
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    # The first session fills the shared caches; its latencies are cold-start latencies
+    started = time.perf_counter()
+    first, cold_timings, errors = run_sessions(1, args.username, args.password, args.timeout)
+    if errors:
+        print(f"First session failed: {errors[0]}")
+        return 1
+    print(f"First session took {time.perf_counter() - started:.1f}s")
+
+    gc.collect()
+    rss_before = rss_bytes()
+    heap_before = tracemalloc.get_traced_memory()[0] if args.tracemalloc else 0
+
+    # The sessions stay open (as browser tabs would) until memory has been measured
+    started = time.perf_counter()
+    apps, timings, errors = run_sessions(args.sessions, args.username, args.password, args.timeout)
+    elapsed = time.perf_counter() - started
+
+    gc.collect()
+    rss_after = rss_bytes()
+    heap_after = tracemalloc.get_traced_memory()[0] if args.tracemalloc else 0
+
+    print()
+    print_latencies("First session (cold caches):", cold_timings)
+    print_latencies(f"{args.sessions} sessions, interleaved ({elapsed:.1f}s):", timings)
+    print()
+    print(f"Per-session memory: {(rss_after - rss_before) / args.sessions / 1024 / 1024:.2f} MB RSS", end="")
+    if args.tracemalloc:
+        print(f", {(heap_after - heap_before) / args.sessions / 1024 / 1024:.2f} MB Python heap", end="")
+    print()
+    print(f"Total RSS with {args.sessions + 1} sessions open: {rss_after / 1024 / 1024:.1f} MB")
+    if errors:
+        print(f"{len(errors)} sessions failed, e.g. {errors[0]}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
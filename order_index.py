@@ -0,0 +1,135 @@
+"""
+Sorted order index for paging through orders
+
+Orders are ranked newest first (rank 0 is the most recent order). Every
+filter is kept as a sorted array of ranks, so a filtered result is itself a
+sorted rank sequence and any page of it is a plain slice.
+"""
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+import numpy as np
+
+EMPTY_RANKS = np.array([], dtype=np.int64)
+
+
+def normalize_date(date_str):
+    """Normalize WooCommerce date strings so they sort chronologically as plain strings"""
+    return (date_str or '').replace(' ', 'T')
+
+
+def normalize_email(email):
+    """Normalize an email address for exact matching"""
+    return (email or '').strip().lower()
+
+
+def order_courses(order, rules):
+    """Return the courses whose name appears in any line item of the order"""
+    matched = []
+    for item in order.line_items:
+        for course in rules.courses_in(item.name):
+            if course not in matched:
+                matched.append(course)
+    return matched
+
+
+def build_order_index(orders, rules):
+    """Build the rank arrays used to filter and page through Order records without sorting on render"""
+    dates = [normalize_date(order.date_created) for order in orders]
+
+    # merge_orders already stores orders newest first; only sort if the file isn't in that order
+    if all(dates[i] >= dates[i + 1] for i in range(len(dates) - 1)):
+        positions = range(len(orders))
+    else:
+        positions = sorted(range(len(orders)), key=lambda i: dates[i], reverse=True)
+
+    by_status = defaultdict(list)
+    by_course = defaultdict(list)
+    by_customer = defaultdict(list)
+    ids = []
+
+    for rank, pos in enumerate(positions):
+        order = orders[pos]
+        email = normalize_email(order.email)
+
+        by_status[order.status].append(rank)
+        for course in order_courses(order, rules):
+            by_course[course].append(rank)
+        if email:
+            by_customer[email].append(rank)
+        ids.append(order.id if order.id is not None else -1)
+
+    # Order id -> rank lookup, used to turn search results (order ids) into ranks
+    ids = np.array(ids, dtype=np.int64)
+    id_order = np.argsort(ids, kind='stable')
+
+    return {
+        'positions': positions,
+        # Ascending copy of the ranked dates for bisecting date ranges
+        'dates_ascending': [dates[pos] for pos in reversed(positions)],
+        'by_status': {k: np.array(v, dtype=np.int64) for k, v in by_status.items()},
+        'by_course': {k: np.array(v, dtype=np.int64) for k, v in by_course.items()},
+        'by_customer': {k: np.array(v, dtype=np.int64) for k, v in by_customer.items()},
+        'ids_sorted': ids[id_order],
+        'ranks_by_sorted_id': id_order
+    }
+
+
+def date_rank_range(index, start_date=None, end_date=None):
+    """Return the [first, last) rank range of orders created between start_date and end_date (inclusive)"""
+    dates = index['dates_ascending']
+    total = len(dates)
+    first, last = 0, total
+    if end_date:
+        # Anything up to the end of end_date; 'T~' sorts after every time of day
+        first = total - bisect_right(dates, f"{end_date.strftime('%Y-%m-%d')}T~")
+    if start_date:
+        last = total - bisect_left(dates, start_date.strftime('%Y-%m-%d'))
+    return first, max(first, last)
+
+
+def ranks_for_ids(index, order_ids):
+    """Return the sorted ranks of the given order ids (unknown ids are ignored)"""
+    ids_sorted = index['ids_sorted']
+    order_ids = np.asarray(order_ids, dtype=np.int64)
+    slots = np.searchsorted(ids_sorted, order_ids)
+    found = slots < len(ids_sorted)
+    found[found] = ids_sorted[slots[found]] == order_ids[found]
+    return np.sort(index['ranks_by_sorted_id'][slots[found]])
+
+
+def query_orders(index, status=None, course=None, customer=None, start_date=None, end_date=None, order_ids=None):
+    """Return the ranks (newest first) of the orders matching every given filter
+
+    order_ids restricts the result to those orders (e.g. search index matches).
+    """
+    first, last = date_rank_range(index, start_date, end_date)
+
+    ranks = None if order_ids is None else ranks_for_ids(index, order_ids)
+    for value, table in ((status, 'by_status'), (course, 'by_course'), (customer, 'by_customer')):
+        if not value:
+            continue
+        key = normalize_email(value) if table == 'by_customer' else value
+        matches = index[table].get(key, EMPTY_RANKS)
+        ranks = matches if ranks is None else np.intersect1d(ranks, matches, assume_unique=True)
+
+    if ranks is None:
+        # No set filters: the result is a contiguous block of ranks
+        ranks = range(first, last)
+    else:
+        ranks = ranks[np.searchsorted(ranks, first):np.searchsorted(ranks, last)]
+
+    return ranks
+
+
+def get_page(orders, index, ranks, page, per_page):
+    """Return the orders on the given 1-based page of a rank sequence"""
+    start = (page - 1) * per_page
+    positions = index['positions']
+    return [orders[positions[r]] for r in ranks[start:start + per_page]]
+
+
+def iter_ranked_orders(orders, index, ranks):
+    """Lazily yield the orders for a rank sequence, newest first"""
+    positions = index['positions']
+    for r in ranks:
+        yield orders[positions[r]]
@@ -0,0 +1,156 @@
+"""
+Order store for WooCommerce Dashboard
+
+Woo.json holds every order (newest first). A small metadata file next to it
+carries the data version, which is bumped on every write so that anything
+cached against the store knows when to recompute, and the version counters
+of other tables kept next to the store (such as the subscriptions table).
+The counters start again at 0 when the metadata file is created anew, so it
+also carries a random epoch written with it; store_epoch tells caches that
+outlive a process which store their versions count from.
+
+With several storefronts configured, each store's orders live in their own
+shard file (see shards.py); the default store's shard is Woo.json itself.
+Every shard write bumps the shard's own version and the data version.
+"""
+import json
+import os
+from contextlib import contextmanager
+from datetime import datetime
+from config import DATA_FILES
+from models import loads, decode_orders
+
+# Advisory file locks are POSIX-only; elsewhere store_lock is a no-op
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def _write_json_atomic(path, data, indent=None):
+    """Write JSON to a temporary file and move it into place so readers never see a partial file"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=indent)
+    os.replace(tmp_path, path)
+
+
+def shard_file(path, shard=None):
+    """Path of a data file for a store's shard: the configured path for the default store (None), else 'Woo.<shard>.json'"""
+    if shard is None:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}.{shard}{ext}"
+
+
+def shard_version_key(shard=None):
+    """Metadata key of a shard's version counter"""
+    return f"shard_version:{shard or ''}"
+
+
+def load_store_orders(shard=None):
+    """Load all orders of a shard (the default store's by default) as raw WooCommerce dicts"""
+    try:
+        with open(shard_file(DATA_FILES['orders_json'], shard), "rb") as f:
+            return loads(f.read())
+    except FileNotFoundError:
+        return []
+
+
+def load_store_records(shard=None):
+    """Load all orders of a shard as compact Order records"""
+    try:
+        with open(shard_file(DATA_FILES['orders_json'], shard), "rb") as f:
+            return decode_orders(f.read())
+    except FileNotFoundError:
+        return []
+
+
+def load_store_meta():
+    """Load the store metadata (data version and last update time)"""
+    try:
+        with open(DATA_FILES['store_meta'], "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {'data_version': 0, 'updated_at': None}
+
+
+def get_data_version(key='data_version'):
+    """Return the current data version of the store (or another version counter kept in the metadata)"""
+    return load_store_meta().get(key, 0)
+
+
+def store_epoch():
+    """Identity of the store the data versions count from: the metadata's epoch, and Woo.json's mtime and size
+
+    The file's stat tells apart stores that share an epoch (or have none,
+    without a metadata file) and were replaced by hand.
+    """
+    try:
+        stat = os.stat(DATA_FILES['orders_json'])
+        orders_file = (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        orders_file = None
+    return load_store_meta().get('epoch'), orders_file
+
+
+def bump_data_version(key='data_version'):
+    """Increment the data version (or another version counter kept in the metadata) and return the new value"""
+    meta = load_store_meta()
+    # A new metadata file restarts the counters: its epoch keeps them apart from the previous file's
+    meta.setdefault('epoch', os.urandom(8).hex())
+    meta[key] = meta.get(key, 0) + 1
+    meta['updated_at'] = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    _write_json_atomic(DATA_FILES['store_meta'], meta)
+    return meta[key]
+
+
+def save_store_orders(orders, shard=None):
+    """Replace the orders of a shard, bump its version and return the new data version"""
+    _write_json_atomic(shard_file(DATA_FILES['orders_json'], shard), orders, indent=2)
+    bump_data_version(shard_version_key(shard))
+    return bump_data_version()
+
+
+@contextmanager
+def store_lock():
+    """Hold an exclusive lock on the store while it is read, merged and written
+
+    The dashboard sync and the webhook receiver both write Woo.json; taking
+    this lock around read-merge-write keeps one from overwriting the other.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(DATA_FILES['store_lock'], "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def merge_orders(existing_orders, new_orders, deleted_ids=()):
+    """Merge new orders with existing orders, keeping the most recent version of each order
+
+    An existing order is only replaced by a copy with the same or a later
+    date_modified, so a late or replayed delivery never rolls an order back.
+    Orders whose ids are in deleted_ids are dropped.
+    """
+    # Create a dictionary of existing orders by ID for quick lookup
+    existing_dict = {order['id']: order for order in existing_orders}
+    
+    # Update with new orders (newer orders will overwrite older ones)
+    for new_order in new_orders:
+        existing = existing_dict.get(new_order['id'])
+        if existing is None or (new_order.get('date_modified') or '') >= (existing.get('date_modified') or ''):
+            existing_dict[new_order['id']] = new_order
+    
+    for order_id in deleted_ids:
+        existing_dict.pop(order_id, None)
+    
+    # Convert back to list and sort by date (newest first)
+    merged_orders = list(existing_dict.values())
+    merged_orders.sort(key=lambda x: x.get('date_created', ''), reverse=True)
+    
+    return merged_orders
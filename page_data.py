@@ -0,0 +1,142 @@
+"""
+Derived results the dashboard pages render, cached on disk across restarts
+
+Each function here builds one page input from the orders or the aggregate
+store and is keyed by the data version (see result_cache.py), so after a
+restart the first visitor reads them from Woo.cache/ instead of recomputing
+them. streamlit_app.py wraps them in st.cache_resource for the in-memory
+tier; warm_up computes all of them right after a sync.
+"""
+import heapq
+from collections import defaultdict, Counter
+from order_store import get_data_version
+from aggregates import load_aggregates, save_aggregates, build_monthly_pivots
+from chart_data import daily_revenue_frame
+from cohorts import build_cohorts
+from recurring_revenue import build_recurring_revenue, load_recurring_revenue, save_recurring_revenue, recurring_revenue_frame
+from shards import load_merged_records, merged_aggregates
+from result_cache import persistent_cache
+from product_rules import current_rules
+
+# Users listed in each ranking on the Users page
+TOP_USERS = 20
+
+
+def calculate_stats(orders):
+    """Calculate statistics from orders"""
+    if not orders:
+        return {}
+
+    completed_orders = [o for o in orders if o.status == 'completed']
+    refunded_orders = [o for o in orders if o.status == 'refunded']
+
+    # Only orders with a numeric total are counted (totals are parsed once when the store is decoded)
+    valid_orders = [o for o in orders if o.total is not None]
+
+    # Partial refunds on completed orders (fully refunded orders have status 'refunded')
+    partial_refunds = sum(order.refunded for order in completed_orders) / 100
+
+    stats = {
+        'total_orders': len(valid_orders),
+        'total_revenue': sum(order.total for order in completed_orders if order.total is not None),
+        'partial_refunds': partial_refunds,
+        'refunded_amount': sum(order.total for order in refunded_orders if order.total is not None) + partial_refunds,
+        'completed_orders': len(completed_orders),
+        'refunded_orders': len(refunded_orders),
+        'customer_count': len(set(order.customer_id for order in valid_orders)),
+        'revenue_by_product': defaultdict(float),
+        'status_breakdown': Counter(order.status for order in valid_orders)
+    }
+
+    # Calculate average order value
+    if completed_orders:
+        stats['avg_order_value'] = stats['total_revenue'] / len(completed_orders)
+    else:
+        stats['avg_order_value'] = 0
+
+    # Product analysis
+    for order in completed_orders:
+        if order.total is not None:
+            for item in order.line_items:
+                if item.total is not None:
+                    stats['revenue_by_product'][item.name] += item.total
+
+    return stats
+
+
+@persistent_cache
+def headline_stats(data_version, _orders):
+    """Headline statistics of the Dashboard"""
+    return calculate_stats(_orders)
+
+
+@persistent_cache
+def daily_revenue(data_version, _aggregates):
+    """Daily revenue per course frame of the revenue trends"""
+    return daily_revenue_frame(_aggregates)
+
+
+@persistent_cache
+def monthly_pivots(data_version, _aggregates):
+    """Monthly revenue and new-order pivot tables"""
+    return build_monthly_pivots(_aggregates)
+
+
+@persistent_cache
+def cohorts(data_version, _orders):
+    """Cohort retention and revenue matrices per course"""
+    return build_cohorts(_orders, current_rules())
+
+
+@persistent_cache
+def recurring_revenue_series(data_version, _orders):
+    """MRR series per course and tier, from the store saved at sync time (rebuilt if it doesn't match the store)"""
+    recurring_revenue = load_recurring_revenue(data_version)
+    if recurring_revenue is None:
+        recurring_revenue = build_recurring_revenue(_orders, current_rules())
+        save_recurring_revenue(recurring_revenue, data_version)
+    return recurring_revenue_frame(recurring_revenue)
+
+
+@persistent_cache
+def user_summary(data_version, _users):
+    """Totals and top users of the Users page: longest subscriptions and highest lifetime value (net of refunds)"""
+    total_users = len(_users)
+    if not total_users:
+        return None
+    net_revenue = sum(user['net_revenue'] for user in _users.values())
+    return {
+        'total_users': total_users,
+        'net_revenue': net_revenue,
+        'avg_lifetime_value': net_revenue / total_users,
+        'avg_orders': sum(user['order_count'] for user in _users.values()) / total_users,
+        'longest': heapq.nlargest(TOP_USERS, _users.items(), key=lambda x: x[1]['subscription_months']),
+        'highest_value': heapq.nlargest(TOP_USERS, _users.items(), key=lambda x: x[1]['net_revenue'])
+    }
+
+
+def warm_up(data_version=None, orders=None, aggregates=None):
+    """Compute every cached page result for a data version (the current one by default); returns the version
+
+    Pass the orders and aggregates when they are already loaded; otherwise
+    they are read from the store.
+    """
+    if data_version is None:
+        data_version = get_data_version()
+        orders = load_merged_records()
+        if get_data_version() != data_version:
+            # The store changed while it was read: warm the newer version
+            return warm_up()
+    if aggregates is None:
+        aggregates = load_aggregates(data_version)
+        if aggregates is None:
+            aggregates = merged_aggregates()
+            save_aggregates(aggregates, data_version)
+
+    headline_stats(data_version, orders)
+    daily_revenue(data_version, aggregates)
+    monthly_pivots(data_version, aggregates)
+    cohorts(data_version, orders)
+    recurring_revenue_series(data_version, orders)
+    user_summary(data_version, aggregates['users'])
+    return data_version
@@ -0,0 +1,238 @@
+"""
+Product rules for WooCommerce Dashboard
+
+The courses tracked on the dashboard and the products left out of the
+monthly tables and user analysis are kept in a versioned rules file,
+product_rules.json:
+
+    {"version": 1, "courses": [...], "excluded_products": [...]}
+
+A product belongs to every course whose name appears in it (case
+insensitively; its course is the first of them, or "Other"), and is
+excluded if its normalized name is in the excluded list. ProductRules
+compiles the rules once: the excluded names into a hash set, and every
+classification is memoized per product name, so aggregating an order costs
+a dictionary lookup per line item however many rules there are.
+
+The store is classified with the applied rules, a copy of the rules file
+kept next to it (Woo.rules.json); every process reloads them when that copy
+changes. To change the rules, edit product_rules.json, bump its version and
+run `python product_rules.py apply`. Only the product names whose
+classification changed are reclassified: the rollups of the closed fiscal
+years that sold them, the partials of the shards that hold them and their
+orders' MRR contributions are recomputed, the merged aggregates are rebuilt
+from the partials and the data version is bumped; everything else is kept.
+
+Usage:
+    python product_rules.py diff    # product names the rules file would reclassify
+    python product_rules.py apply   # reclassify them and apply the rules file
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from config import DATA_FILES
+from aggregates import normalize_product_name
+from order_store import store_lock
+
+# Compiled applied rules: (modification time of the applied copy, ProductRules)
+_current = None
+
+
+class ProductRules:
+    """Compiled product rules; classifications are memoized per product name"""
+
+    def __init__(self, version, courses, excluded_products):
+        self.version = version
+        self.courses = list(courses)
+        self.excluded_products = list(excluded_products)
+        self._lowered = [(course, course.lower()) for course in self.courses]
+        self._excluded = {normalize_product_name(name) for name in self.excluded_products}
+        self._courses_in = {}
+        self._is_excluded = {}
+
+    def courses_in(self, name):
+        """Courses whose name appears in the product name, in rules order"""
+        matched = self._courses_in.get(name)
+        if matched is None:
+            lowered = name.lower()
+            matched = self._courses_in[name] = tuple(course for course, course_lower in self._lowered if course_lower in lowered)
+        return matched
+
+    def course(self, name):
+        """The product's course (the first matching one), or "Other" """
+        matched = self.courses_in(name)
+        return matched[0] if matched else "Other"
+
+    def is_excluded(self, name):
+        """Whether the product is left out of the monthly tables and user analysis"""
+        excluded = self._is_excluded.get(name)
+        if excluded is None:
+            excluded = self._is_excluded[name] = normalize_product_name(name) in self._excluded
+        return excluded
+
+    def classification(self, name):
+        """Everything the rules decide about a product name (equal classifications aggregate identically)"""
+        return self.courses_in(name), self.is_excluded(name)
+
+    def to_dict(self):
+        return {'version': self.version, 'courses': self.courses, 'excluded_products': self.excluded_products}
+
+    def __reduce__(self):
+        # Worker processes get the rules without their memo
+        return (ProductRules, (self.version, self.courses, self.excluded_products))
+
+
+def read_rules(path):
+    """Compile a rules file"""
+    with open(path, "r") as f:
+        data = json.load(f)
+    return ProductRules(data['version'], data['courses'], data['excluded_products'])
+
+
+def current_rules():
+    """The rules the store is classified with (the rules file is applied on first use), recompiled when they change"""
+    global _current
+    path = DATA_FILES['applied_rules']
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        shutil.copyfile(DATA_FILES['product_rules'], path)
+        mtime = os.stat(path).st_mtime_ns
+    if _current is None or _current[0] != mtime:
+        _current = (mtime, read_rules(path))
+    return _current[1]
+
+
+def save_applied_rules(rules):
+    """Make rules the applied rules of the store (call under store_lock)"""
+    path = DATA_FILES['applied_rules']
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(rules.to_dict(), f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def changed_names(names, old_rules, new_rules):
+    """The product names whose classification differs between two sets of rules"""
+    return {name for name in names if old_rules.classification(name) != new_rules.classification(name)}
+
+
+def order_names(order):
+    """Product names of an Order record"""
+    return {item.name for item in order.line_items}
+
+
+def reclassify(new_rules):
+    """Apply new rules to the store, recomputing only what the changed product names touch
+
+    Call under store_lock. Returns (changed product names, {shard: fiscal
+    years whose rollup was recomputed}, new data version).
+    """
+    # Imported here: these modules import this one
+    from aggregates import merge_partials, save_aggregates, fiscal_year_of
+    from aggregation_engine import run_partial
+    from order_store import get_data_version, bump_data_version, shard_version_key
+    from tiers import archive_version, load_rollup, rollup_partials, save_rollup
+    from shards import shard_names, shard_records, archive_records, save_partial, merged_aggregates
+    from search_index import load_search_index, save_search_index
+    from recurring_revenue import load_recurring_revenue, save_recurring_revenue, update_recurring_revenue
+
+    old_rules = current_rules()
+    previous_version = get_data_version()
+    hot = {shard: shard_records(shard) for shard in shard_names()}
+    archived = {shard: archive_records(shard) for shard in shard_names()}
+    names = set()
+    for records in list(hot.values()) + list(archived.values()):
+        for order in records:
+            names |= order_names(order)
+    changed = changed_names(names, old_rules, new_rules)
+    if not changed and new_rules.courses == old_rules.courses:
+        # No product sold is classified differently: nothing stored depends on the change
+        save_applied_rules(new_rules)
+        return changed, {}, previous_version
+
+    rebuilt_years = {}
+    partials = {}
+    affected_orders = []
+    for shard in shard_names():
+        hot_affected = [order for order in hot[shard] if order_names(order) & changed]
+        archive_affected = [order for order in archived[shard] if order_names(order) & changed]
+        if not hot_affected and not archive_affected:
+            continue
+        affected_orders += hot_affected + archive_affected
+
+        # Only the closed fiscal years that sold a changed product are aggregated again
+        version = archive_version(shard)
+        rollup = load_rollup(shard, version)
+        if rollup is None:
+            fiscal_years = None
+            rollup = rollup_partials(archived[shard], new_rules)
+        else:
+            fiscal_years = {fiscal_year_of(order.date_created) for order in archive_affected}
+            rollup.update(rollup_partials(
+                [order for order in archived[shard] if fiscal_year_of(order.date_created) in fiscal_years], new_rules))
+        rebuilt_years[shard] = sorted(rollup if fiscal_years is None else fiscal_years)
+        # Saved before merging: merge_partials may modify the partials it merges
+        save_rollup(rollup, shard, version)
+        partials[shard] = merge_partials(list(rollup.values()) + [run_partial(hot[shard], new_rules)])
+
+    # The search index doesn't depend on the rules; the affected orders' MRR contributions may move between courses
+    search_index = load_search_index(previous_version)
+    recurring_revenue = load_recurring_revenue(previous_version)
+    if recurring_revenue is not None:
+        update_recurring_revenue(recurring_revenue, affected_orders, [], old_rules)
+        update_recurring_revenue(recurring_revenue, [], affected_orders, new_rules)
+
+    for shard, partial in partials.items():
+        save_partial(partial, shard, bump_data_version(shard_version_key(shard)))
+    save_applied_rules(new_rules)
+    # Every page result is recomputed (the course list itself may have changed)
+    data_version = bump_data_version()
+    if search_index is not None:
+        save_search_index(search_index, data_version)
+    if recurring_revenue is not None:
+        save_recurring_revenue(recurring_revenue, data_version)
+    # Shards without changed products keep their saved partials
+    save_aggregates(merged_aggregates(partials), data_version)
+    return changed, rebuilt_years, data_version
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Product rules")
+    parser.add_argument("command", choices=["diff", "apply"])
+    args = parser.parse_args()
+
+    applied = current_rules()
+    rules = read_rules(DATA_FILES['product_rules'])
+    if rules.to_dict() == applied.to_dict():
+        print(f"The rules file (version {rules.version}) is already applied")
+        return 0
+    if rules.version <= applied.version:
+        print(f"The rules file changed but its version ({rules.version}) isn't above the applied version ({applied.version}); bump it")
+        return 1
+
+    if args.command == "diff":
+        # Imported here: shards imports this module
+        from shards import load_merged_records
+        names = set()
+        for order in load_merged_records():
+            names |= order_names(order)
+        for name in sorted(changed_names(names, applied, rules)):
+            print(f"{name}: {applied.classification(name)} -> {rules.classification(name)}")
+        return 0
+
+    started = time.time()
+    with store_lock():
+        changed, rebuilt_years, data_version = reclassify(rules)
+    print(f"Applied rules version {rules.version} in {time.time() - started:.1f} seconds: "
+          f"{len(changed)} product names reclassified, data version {data_version}")
+    for shard, fiscal_years in rebuilt_years.items():
+        print(f"  {shard or 'default store'}: rollups of fiscal years {fiscal_years} and the open years recomputed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
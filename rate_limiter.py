@@ -0,0 +1,145 @@
+"""
+Adaptive client-side rate limiter for the WooCommerce API
+
+Every request takes a token from a token bucket. The bucket's refill rate,
+the number of concurrent requests and the page size are tuned with AIMD
+(additive increase, multiplicative decrease) from what the server reports
+back: fast, successful responses raise them a step at a time. A 429/503
+halves the rate; a failed request, a server error or a response slower than
+the target latency halves the rate and the concurrency as well (and slow
+responses also halve the page size). A Retry-After header pauses every
+request until the server says it is ready again.
+"""
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+# Responses that mean "slow down" rather than "something is broken"
+THROTTLE_STATUSES = {429, 503}
+
+# Weight of the newest sample in the latency and error-rate moving averages
+EWMA_WEIGHT = 0.2
+
+# Requests/second added per second of clean responses once the server has pushed back
+ADDITIVE_INCREASE = 0.25
+
+# Factor applied to the rate (and concurrency/page size when overloaded) on a decrease
+MULTIPLICATIVE_DECREASE = 0.5
+
+
+def parse_retry_after(value):
+    """Return the seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveRateLimiter:
+    """Token bucket whose rate, concurrency and page size adapt to latency and errors (thread safe)"""
+
+    def __init__(self, rate, max_rate, max_concurrency, per_page, min_per_page, target_latency, min_rate=0.5):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.max_concurrency = max_concurrency
+        self.concurrency = 1
+        self.max_per_page = per_page
+        self.min_per_page = min_per_page
+        self.per_page = per_page
+        self.target_latency = target_latency
+
+        self.latency = None  # moving average, seconds
+        self.error_rate = 0.0  # moving average of failed/throttled responses
+        self.requests = 0
+        self.throttled = 0
+        self.blocked_until = 0.0
+
+        self._tokens = 1.0
+        self._refilled_at = time.monotonic()
+        self._decreased_at = 0.0
+        self._slow_start = True  # grow quickly until the server first pushes back
+        self._clean_responses = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        # No bursts: requests are spaced evenly at the current rate, concurrency only overlaps their latency
+        self._tokens = min(1.0, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        self.requests += 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def record(self, latency, status=None, retry_after=None, failed=False):
+        """Feed back one response: its latency, HTTP status and Retry-After seconds, or failed=True if no response came back"""
+        with self._lock:
+            now = time.monotonic()
+            self.latency = latency if self.latency is None else (1 - EWMA_WEIGHT) * self.latency + EWMA_WEIGHT * latency
+            throttled = status in THROTTLE_STATUSES
+            slow = failed or latency > self.target_latency
+            error = failed or throttled or (status is not None and status >= 500)
+            self.error_rate = (1 - EWMA_WEIGHT) * self.error_rate + EWMA_WEIGHT * (1.0 if error else 0.0)
+
+            if throttled:
+                self.throttled += 1
+            if retry_after is not None:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+
+            if error or slow:
+                self._decrease(now, overloaded=slow or not throttled, shrink_pages=slow)
+            else:
+                self._increase()
+
+    def _decrease(self, now, overloaded, shrink_pages):
+        """Multiplicative decrease, at most once per round trip so one overloaded window isn't counted several times"""
+        self._clean_responses = 0
+        if now - self._decreased_at < (self.latency or 1.0):
+            return
+        self._decreased_at = now
+        self._slow_start = False
+        self.rate = max(self.min_rate, self.rate * MULTIPLICATIVE_DECREASE)
+        self._tokens = min(self._tokens, 0.0)
+        # Throttling is about request rate; only a struggling server needs fewer requests in flight
+        if overloaded:
+            self.concurrency = max(1, int(self.concurrency * MULTIPLICATIVE_DECREASE))
+        # Large pages are slow queries for WooCommerce; shrink them only when responses are slow
+        if shrink_pages:
+            self.per_page = max(self.min_per_page, int(self.per_page * MULTIPLICATIVE_DECREASE))
+
+    def _increase(self):
+        """Additive increase: the rate grows by one request/second per clean response until the first
+        decrease, then by ADDITIVE_INCREASE per second; concurrency and page size after a clean window"""
+        self.rate = min(self.max_rate, self.rate + (1.0 if self._slow_start else ADDITIVE_INCREASE / self.rate))
+        self._clean_responses += 1
+        if self._clean_responses >= self.concurrency and self.latency < self.target_latency / 2:
+            self._clean_responses = 0
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+            self.per_page = min(self.max_per_page, self.per_page + self.min_per_page)
+
+    def describe(self):
+        """One-line summary of the live limiter state for the progress display"""
+        latency = f"{self.latency:.2f}s" if self.latency is not None else "-"
+        text = (f"Limiter: {self.rate:.1f} req/s | {self.concurrency} concurrent | {self.per_page} per page | "
+                f"latency {latency} | errors {self.error_rate:.0%} | throttled {self.throttled}")
+        waiting = self.blocked_until - time.monotonic()
+        if waiting > 0:
+            text += f" | waiting {waiting:.0f}s (Retry-After)"
+        return text
@@ -0,0 +1,199 @@
+"""
+Recurring revenue (MRR/ARR) time series for WooCommerce Dashboard
+
+Every completed subscription line item (individual or group) of a
+registered customer is spread over the months it pays for: one month for
+monthly terms, twelve for annual ones (the default when no term is given).
+A subscriber is a (course, tier, customer) triple. Tiers are "Individual
+Monthly", "Individual Annual" and "Group N seats".
+
+For each subscriber the store keeps monthly recurring revenue by month. For
+each (course, tier) it keeps a monthly series of MRR, new, expansion,
+contraction and churned MRR and the number of paying subscribers. A month's
+movement for a subscriber compares its MRR with the month before: new when
+it starts paying, expansion or contraction when the amount changes, churned
+(the previous month's MRR) when it stops.
+
+The series is only ever updated by deltas. A sync applies the previous and
+the new versions of the orders it changed, which touches only the months of
+the subscribers those orders belong to. History is never recomputed, and new
+months are appended as renewals arrive. Like the aggregates, the store is
+saved next to Woo.json, tagged with the data version.
+"""
+import json
+import os
+from collections import defaultdict
+import pandas as pd
+from config import DATA_FILES
+from aggregates import group_seats, to_cents
+from cohorts import month_number, month_label
+
+# Columns of a series row, all in cents except the subscriber count
+SERIES_FIELDS = ['mrr', 'new', 'expansion', 'contraction', 'churned', 'subscribers']
+
+
+def subscription_tier(item, order_cents):
+    """Return (tier, months paid for) of a line item, or (None, 0) if it isn't a subscription product"""
+    item_name = item.name.lower()
+    payment_term = item.payment_term.lower() if item.payment_term is not None else None
+    # Monthly vs annual from the payment term, falling back to the product name
+    months = 1 if payment_term == 'monthly' or 'monthly' in item_name else 12
+    if 'individual' in item_name:
+        return ("Individual Monthly" if months == 1 else "Individual Annual"), months
+    if 'group' in item_name or 'seats' in item_name:
+        return f"Group {group_seats(item_name, order_cents)} seats", months
+    return None, 0
+
+
+def tier_sort_key(tier):
+    """Individual tiers first, then groups by seat count"""
+    if tier.startswith("Group"):
+        return (1, int(tier.split()[1]))
+    return (0, 0 if tier == "Individual Monthly" else 1)
+
+
+def order_contributions(order, rules):
+    """Monthly recurring revenue an Order record pays for: [(course, tier, customer_id, month number, cents)]"""
+    if order.status != 'completed' or order.total is None or not order.customer_id:
+        return []
+    start = month_number(order.date_created)
+    if start is None:
+        return []
+    order_cents = to_cents(order.total)
+
+    contributions = []
+    for item in order.line_items:
+        course = rules.course(item.name)
+        if course not in rules.courses:
+            continue
+        tier, months = subscription_tier(item, order_cents)
+        if tier is None:
+            continue
+        cents = 0 if item.total is None else to_cents(item.total)
+        # Spread exactly: the monthly shares add up to the item total
+        for i in range(months):
+            share = cents * (i + 1) // months - cents * i // months
+            contributions.append((course, tier, order.customer_id, start + i, share))
+    return contributions
+
+
+def new_recurring_revenue():
+    """Return an empty recurring revenue store"""
+    return {
+        # (course, tier, customer_id) -> {month number: MRR cents}
+        'subscribers': {},
+        # (course, tier) -> {month number: [mrr, new, expansion, contraction, churned, subscribers]}
+        'series': defaultdict(dict)
+    }
+
+
+def _apply_series(store, key, months, sign):
+    """Add (sign=1) or remove (sign=-1) one subscriber's share of the series for the given months"""
+    subscriber = store['subscribers'].get(key, {})
+    series = store['series'][key[:2]]
+    for month in months:
+        current = subscriber.get(month, 0)
+        previous = subscriber.get(month - 1, 0)
+        if not current and not previous:
+            continue
+        row = series.get(month)
+        if row is None:
+            row = series[month] = [0] * len(SERIES_FIELDS)
+        row[0] += sign * current
+        if current and not previous:
+            row[1] += sign * current
+        elif current > previous > 0:
+            row[2] += sign * (current - previous)
+        elif 0 < current < previous:
+            row[3] += sign * (previous - current)
+        elif previous and not current:
+            row[4] += sign * previous
+        if current:
+            row[5] += sign
+        if not any(row):
+            del series[month]
+
+
+def update_recurring_revenue(store, previous_orders, changed_orders, rules):
+    """Update the store in place from the previous and new versions of changed Order records
+
+    Orders present in previous_orders but not in changed_orders are treated as deleted.
+    Returns the number of subscribers whose series changed.
+    """
+    deltas = defaultdict(lambda: defaultdict(int))
+    for order in previous_orders:
+        for course, tier, customer_id, month, cents in order_contributions(order, rules):
+            deltas[(course, tier, customer_id)][month] -= cents
+    for order in changed_orders:
+        for course, tier, customer_id, month, cents in order_contributions(order, rules):
+            deltas[(course, tier, customer_id)][month] += cents
+
+    updated = 0
+    for key, month_deltas in deltas.items():
+        month_deltas = {month: cents for month, cents in month_deltas.items() if cents}
+        if not month_deltas:
+            continue
+        # A change in month m also changes the movement of month m + 1
+        affected = set(month_deltas) | {month + 1 for month in month_deltas}
+        _apply_series(store, key, affected, -1)
+        subscriber = store['subscribers'].setdefault(key, {})
+        for month, cents in month_deltas.items():
+            total = subscriber.get(month, 0) + cents
+            if total:
+                subscriber[month] = total
+            else:
+                subscriber.pop(month, None)
+        if not subscriber:
+            del store['subscribers'][key]
+        _apply_series(store, key, affected, 1)
+        updated += 1
+    return updated
+
+
+def build_recurring_revenue(orders, rules):
+    """Build the recurring revenue store from scratch"""
+    store = new_recurring_revenue()
+    update_recurring_revenue(store, [], orders, rules)
+    return store
+
+
+def recurring_revenue_frame(store):
+    """Series as a DataFrame: one row per (Month, Course, Tier) with dollars and subscriber counts"""
+    rows = []
+    for (course, tier), series in store['series'].items():
+        for month, row in series.items():
+            rows.append([month_label(month), course, tier] + [cents / 100 for cents in row[:5]] + [row[5]])
+    frame = pd.DataFrame(rows, columns=['Month', 'Course', 'Tier', 'MRR', 'New', 'Expansion', 'Contraction', 'Churned', 'Subscribers'])
+    frame['Month'] = pd.to_datetime(frame['Month'])
+    frame['ARR'] = frame['MRR'] * 12
+    return frame.sort_values(['Month', 'Course', 'Tier'], ignore_index=True)
+
+
+def save_recurring_revenue(store, data_version):
+    """Persist the recurring revenue store, tagged with the data version it matches"""
+    # JSON object keys must be strings; tuples and month numbers are restored on load
+    data = {
+        'subscribers': [list(key) + [sorted(months.items())] for key, months in store['subscribers'].items()],
+        'series': [list(key) + [sorted(series.items())] for key, series in store['series'].items()]
+    }
+    tmp_path = f"{DATA_FILES['recurring_revenue']}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({'data_version': data_version, 'recurring_revenue': data}, f)
+    os.replace(tmp_path, DATA_FILES['recurring_revenue'])
+
+
+def load_recurring_revenue(data_version):
+    """Load the persisted recurring revenue store, or None if it is missing or stale"""
+    try:
+        with open(DATA_FILES['recurring_revenue'], "r") as f:
+            data = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if data.get('data_version') != data_version:
+        return None
+    store = new_recurring_revenue()
+    for course, tier, customer_id, months in data['recurring_revenue']['subscribers']:
+        store['subscribers'][(course, tier, customer_id)] = {month: cents for month, cents in months}
+    for course, tier, series in data['recurring_revenue']['series']:
+        store['series'][(course, tier)] = {month: row for month, row in series}
+    return store
@@ -0,0 +1,157 @@
+"""
+Refunds table for WooCommerce Dashboard
+
+An order's payload lists its refunds (id and amount) but not which line
+items they refunded. The sync fetches /orders/<id>/refunds for the orders
+whose refunds changed (concurrently, through the shared session and
+limiter in api_client.py) and keeps one compact row per refund in
+Woo.refunds.json, joined to the orders by order id.
+
+When the store is decoded, apply_refunds attributes each order's refunded
+amount to its line items: item refunds from the table where known, the rest
+split over the items in proportion to their totals. The aggregates then
+carry refunded and net revenue per course, day and customer, computed once
+per data version like everything else.
+"""
+import json
+import os
+from config import DATA_FILES
+from models import parse_money
+from order_store import shard_file
+from api_client import ApiError, api_url, iter_responses
+
+# One row per refund; 'items' is [[line item name, refunded cents], ...]
+REFUND_COLUMNS = ['id', 'order_id', 'date_created', 'amount', 'reason', 'items']
+
+
+def _cents(value):
+    """Positive cents of a money value (refund line totals are negative)"""
+    amount = parse_money(value)
+    return 0 if amount is None else abs(int(round(amount * 100)))
+
+
+def refund_row(order_id, refund):
+    """Compact table row of a refund from the refunds endpoint"""
+    return [
+        refund['id'],
+        order_id,
+        refund.get('date_created') or '',
+        _cents(refund.get('amount')),
+        refund.get('reason') or '',
+        [[item.get('name') or '', _cents(item.get('total'))] for item in refund.get('line_items') or []
+         if _cents(item.get('total'))]
+    ]
+
+
+def refunds_by_order(rows):
+    """Group table rows by order id"""
+    by_order = {}
+    for row in rows:
+        by_order.setdefault(row[1], []).append(row)
+    return by_order
+
+
+def refund_candidates(raw_orders, by_order):
+    """Ids of orders whose refunds differ from the table (refund ids in the payload vs rows stored)
+
+    A refund added or removed changes the order's date_modified, so any order
+    refunded since the last sync is among those an incremental sync fetches
+    (it asks for orders modified since its cursor, not only new ones) and is
+    checked here with its current payload. Orders whose refund ids match the
+    table are skipped.
+    """
+    candidates = set()
+    for order in raw_orders:
+        payload_ids = {refund.get('id') for refund in order.get('refunds') or [] if isinstance(refund, dict)}
+        stored_ids = {row[0] for row in by_order.get(order['id'], ())}
+        if payload_ids != stored_ids:
+            candidates.add(order['id'])
+    return candidates
+
+
+def fetch_refunds(session, limiter, headers, order_ids, config=None):
+    """Fetch the refunds of each order concurrently: {order id: [rows]} (orders that no longer exist get [])
+
+    config is the store to fetch from (the default store if None). Raises
+    requests exceptions, or ApiError for any other non-200 response.
+    """
+    urls = {api_url(f"orders/{order_id}/refunds", config): order_id for order_id in order_ids}
+    fetched = {}
+    for url, response in iter_responses(session, limiter, list(urls), headers):
+        order_id = urls[url]
+        if response.status_code == 404:
+            fetched[order_id] = []
+            continue
+        if response.status_code != 200:
+            raise ApiError(response.status_code, response.text[:200])
+        fetched[order_id] = [refund_row(order_id, refund) for refund in response.json()]
+    return fetched
+
+
+def update_refunds(rows, fetched):
+    """Replace the rows of the fetched orders with their new refunds"""
+    kept = [row for row in rows if row[1] not in fetched]
+    for order_rows in fetched.values():
+        kept.extend(order_rows)
+    return kept
+
+
+def split_cents(cents, weights):
+    """Split cents over the weights exactly (the shares add up to cents)"""
+    total = sum(weights)
+    if total <= 0:
+        weights, total = [1] * len(weights), len(weights)
+    shares, cumulative = [], 0
+    for weight in weights:
+        share = cents * (cumulative + weight) // total - cents * cumulative // total
+        cumulative += weight
+        shares.append(share)
+    return shares
+
+
+def apply_refunds(orders, by_order=None):
+    """Set each line item's refunded cents from its order's refunded amount
+
+    Item refunds listed in the table go to the item with that name; the rest
+    of the order's refunded amount (refunds of shipping or fees, or refunds
+    not fetched yet) is split over the items in proportion to their totals.
+    """
+    by_order = by_order or {}
+    for order in orders:
+        items = order.line_items
+        if not order.refunded or not items:
+            continue
+        item_cents = [0] * len(items)
+        remaining = order.refunded
+        for row in by_order.get(order.id, ()):
+            for name, cents in row[5]:
+                for i, item in enumerate(items):
+                    if item.name == name:
+                        item_cents[i] += cents
+                        remaining -= cents
+                        break
+        weights = [max(0, int(round((item.total or 0) * 100))) for item in items]
+        for i, share in enumerate(split_cents(remaining, weights)):
+            items[i].refunded = item_cents[i] + share
+    return orders
+
+
+def load_refunds(shard=None):
+    """Load a shard's refunds table rows (empty if no refunds have been fetched)"""
+    try:
+        with open(shard_file(DATA_FILES['refunds'], shard), "r") as f:
+            data = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return []
+    if data.get('columns') != REFUND_COLUMNS:
+        return []
+    return data['rows']
+
+
+def save_refunds(rows, shard=None):
+    """Replace a shard's refunds table (saved under store_lock, before the store write that bumps the data version)"""
+    path = shard_file(DATA_FILES['refunds'], shard)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({'columns': REFUND_COLUMNS, 'rows': rows}, f)
+    os.replace(tmp_path, path)
@@ -0,0 +1,172 @@
+"""
+Persistent result cache for WooCommerce Dashboard
+
+st.cache_resource keeps derived results (stats, pivots, frames, rankings)
+in memory, so every redeploy or restart starts cold and the first visitor
+pays for recomputing them. Functions decorated with persistent_cache also
+keep their results on disk, in Woo.cache/, one pickle per entry, keyed by
+the function, CACHE_FORMAT, the store's epoch (order_store.store_epoch, so
+a store replaced by hand or a new metadata file restarting the data version
+never reads an earlier store's entries) and the function's arguments (the
+data version among them). Arguments whose names start with an underscore are not part of
+the key, as with st.cache_resource: pass the data the result is computed
+from as _orders or _aggregates and key it by its version.
+
+The cache is shared by every process serving the dashboard. Entries are
+written to a temporary file and moved into place, so readers never see a
+partial entry; a hit touches the entry's modification time, and after each
+write the least recently used entries are removed until the cache is under
+`result_cache_max_mb`, holding a file lock so concurrent evictions don't
+race. Entries of old data versions are never read again and age out the
+same way.
+
+Usage:
+    python result_cache.py warm    # compute every page's results for the current data version
+    python result_cache.py info    # entries and size
+    python result_cache.py clear   # remove every entry
+"""
+import argparse
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import threading
+import time
+from config import APP_CONFIG, DATA_FILES
+from order_store import store_epoch
+
+# Advisory file locks are POSIX-only; elsewhere eviction isn't serialized across processes
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Bump when a cached function's result changes shape, so old entries are ignored
+CACHE_FORMAT = 2
+
+_MISS = object()
+
+
+def _cache_dir():
+    """Directory holding the entries (created on first use)"""
+    os.makedirs(DATA_FILES['result_cache'], exist_ok=True)
+    return DATA_FILES['result_cache']
+
+
+def entry_path(func_name, key_args):
+    """Path of the entry for a function and its key arguments (in the current store epoch)"""
+    digest = hashlib.sha256(repr((CACHE_FORMAT, store_epoch(), func_name, key_args)).encode()).hexdigest()[:32]
+    return os.path.join(_cache_dir(), f"{func_name}.{digest}.pkl")
+
+
+def cache_get(path):
+    """Value of an entry, or _MISS if it is missing or unreadable (another process may be evicting it)"""
+    try:
+        with open(path, "rb") as f:
+            value = pickle.load(f)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return _MISS
+    try:
+        # Mark the entry as recently used for eviction
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+    return value
+
+
+def cache_put(path, value):
+    """Write an entry atomically, then evict least recently used entries over the size bound"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    evict(APP_CONFIG['result_cache_max_mb'] * 1024 * 1024)
+
+
+def _entries():
+    """(modification time, size, path) of every entry"""
+    entries = []
+    with os.scandir(_cache_dir()) as scan:
+        for entry in scan:
+            if not entry.name.endswith('.pkl'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    return entries
+
+
+def evict(max_bytes):
+    """Remove the least recently used entries until the cache holds at most max_bytes; returns the number removed"""
+    with open(os.path.join(_cache_dir(), ".lock"), "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        entries = sorted(_entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return removed
+
+
+def clear_cache():
+    """Remove every entry; returns the number removed"""
+    return evict(-1)
+
+
+def persistent_cache(func):
+    """Keep func's results on disk, keyed by its name and its arguments not starting with an underscore
+
+    Stack it under @st.cache_resource: memory is checked first, then disk,
+    and only then is func called.
+    """
+    parameters = list(inspect.signature(func).parameters)
+    func_name = f"{func.__module__}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        bound = dict(zip(parameters, args), **kwargs)
+        key_args = tuple((name, bound[name]) for name in parameters if name in bound and not name.startswith('_'))
+        path = entry_path(func_name, key_args)
+        value = cache_get(path)
+        if value is _MISS:
+            value = func(*args, **kwargs)
+            cache_put(path, value)
+        return value
+
+    return wrapper
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Persistent result cache")
+    parser.add_argument("command", choices=["warm", "info", "clear"])
+    args = parser.parse_args()
+
+    if args.command == "warm":
+        # Imported here: page_data imports this module for the decorator
+        from page_data import warm_up
+        started = time.time()
+        data_version = warm_up()
+        print(f"Warmed the result cache for data version {data_version} in {time.time() - started:.1f} seconds")
+    elif args.command == "info":
+        entries = _entries()
+        print(f"{len(entries)} entries, {sum(size for _, size, _ in entries) / 1024 / 1024:.1f} MB "
+              f"(bound {APP_CONFIG['result_cache_max_mb']} MB)")
+    else:
+        print(f"Removed {clear_cache()} entries")
+
+
+if __name__ == "__main__":
+    main()
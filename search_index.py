@@ -0,0 +1,148 @@
+"""
+Inverted search index over customers and products
+
+Maps every token of an order's customer name, email, order number and
+normalized product names to a sorted array of order ids. The index is built
+or updated at sync time and saved next to the store (tagged with the data
+version it was built for), so the dashboard only has to load it.
+"""
+import json
+import os
+import re
+from bisect import bisect_left, insort
+from collections import defaultdict
+import numpy as np
+from config import DATA_FILES
+from aggregates import normalize_product_name
+
+EMPTY_IDS = np.array([], dtype=np.int64)
+
+# Trailing query terms shorter than this are matched exactly rather than expanded as a prefix
+MIN_PREFIX_LENGTH = 2
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Split text into lowercase alphanumeric tokens"""
+    return TOKEN_RE.findall((text or '').lower())
+
+
+def order_tokens(order):
+    """Return the set of search tokens for an Order record"""
+    tokens = {str(order.id)}
+    tokens.update(tokenize(order.first_name))
+    tokens.update(tokenize(order.last_name))
+    tokens.update(tokenize(order.email))
+    for item in order.line_items:
+        tokens.update(tokenize(normalize_product_name(item.name)))
+    tokens.discard('')
+    return tokens
+
+
+def build_search_index(orders):
+    """Build the search index from scratch"""
+    postings = defaultdict(list)
+    for order in orders:
+        if order.id is None:
+            continue
+        for token in order_tokens(order):
+            postings[token].append(order.id)
+    postings = {token: np.unique(np.array(ids, dtype=np.int64)) for token, ids in postings.items()}
+    return {'postings': postings, 'vocabulary': sorted(postings)}
+
+
+def update_search_index(index, previous_orders, changed_orders):
+    """Update the index in place: drop the tokens of the previous versions of orders and add the changed ones
+
+    Orders present in previous_orders but not in changed_orders are treated as deleted.
+    """
+    removals = defaultdict(set)
+    additions = defaultdict(set)
+    for order in previous_orders:
+        for token in order_tokens(order):
+            removals[token].add(order.id)
+    for order in changed_orders:
+        for token in order_tokens(order):
+            additions[token].add(order.id)
+
+    postings = index['postings']
+    vocabulary = index['vocabulary']
+    for token in set(removals) | set(additions):
+        ids = postings.get(token, EMPTY_IDS)
+        if token in removals:
+            ids = np.setdiff1d(ids, np.fromiter(removals[token], dtype=np.int64), assume_unique=True)
+        if token in additions:
+            ids = np.union1d(ids, np.fromiter(additions[token], dtype=np.int64))
+
+        if len(ids):
+            if token not in postings:
+                insort(vocabulary, token)
+            postings[token] = ids
+        elif token in postings:
+            del postings[token]
+            del vocabulary[bisect_left(vocabulary, token)]
+    return index
+
+
+def _prefix_ids(index, prefix):
+    """Return the ids of orders with any token starting with prefix"""
+    if len(prefix) < MIN_PREFIX_LENGTH:
+        return index['postings'].get(prefix, EMPTY_IDS)
+    vocabulary = index['vocabulary']
+    start = bisect_left(vocabulary, prefix)
+    # '{' sorts right after 'z', so this is the end of the prefix block
+    end = bisect_left(vocabulary, prefix + '{', start)
+    matches = [index['postings'][token] for token in vocabulary[start:end]]
+    if not matches:
+        return EMPTY_IDS
+    if len(matches) == 1:
+        return matches[0]
+    return np.unique(np.concatenate(matches))
+
+
+def search_order_ids(index, query):
+    """Return the sorted ids of orders matching every token of the query (the last token as a prefix)
+
+    Returns None for an empty query.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return None
+
+    matches = [index['postings'].get(term, EMPTY_IDS) for term in terms[:-1]]
+    matches.append(_prefix_ids(index, terms[-1]))
+
+    # Intersect smallest first, probing the larger arrays by binary search
+    matches.sort(key=len)
+    result = matches[0]
+    for ids in matches[1:]:
+        if not len(result):
+            break
+        slots = np.minimum(np.searchsorted(ids, result), len(ids) - 1)
+        result = result[ids[slots] == result]
+    return result
+
+
+def save_search_index(index, data_version):
+    """Persist the search index next to the store, tagged with the data version it matches"""
+    tmp_path = f"{DATA_FILES['search_index']}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({
+            'data_version': data_version,
+            'postings': {token: ids.tolist() for token, ids in index['postings'].items()}
+        }, f)
+    os.replace(tmp_path, DATA_FILES['search_index'])
+
+
+def load_search_index(data_version):
+    """Load the persisted search index, or None if it is missing or was built for another data version"""
+    try:
+        with open(DATA_FILES['search_index'], "r") as f:
+            data = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if data.get('data_version') != data_version:
+        return None
+    postings = {token: np.array(ids, dtype=np.int64) for token, ids in data['postings'].items()}
+    return {'postings': postings, 'vocabulary': sorted(postings)}
@@ -0,0 +1,261 @@
+"""
+Multi-store shards of the order store for WooCommerce Dashboard
+
+Every storefront in WOOCOMMERCE_STORES is synced into its own shard: the
+first (default) store keeps Woo.json and the other data files as
+configured, each further store gets 'Woo.<name>.json', its own refunds
+table and its own staging area. Shards have their own cursor (their newest
+order), rate limiter and version counter, so stores sync in parallel and
+independently of each other.
+
+The dashboard reads one merged view. The order and customer ids of the
+store at position k (k > 0) in WOOCOMMERCE_STORES are offset by
+k * SHARD_ID_SPAN so they never collide; the default store's ids are left
+as they are. The aggregates are kept as one partial per shard (see
+aggregates.py), saved next to the shard and tagged with the shard's
+version. Writing a shard recomputes only that shard's partial and merges it
+with the saved partials of the others, so syncing one store costs the same
+however many stores there are, and pages read the merged aggregates as
+before.
+
+Each shard is also split into hot and cold tiers (see tiers.py): writing a
+shard freezes orders of closed fiscal years into its archive and rollup,
+and its partial is the rollup merged with a partial of the hot orders only.
+The merged records the pages read include the archived orders, decoded once
+per archive version.
+"""
+import os
+import pickle
+from config import WOOCOMMERCE_STORES, DATA_FILES
+from order_store import (load_store_records, save_store_orders, get_data_version, shard_file,
+                         shard_version_key, merge_orders)
+from models import orders_from_dicts
+from refunds import load_refunds, save_refunds, refunds_by_order, apply_refunds
+from aggregates import merge_partials, finalize_aggregates, save_aggregates, fiscal_year_of, AGGREGATES_FORMAT
+from tiers import (split_tiers, archive_version, load_archive, save_archive, rollup_partials, load_rollup,
+                   save_rollup)
+from aggregation_engine import run_partial
+from product_rules import current_rules
+from alerts import check_alerts
+from search_index import build_search_index, update_search_index, load_search_index, save_search_index
+from recurring_revenue import (build_recurring_revenue, update_recurring_revenue, load_recurring_revenue,
+                               save_recurring_revenue)
+
+# Ids of the store at position k are offset by k * SHARD_ID_SPAN in the merged view
+SHARD_ID_SPAN = 10 ** 12
+
+# Decoded archive records per shard: shard -> (archive version, records); the records are never modified
+_archive_cache = {}
+
+
+def store_shard(store):
+    """Shard name of a configured store (None for the default store)"""
+    return None if store is WOOCOMMERCE_STORES[0] or store['name'] == WOOCOMMERCE_STORES[0]['name'] else store['name']
+
+
+def shard_names():
+    """Shard of every configured store, in configuration order"""
+    return [store_shard(store) for store in WOOCOMMERCE_STORES]
+
+
+def split_order_id(order_id):
+    """(store name, store's own order id) of a merged-view order id"""
+    position, store_id = divmod(order_id, SHARD_ID_SPAN)
+    if position >= len(WOOCOMMERCE_STORES):
+        return WOOCOMMERCE_STORES[0]['name'], order_id
+    return WOOCOMMERCE_STORES[position]['name'], store_id
+
+
+def offset_ids(records, shard):
+    """Move the order and customer ids of a shard's Order records into the merged id space (in place)"""
+    offset = shard_names().index(shard) * SHARD_ID_SPAN
+    if offset:
+        for order in records:
+            order.id += offset
+            # Guests (customer 0) stay guests
+            if order.customer_id:
+                order.customer_id += offset
+    return records
+
+
+def shard_records(shard, raw_orders=None, refund_rows=None):
+    """Order records of a shard with refunds joined, in the merged id space
+
+    raw_orders and refund_rows default to what is stored for the shard.
+    """
+    records = load_store_records(shard) if raw_orders is None else orders_from_dicts(raw_orders)
+    refund_rows = load_refunds(shard) if refund_rows is None else refund_rows
+    return offset_ids(apply_refunds(records, refunds_by_order(refund_rows)), shard)
+
+
+def archive_records(shard):
+    """Order records of a shard's archive with refunds joined, in the merged id space (decoded once per archive version)"""
+    version = archive_version(shard)
+    cached = _archive_cache.get(shard)
+    if cached is None or cached[0] != version:
+        cached = (version, shard_records(shard, load_archive(shard)))
+        _archive_cache[shard] = cached
+    return cached[1]
+
+
+def load_merged_records(replaced=None):
+    """Order records of every shard, hot and archived, newest first
+
+    replaced maps shards to hot records to use instead of the stored ones.
+    """
+    replaced = replaced or {}
+    shards = shard_names()
+    records = []
+    for shard in shards:
+        hot = replaced[shard] if shard in replaced else shard_records(shard)
+        records.extend(hot)
+        # An order still in the hot file is newer than its archived copy (a write interrupted between the two files)
+        hot_ids = {order.id for order in hot}
+        records.extend(order for order in archive_records(shard) if order.id not in hot_ids)
+    if len(shards) > 1:
+        records.sort(key=lambda order: order.date_created, reverse=True)
+    return records
+
+
+def save_partial(partial, shard, shard_version):
+    """Persist a shard's aggregate partial, tagged with the shard version it was built from"""
+    # Partials hold sets, Counters and tuple keys; pickle keeps them exact (the file is only read by this app)
+    path = shard_file(DATA_FILES['shard_partial'], shard)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump({'format': AGGREGATES_FORMAT, 'shard_version': shard_version, 'partial': partial}, f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_partial(shard, shard_version):
+    """Load a shard's saved aggregate partial, or None if it is missing, stale or of an older format"""
+    try:
+        with open(shard_file(DATA_FILES['shard_partial'], shard), "rb") as f:
+            data = pickle.load(f)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return None
+    if data.get('shard_version') != shard_version or data.get('format') != AGGREGATES_FORMAT:
+        return None
+    return data['partial']
+
+
+def rollup_partial(shard):
+    """Merged rollup partial of a shard's closed fiscal years (rebuilt from the archive if the rollup doesn't match it)"""
+    version = archive_version(shard)
+    partials = load_rollup(shard, version)
+    if partials is None:
+        partials = rollup_partials(archive_records(shard), current_rules())
+        save_rollup(partials, shard, version)
+    return merge_partials(partials.values())
+
+
+def freeze_orders(shard, orders, refund_rows, deleted_ids=()):
+    """Merge orders of closed fiscal years into a shard's archive (dropping deleted_ids) and recompute their years' rollup
+
+    Call under store_lock. Returns True if the archive already held any of
+    these orders (a late change to a closed year), False if they were all
+    new to it or nothing changed.
+    """
+    previous_version = archive_version(shard)
+    archive = load_archive(shard)
+    archived = {order['id']: order for order in archive}
+    deleted = [archived[order_id] for order_id in deleted_ids if order_id in archived]
+    if not orders and not deleted:
+        return False
+    late_change = bool(deleted) or any(order['id'] in archived for order in orders)
+    archive = merge_orders(archive, orders, deleted_ids)
+    version = save_archive(archive, shard)
+
+    partials = load_rollup(shard, previous_version)
+    if partials is None:
+        partials = rollup_partials(shard_records(shard, archive, refund_rows), current_rules())
+    else:
+        # Only the fiscal years of the frozen and deleted orders are recomputed
+        fiscal_years = {fiscal_year_of(order['date_created']) for order in orders + deleted}
+        for fiscal_year in fiscal_years:
+            partials.pop(fiscal_year, None)
+        changed = [order for order in archive if fiscal_year_of(order['date_created']) in fiscal_years]
+        partials.update(rollup_partials(shard_records(shard, changed, refund_rows), current_rules()))
+    save_rollup(partials, shard, version)
+    return late_change
+
+
+def shard_partial(shard):
+    """A shard's aggregate partial: the saved one if it matches the shard, else rebuilt from its rollup and hot orders"""
+    shard_version = get_data_version(shard_version_key(shard))
+    partial = load_partial(shard, shard_version)
+    if partial is None:
+        # The hot tier is small: aggregated in this process, without starting a worker pool
+        partial = merge_partials([rollup_partial(shard), run_partial(shard_records(shard), current_rules(), workers=1)])
+        save_partial(partial, shard, shard_version)
+    return partial
+
+
+def merged_aggregates(partials=None):
+    """Finalized aggregates of every shard, from their partials; partials maps shards to partials to use as given"""
+    partials = partials or {}
+    return finalize_aggregates(
+        merge_partials([partials[shard] if shard in partials else shard_partial(shard) for shard in shard_names()]),
+        current_rules()
+    )
+
+
+def write_shard(shard, orders, refund_rows=None, previous_orders=None, applied_orders=None, deleted_ids=()):
+    """Save a shard's orders and bring the merged search index, aggregates and MRR series up to date
+
+    Call under store_lock. orders are the shard's hot orders with any new
+    or changed ones merged in; those of closed fiscal years are frozen into
+    the archive and the rest saved as the hot tier. previous_orders and
+    applied_orders are the raw orders this write replaces and the ones it
+    applied; when given (and the saved index and series match the store)
+    only those orders are applied to the search index and MRR series,
+    otherwise both are rebuilt from every shard. The applied orders are
+    also checked for anomalies (alerts.py). refund_rows is the shard's
+    new refunds table, if it changed. deleted_ids are orders deleted from
+    the store, removed from the archive as well. Returns the new data
+    version and the alerts raised, to be sent (alerts.send_alerts) once
+    store_lock is released.
+    """
+    previous_version = get_data_version()
+    rules = current_rules()
+    if refund_rows is None:
+        refund_rows = load_refunds(shard)
+
+    # Refunds are saved first: frozen orders are aggregated with them
+    save_refunds(refund_rows, shard)
+    orders, cold_orders = split_tiers(orders)
+    records = shard_records(shard, orders, refund_rows)
+    # Changes to orders of closed fiscal years aren't alerted on: their previous versions are in the archive
+    alerts = check_alerts(previous_orders, None if applied_orders is None else split_tiers(applied_orders)[0],
+                          lambda: load_merged_records({shard: records}), rules)
+    if (cold_orders or deleted_ids) and freeze_orders(shard, cold_orders, refund_rows, deleted_ids):
+        # The archived copies these replace aren't among previous_orders
+        previous_orders = None
+
+    search_index = None
+    recurring_revenue = None
+    if previous_orders is not None:
+        previous_records = offset_ids(orders_from_dicts(previous_orders), shard)
+        applied_records = offset_ids(orders_from_dicts(applied_orders), shard)
+        search_index = load_search_index(previous_version)
+        if search_index is not None:
+            update_search_index(search_index, previous_records, applied_records)
+        recurring_revenue = load_recurring_revenue(previous_version)
+        if recurring_revenue is not None:
+            update_recurring_revenue(recurring_revenue, previous_records, applied_records, rules)
+    if search_index is None or recurring_revenue is None:
+        merged_records = load_merged_records({shard: records})
+        if search_index is None:
+            search_index = build_search_index(merged_records)
+        if recurring_revenue is None:
+            recurring_revenue = build_recurring_revenue(merged_records, rules)
+
+    # Only this shard's hot orders are aggregated; its rollup and the other shards' saved partials are merged in
+    partial = merge_partials([rollup_partial(shard), run_partial(records, rules, workers=1)])
+    data_version = save_store_orders(orders, shard)
+    save_partial(partial, shard, get_data_version(shard_version_key(shard)))
+    save_search_index(search_index, data_version)
+    save_aggregates(merged_aggregates({shard: partial}), data_version)
+    save_recurring_revenue(recurring_revenue, data_version)
+    return data_version, alerts
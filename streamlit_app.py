@@ -1,14 +1,37 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
-import json
 import requests
-import base64
 import time
 import os
+import math
+import threading
 from datetime import datetime
-from collections import defaultdict, Counter
-from config import WOOCOMMERCE_CONFIG, APP_CONFIG, DATA_FILES
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from config import WOOCOMMERCE_CONFIG, WOOCOMMERCE_STORES, APP_CONFIG
+from order_store import load_store_orders, get_data_version, merge_orders, store_lock
+from sync_staging import resumable_checkpoint, start_staging, set_snapshot, stage_batch, load_staged_orders, clear_staging
+from api_client import ApiError, api_url, auth_headers, create_session, create_limiter, iter_pages, request_error_message
+from order_index import build_order_index, query_orders, get_page, iter_ranked_orders
+from search_index import build_search_index, search_order_ids, load_search_index, save_search_index
+from aggregates import load_aggregates, save_aggregates
+from shards import store_shard, split_order_id, load_merged_records, archive_records, merged_aggregates, write_shard
+from alerts import send_alerts
+from tiers import split_tiers
+from export import (EXPORT_FORMATS, MIME_TYPES, iter_chunks, iter_frame_chunks,
+                    user_rows, order_rows, write_export)
+from chart_data import BUCKETS, revenue_series, status_counts_frame
+from cohorts import cohort_frame
+from refunds import refund_candidates, fetch_refunds, update_refunds, load_refunds, refunds_by_order
+from subscriptions import (subscription_row, merge_subscriptions, latest_modified, load_subscriptions,
+                           save_subscriptions, build_subscription_index, subscription_summary, VERSION_KEY)
+from recurring_revenue import tier_sort_key
+from product_rules import current_rules
+from comparisons import compare_fiscal_years, compare_months, elapsed_months, month_label, growth
+from page_data import (headline_stats, daily_revenue, monthly_pivots, cohorts, recurring_revenue_series,
+                       user_summary, warm_up)
 
 # Try to import streamlit-authenticator, fallback to simple auth if it fails
 try:
@@ -25,6 +48,9 @@ st.set_page_config(
     layout=APP_CONFIG['layout']
 )
 
+# Courses tracked on the dashboard, from the applied product rules (read again on every rerun)
+COURSES = current_rules().courses
+
 # Authentication setup - using simple authentication for reliability
 if not st.session_state.get('authenticated', False):
     st.title("🔐 WooCommerce Dashboard Login")
@@ -62,25 +88,110 @@ if not WOOCOMMERCE_CONFIG['consumer_key'] or not WOOCOMMERCE_CONFIG['consumer_se
 # If authenticated and API keys are configured, show the dashboard
 st.success("Welcome Paideia!")
 
-@st.cache_data(ttl=APP_CONFIG['cache_ttl'])  # Cache for 5 minutes
-def load_orders():
-    """Load orders from JSON file with caching"""
+@st.cache_resource(ttl=APP_CONFIG['cache_ttl'])  # Cache for 5 minutes
+def load_orders(data_version):
+    """Load orders of every store's shard as compact Order records with caching (keyed by the store's data version)
+
+    A shared resource rather than cache_data, so reruns don't unpickle a fresh
+    copy of every order; the records are never modified.
+    """
     try:
-        with open(DATA_FILES['orders_json'], "r") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return []
+        return load_merged_records()
     except Exception as e:
         return []
 
-def get_latest_order_date(orders):
-    """Get the most recent order date from existing orders"""
+@st.cache_resource
+def get_stats(data_version, _orders):
+    """Headline statistics, calculated once per data version (and kept on disk across restarts)"""
+    return headline_stats(data_version, _orders)
+
+@st.cache_resource
+def get_order_index(data_version, _orders):
+    """Build the sorted order index once per data version and share it across sessions"""
+    return build_order_index(_orders, current_rules())
+
+@st.cache_resource
+def get_search_index(data_version, _orders):
+    """Load the search index saved at sync time, rebuilding it if it doesn't match the store"""
+    search_index = load_search_index(data_version)
+    if search_index is None:
+        search_index = build_search_index(_orders)
+        save_search_index(search_index, data_version)
+    return search_index
+
+@st.cache_resource
+def get_aggregates(data_version, _orders):
+    """Load the aggregate store saved at sync time, rebuilding it from the shards' partials if it doesn't match the store"""
+    aggregates = load_aggregates(data_version)
+    if aggregates is None:
+        aggregates = merged_aggregates()
+        save_aggregates(aggregates, data_version)
+    return aggregates
+
+@st.cache_resource
+def get_daily_revenue_frame(data_version, _aggregates):
+    """Daily revenue per course frame, built once per data version (and kept on disk across restarts)"""
+    return daily_revenue(data_version, _aggregates)
+
+@st.cache_resource
+def get_monthly_pivots(data_version, _aggregates):
+    """Monthly revenue and new-order pivot tables, built once per data version (and kept on disk across restarts)"""
+    return monthly_pivots(data_version, _aggregates)
+
+@st.cache_resource
+def get_cohorts(data_version, _orders):
+    """Cohort retention and revenue matrices per course, built once per data version (and kept on disk across restarts)"""
+    return cohorts(data_version, _orders)
+
+@st.cache_resource
+def get_recurring_revenue_frame(data_version, _orders):
+    """MRR series per course and tier, built once per data version (and kept on disk across restarts)"""
+    return recurring_revenue_series(data_version, _orders)
+
+@st.cache_resource
+def get_user_summary(data_version, _aggregates):
+    """Totals and top users of the Users page, built once per data version (and kept on disk across restarts)"""
+    return user_summary(data_version, _aggregates['users'])
+
+@st.cache_resource
+def get_subscription_index(subscriptions_version, rules_version):
+    """Subscriptions table as NumPy arrays, built once per version of the table and of the product rules"""
+    return build_subscription_index(load_subscriptions(), current_rules())
+
+def load_session_inputs():
+    """Orders, index, aggregates and stats for the current data version, memoized in this session
+
+    The cached resources above are looked up once per data version and kept
+    in session state, so a rerun only reads the store's data version.
+    Returns None if there are no orders.
+    """
+    data_version = get_data_version()
+    inputs = st.session_state.get('inputs')
+    if inputs is not None and inputs['data_version'] == data_version:
+        return inputs
+
+    orders = load_orders(data_version)
+    if not orders:
+        return None
+    aggregates = get_aggregates(data_version, orders)
+    inputs = {
+        'data_version': data_version,
+        'orders': orders,
+        'order_index': get_order_index(data_version, orders),
+        'aggregates': aggregates,
+        'stats': get_stats(data_version, orders)
+    }
+    st.session_state['inputs'] = inputs
+    return inputs
+
+def get_latest_order_date(orders, field='date_created'):
+    """Get the most recent order date (date_created, or another date field) from existing orders"""
     if not orders:
         return None
     
     latest_date = None
     for order in orders:
-        date_str = order.get('date_created')
+        date_str = order.get(field)
         if not date_str:
             continue
         try:
@@ -96,239 +207,282 @@ def get_latest_order_date(orders):
     
     return latest_date
 
-def merge_orders(existing_orders, new_orders):
-    """Merge new orders with existing orders, keeping the most recent version of each order"""
-    # Create a dictionary of existing orders by ID for quick lookup
-    existing_dict = {order['id']: order for order in existing_orders}
-    
-    # Update with new orders (newer orders will overwrite older ones)
-    for new_order in new_orders:
-        existing_dict[new_order['id']] = new_order
-    
-    # Convert back to list and sort by date (newest first)
-    merged_orders = list(existing_dict.values())
-    merged_orders.sort(key=lambda x: x.get('date_created', ''), reverse=True)
-    
-    return merged_orders
-
-def fetch_orders_from_api(incremental=True):
-    """Fetch orders from WooCommerce API with incremental update support"""
-    import math
-    from requests.adapters import HTTPAdapter
-    from urllib3.util.retry import Retry
-    
-    api_url = f"{WOOCOMMERCE_CONFIG['base_url']}/wp-json/wc/v3/orders"
-    credentials = f"{WOOCOMMERCE_CONFIG['consumer_key']}:{WOOCOMMERCE_CONFIG['consumer_secret']}"
-    encoded_credentials = base64.b64encode(credentials.encode()).decode()
-    headers = {
-        "Authorization": f"Basic {encoded_credentials}",
-        "Content-Type": "application/json",
-        "User-Agent": "curl/8.7.1"
-    }
-    
-    # Load existing orders for incremental update
+def fetch_orders_from_api(incremental=True, store=None):
+    """Fetch orders of one store (the default store if None) from WooCommerce API into its shard, with incremental update support"""
+    store = store or WOOCOMMERCE_STORES[0]
+    shard = store_shard(store)
+    label = f"{store['name']}: " if len(WOOCOMMERCE_STORES) > 1 else ""
+    url = api_url("orders", store)
+    headers = auth_headers(store)
+    
+    # Load existing orders for incremental update (each store has its own cursor)
     existing_orders = []
     if incremental:
-        try:
-            with open(DATA_FILES['orders_json'], "r") as f:
-                existing_orders = json.load(f)
-        except FileNotFoundError:
-            pass
-    
-    # Get the latest order date for incremental fetching
-    latest_date = get_latest_order_date(existing_orders)
-    
-    # Configure retry strategy
-    retry_strategy = Retry(
-        total=3,
-        backoff_factor=1,
-        status_forcelist=[429, 500, 502, 503, 504],
-    )
+        existing_orders = load_store_orders(shard)
+    
+    # Incremental syncs fetch every order modified since the last one, so refunds, status changes and edits of
+    # older orders are picked up too. The cursor is never later than the newest order's creation: after a full
+    # sync, orders created after its snapshot may have been modified before orders fetched later in that sync
+    latest_date = get_latest_order_date(existing_orders, 'date_modified')
+    latest_created = get_latest_order_date(existing_orders)
+    if latest_date is None or (latest_created is not None and latest_created < latest_date):
+        latest_date = latest_created
     
-    session = requests.Session()
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
+    session = create_session()
+    limiter = create_limiter()
     
     all_new_orders = []
-    page = 1
-    per_page = APP_CONFIG.get('api_per_page', 100)
+    batch = 1
     total_orders_est = None
+    fetched = 0
     start_time = time.time()
     
+    params = {
+        "orderby": "date",
+        "order": "desc"
+    }
+    
+    # Incremental updates ask for orders modified since the cursor, newest changes first (an order modified
+    # mid-sync moves to the front, so later pages can only repeat an order, never skip one)
+    if incremental and latest_date:
+        params["orderby"] = "modified"
+        params["modified_after"] = latest_date.strftime("%Y-%m-%dT%H:%M:%S")
+    
+    # Full syncs stage every batch on disk, so an interrupted sync resumes where it stopped
+    full_sync = not (incremental and latest_date)
+    checkpoint = None
+    resume_hint = ""
+    if full_sync:
+        base_params = dict(params)
+        checkpoint = resumable_checkpoint(base_params, shard)
+        if checkpoint is None:
+            checkpoint = start_staging(base_params, shard)
+        elif checkpoint['last_batch'] > 0:
+            st.info(f"{label}Resuming the interrupted full sync after {checkpoint['fetched']:,} already fetched orders.")
+        batch = checkpoint['last_batch'] + 1
+        fetched = checkpoint['fetched']
+        total_orders_est = checkpoint['total_estimate']
+        resume_hint = " Fetched orders are saved; run the full refresh again to resume."
+        # Full syncs reuse the checkpoint's parameters, including the snapshot filter
+        params.update(checkpoint['params'])
+    resumed_from = fetched
+    
     progress_bar = st.progress(0)
     status_text = st.empty()
     count_text = st.empty()
     timing_text = st.empty()
+    limiter_text = st.empty()
+    
+    def show_batch_status():
+        if incremental and latest_date:
+            status_text.text(f"{label}Fetching orders created or changed since {latest_date.strftime('%Y-%m-%d %H:%M')} (Batch {batch})...")
+        else:
+            status_text.text(f"{label}Fetching all orders (Batch {batch})...")
     
     try:
-        while True:
-            if incremental and latest_date:
-                status_text.text(f"Fetching new orders since {latest_date.strftime('%Y-%m-%d %H:%M')} (Page {page})...")
-            else:
-                status_text.text(f"Fetching all orders (Page {page})...")
-            
-            params = {
-                "per_page": per_page,
-                "page": page,
-                "orderby": "date",
-                "order": "desc"
-            }
-            
-            # Add date filter for incremental updates
-            if incremental and latest_date:
-                params["after"] = latest_date.strftime("%Y-%m-%dT%H:%M:%S")
-            
-            try:
-                response = session.get(api_url, headers=headers, params=params, timeout=APP_CONFIG['api_timeout'])
-            except requests.exceptions.Timeout:
-                return False, f"Request timed out after {APP_CONFIG['api_timeout']} seconds. The server is taking too long to respond."
-            except requests.exceptions.ConnectionError:
-                return False, "Connection error. Please check your internet connection and try again."
-            except requests.exceptions.RequestException as e:
-                return False, f"Network error: {str(e)}"
-            
-            if response.status_code == 200:
-                # Try to get total count from headers (if available)
-                if total_orders_est is None:
-                    total_header = response.headers.get('X-WP-Total')
-                    if total_header:
-                        try:
-                            total_orders_est = int(total_header)
-                        except Exception:
-                            total_orders_est = None
-                
-                orders = response.json()
-                if not orders:
-                    break
-                
-                all_new_orders.extend(orders)
+        show_batch_status()
+        # Batches arrive in offset order so staged batches stay contiguous
+        pages = iter_pages(session, limiter, url, headers, params, offset=fetched, total_estimate=total_orders_est)
+        try:
+            for orders, total_orders_est in pages:
+                if full_sync:
+                    if checkpoint['last_batch'] == 0:
+                        set_snapshot(checkpoint, orders)
+                        # Batches requested from now on are pinned to the snapshot
+                        params.update(checkpoint['params'])
+                    stage_batch(checkpoint, orders, total_orders_est)
+                    fetched = checkpoint['fetched']
+                else:
+                    all_new_orders.extend(orders)
+                    fetched = len(all_new_orders)
                 
-                # Progress info with timing estimates
-                fetched = len(all_new_orders)
+                # Progress info with timing estimates (the rate only counts orders fetched by this run)
                 elapsed = time.time() - start_time
+                limiter_text.text(limiter.describe())
                 
                 if total_orders_est:
                     percent = min(fetched / total_orders_est, 1.0)
                     progress_bar.progress(percent)
-                    count_text.text(f"Fetched {fetched:,} new orders (Page {page})")
+                    count_text.text(f"Fetched {fetched:,} new orders (Batch {batch})")
                     
                     # Estimate remaining time
-                    if fetched > 0 and elapsed > 0:
-                        rate = fetched / elapsed
+                    if fetched > resumed_from and elapsed > 0:
+                        rate = (fetched - resumed_from) / elapsed
                         remaining = total_orders_est - fetched
                         eta_seconds = remaining / rate if rate > 0 else 0
                         eta_minutes = eta_seconds / 60
                         timing_text.text(f"Rate: {rate:.1f} orders/sec | Elapsed: {elapsed:.0f}s | ETA: {eta_minutes:.1f} minutes")
                 else:
-                    progress = min(page / 50, 1.0)
+                    progress = min(batch / 50, 1.0)
                     progress_bar.progress(progress)
-                    count_text.text(f"Fetched {fetched:,} new orders (Page {page})")
+                    count_text.text(f"Fetched {fetched:,} new orders (Batch {batch})")
                     
-                    if fetched > 0 and elapsed > 0:
-                        rate = fetched / elapsed
+                    if fetched > resumed_from and elapsed > 0:
+                        rate = (fetched - resumed_from) / elapsed
                         timing_text.text(f"Rate: {rate:.1f} orders/sec | Elapsed: {elapsed:.0f}s")
                 
-                if len(orders) < per_page:
-                    break
-                page += 1
-                time.sleep(APP_CONFIG['api_delay'])
-            else:
-                return False, f"API Error: Status code {response.status_code} - {response.text[:200]}"
+                batch += 1
+                show_batch_status()
+        except (requests.exceptions.RequestException, ApiError) as e:
+            return False, label + request_error_message(e, resume_hint)
+        finally:
+            pages.close()
+        
+        # Every batch of a full sync is staged; read them back for promotion
+        if full_sync:
+            status_text.text("Loading staged orders...")
+            all_new_orders = load_staged_orders(checkpoint)
+        
+        # Refunds (with their line items) of the orders whose refunds changed, fetched concurrently
+        refund_orders = refund_candidates(all_new_orders + existing_orders, refunds_by_order(load_refunds(shard)))
+        fetched_refunds = {}
+        if refund_orders:
+            status_text.text(f"Fetching refunds of {len(refund_orders):,} orders...")
+            try:
+                fetched_refunds = fetch_refunds(session, limiter, headers, refund_orders, store)
+            except (requests.exceptions.RequestException, ApiError) as e:
+                return False, label + request_error_message(e, resume_hint)
         
         # Merge and save data
         status_text.text("Merging and saving data...")
         with st.spinner("Merging and saving data..."):
             if all_new_orders or existing_orders:
-                # Merge new orders with existing ones
-                if incremental and existing_orders:
-                    merged_orders = merge_orders(existing_orders, all_new_orders)
-                    total_orders = len(merged_orders)
-                    new_count = len(all_new_orders)
-                else:
-                    merged_orders = all_new_orders
-                    total_orders = len(merged_orders)
-                    new_count = total_orders
+                # Merge new orders with existing ones; the shard is re-read under the lock so orders
+                # written by the webhook receiver during the fetch aren't lost (other stores' syncs wait here too)
+                with store_lock():
+                    previous_orders = applied_orders = None
+                    if incremental and existing_orders:
+                        existing_orders = load_store_orders(shard)
+                        merged_orders = merge_orders(existing_orders, all_new_orders)
+                        new_count = len(all_new_orders)
+                        
+                        # Orders the merge actually applied, and the versions they replace
+                        existing_by_id = {order['id']: order for order in existing_orders}
+                        merged_by_id = {order['id']: order for order in merged_orders}
+                        applied_orders = [o for o in all_new_orders if merged_by_id.get(o['id']) is o]
+                        previous_orders = [existing_by_id[o['id']] for o in applied_orders if o['id'] in existing_by_id]
+                    else:
+                        # Drop any order staged twice across an interruption
+                        merged_orders = merge_orders([], all_new_orders)
+                        total_orders = len(merged_orders)
+                        new_count = total_orders
+                    
+                    # The search index and MRR series are updated with just the applied orders when they match
+                    # the store, and only this store's aggregate partial is recomputed
+                    _, alerts = write_shard(shard, merged_orders, update_refunds(load_refunds(shard), fetched_refunds),
+                                            previous_orders, applied_orders)
+                    if incremental and existing_orders:
+                        # The store file only holds open fiscal years; the total includes the archived ones
+                        total_orders = len(split_tiers(merged_orders)[0]) + len(archive_records(shard))
+                
+                # Posted after the lock is released, so a slow alert webhook doesn't hold up other writes
+                send_alerts(alerts)
                 
-                with open(DATA_FILES['orders_json'], "w") as f:
-                    json.dump(merged_orders, f, indent=2)
+                # The staged batches are now in the store
+                if full_sync:
+                    clear_staging(shard)
                 
                 progress_bar.empty()
                 status_text.empty()
                 count_text.empty()
                 timing_text.empty()
+                limiter_text.empty()
                 elapsed = time.time() - start_time
                 
                 if incremental and new_count > 0:
-                    st.success(f"Updated {new_count:,} new orders. Total: {total_orders:,} orders in {elapsed:.1f} seconds.")
-                    return True, f"Updated {new_count:,} new orders. Total: {total_orders:,} orders in {elapsed:.1f} seconds."
+                    st.success(f"{label}Updated {new_count:,} new or changed orders. Total: {total_orders:,} orders in {elapsed:.1f} seconds.")
+                    return True, f"{label}Updated {new_count:,} new or changed orders. Total: {total_orders:,} orders in {elapsed:.1f} seconds."
                 elif incremental:
-                    st.success(f"No new orders found. Total: {total_orders:,} orders.")
-                    return True, f"No new orders found. Total: {total_orders:,} orders."
+                    st.success(f"{label}No new or changed orders found. Total: {total_orders:,} orders.")
+                    return True, f"{label}No new or changed orders found. Total: {total_orders:,} orders."
                 else:
-                    st.success(f"Successfully updated {total_orders:,} orders in {elapsed:.1f} seconds.")
-                    return True, f"Successfully updated {total_orders:,} orders in {elapsed:.1f} seconds."
+                    st.success(f"{label}Successfully updated {total_orders:,} orders in {elapsed:.1f} seconds.")
+                    return True, f"{label}Successfully updated {total_orders:,} orders in {elapsed:.1f} seconds."
             else:
+                if full_sync:
+                    clear_staging(shard)
                 progress_bar.empty()
                 status_text.empty()
                 count_text.empty()
                 timing_text.empty()
-                return False, "No orders found"
+                limiter_text.empty()
+                return False, f"{label}No orders found"
     except Exception as e:
         progress_bar.empty()
         status_text.empty()
         count_text.empty()
         timing_text.empty()
-        return False, f"Error: {str(e)}"
+        limiter_text.empty()
+        return False, f"{label}Error: {str(e)}{resume_hint}"
 
-def calculate_stats(orders):
-    """Calculate statistics from orders"""
-    if not orders:
-        return {}
-    
-    completed_orders = [o for o in orders if o.get('status') == 'completed']
-    refunded_orders = [o for o in orders if o.get('status') == 'refunded']
+def refresh_stores(incremental=True):
+    """Sync every configured store into its shard, in parallel; returns (success, message) per store"""
+    if len(WOOCOMMERCE_STORES) == 1:
+        return [fetch_orders_from_api(incremental=incremental)]
+    
+    # Each store's progress shows in its own container; the worker threads write to them through the script's context
+    ctx = get_script_run_ctx()
+    containers = [st.container() for store in WOOCOMMERCE_STORES]
+    
+    def sync(store, container):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        with container:
+            return fetch_orders_from_api(incremental=incremental, store=store)
+    
+    with ThreadPoolExecutor(max_workers=len(WOOCOMMERCE_STORES)) as pool:
+        return list(pool.map(sync, WOOCOMMERCE_STORES, containers))
+
+def fetch_subscriptions_from_api(incremental=True):
+    """Sync the WooCommerce Subscriptions table, fetching only subscriptions modified since the last sync"""
+    url = api_url("subscriptions")
+    headers = auth_headers()
+    
+    # Ordered by id, so subscriptions modified while the sync runs keep their offset
+    params = {
+        "orderby": "id",
+        "order": "asc"
+    }
     
-    # Validate order data
-    valid_orders = []
-    for order in orders:
-        if isinstance(order, dict) and 'total' in order:
-            try:
-                float(order['total'])
-                valid_orders.append(order)
-            except (ValueError, TypeError):
-                continue
+    # Incremental cursor: the newest modification already in the table
+    latest_modified_date = latest_modified(load_subscriptions()) if incremental else None
+    if latest_modified_date:
+        params["modified_after"] = latest_modified_date
     
-    stats = {
-        'total_orders': len(valid_orders),
-        'total_revenue': sum(float(order['total']) for order in completed_orders if order in valid_orders),
-        'refunded_amount': sum(float(order['total']) for order in refunded_orders if order in valid_orders),
-        'completed_orders': len(completed_orders),
-        'refunded_orders': len(refunded_orders),
-        'customer_count': len(set(order.get('customer_id', 0) for order in valid_orders)),
-        'revenue_by_product': defaultdict(float),
-        'status_breakdown': Counter(order.get('status', 'unknown') for order in valid_orders)
-    }
+    session = create_session()
+    limiter = create_limiter()
+    start_time = time.time()
     
-    # Calculate average order value
-    if completed_orders:
-        stats['avg_order_value'] = stats['total_revenue'] / len(completed_orders)
-    else:
-        stats['avg_order_value'] = 0
-    
-    # Product analysis
-    for order in completed_orders:
-        if order in valid_orders:
-            for item in order.get('line_items', []):
-                if isinstance(item, dict) and 'name' in item and 'total' in item:
-                    try:
-                        product_name = item['name']
-                        product_revenue = float(item['total'])
-                        stats['revenue_by_product'][product_name] += product_revenue
-                    except (ValueError, TypeError):
-                        continue
-    
-    return stats
+    status_text = st.empty()
+    status_text.text("Fetching subscriptions...")
+    new_rows = []
+    try:
+        pages = iter_pages(session, limiter, url, headers, params)
+        try:
+            for subscriptions, total_estimate in pages:
+                new_rows.extend(subscription_row(subscription) for subscription in subscriptions)
+                status_text.text(f"Fetched {len(new_rows):,} of {total_estimate or len(new_rows):,} subscriptions...")
+        except ApiError as e:
+            status_text.empty()
+            if e.status_code == 404:
+                return False, "The WooCommerce Subscriptions endpoint was not found; is the Subscriptions extension installed?"
+            return False, request_error_message(e)
+        except requests.exceptions.RequestException as e:
+            status_text.empty()
+            return False, request_error_message(e)
+        finally:
+            pages.close()
+        
+        # Merge under the store lock; the table has its own version, so the order caches stay valid
+        with store_lock():
+            existing_rows = load_subscriptions() if incremental else []
+            rows = merge_subscriptions(existing_rows, new_rows)
+            save_subscriptions(rows)
+        status_text.empty()
+        elapsed = time.time() - start_time
+        return True, f"Synced {len(new_rows):,} changed subscriptions. Total: {len(rows):,} subscriptions in {elapsed:.1f} seconds."
+    except Exception as e:
+        status_text.empty()
+        return False, f"Error: {str(e)}"
 
 def get_fiscal_year(date):
     """Return the fiscal year for a given date (September 1 - August 31)."""
@@ -338,202 +492,14 @@ def get_fiscal_year(date):
     else:
         return date.year
 
-def filter_orders_fiscal_year(orders, fiscal_year):
-    """Filter orders to those in the given fiscal year (September 1 - August 31)."""
-    filtered = []
-    for order in orders:
-        date_str = order.get('date_created')
-        if not date_str:
-            continue
-        try:
-            if 'T' in date_str:
-                date_obj = datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S")
-            else:
-                date_obj = datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S")
-            if get_fiscal_year(date_obj) == fiscal_year:
-                filtered.append(order)
-        except Exception:
-            continue
-    return filtered
-
-def aggregate_product_fiscal_year(orders):
-    """Aggregate revenue and order count per product for the given orders, separating individual/group and new/recurring orders."""
-    product_revenue = defaultdict(float)
-    product_order_count = defaultdict(int)
-    product_individual_revenue = defaultdict(float)
-    product_group_revenue = defaultdict(float)
-    product_individual_count = defaultdict(int)
-    product_group_count = defaultdict(int)
-    
-    # New vs recurring tracking
-    product_new_revenue = defaultdict(float)
-    product_recurring_revenue = defaultdict(float)
-    product_new_count = defaultdict(int)
-    product_recurring_count = defaultdict(int)
-    
-    for order in orders:
-        if order.get('status') != 'completed':
-            continue
-        
-        products_in_order = set()
-        order_total = float(order.get('total', 0))
-        created_via = order.get('created_via', 'checkout')
-        is_recurring = created_via == 'subscription'
-        
-        for item in order.get('line_items', []):
-            if isinstance(item, dict) and 'name' in item and 'total' in item:
-                try:
-                    product_name = item['name']
-                    product_revenue[product_name] += float(item['total'])
-                    products_in_order.add(product_name)
-                except Exception:
-                    continue
-        
-        # Determine if this is an individual or group order based on total amount
-        is_group_order = order_total > 200  # Adjust this threshold as needed
-        
-        for pname in products_in_order:
-            product_order_count[pname] += 1
-            
-            # Individual vs Group tracking
-            if is_group_order:
-                product_group_revenue[pname] += float(order.get('total', 0))
-                product_group_count[pname] += 1
-            else:
-                product_individual_revenue[pname] += float(order.get('total', 0))
-                product_individual_count[pname] += 1
-            
-            # New vs Recurring tracking
-            if is_recurring:
-                product_recurring_revenue[pname] += float(order.get('total', 0))
-                product_recurring_count[pname] += 1
-            else:
-                product_new_revenue[pname] += float(order.get('total', 0))
-                product_new_count[pname] += 1
-    
-    return (product_revenue, product_order_count, 
-            product_individual_revenue, product_group_revenue,
-            product_individual_count, product_group_count,
-            product_new_revenue, product_recurring_revenue,
-            product_new_count, product_recurring_count)
-
-def analyze_course_orders(orders, course_name):
-    """Analyze orders for a specific course with detailed breakdowns using actual product data"""
-    course_orders = []
-    
-    for order in orders:
-        if order.get('status') != 'completed':
-            continue
-        
-        # Check if this order contains the specific course
-        order_contains_course = False
-        for item in order.get('line_items', []):
-            if isinstance(item, dict) and 'name' in item:
-                # Check if course name appears in the product name
-                if course_name.lower() in item['name'].lower():
-                    order_contains_course = True
-                    break
-        
-        if order_contains_course:
-            course_orders.append(order)
-    
-    if not course_orders:
+def format_delta(current, previous, money=False):
+    """st.metric delta of a metric against the comparison period: the change and the growth rate"""
+    if previous is None:
         return None
-    
-    # Analyze the course orders
-    total_orders = len(course_orders)
-    total_revenue = sum(float(order.get('total', 0)) for order in course_orders)
-    
-    # New vs Recurring
-    new_orders = [o for o in course_orders if o.get('created_via') != 'subscription']
-    recurring_orders = [o for o in course_orders if o.get('created_via') == 'subscription']
-    new_revenue = sum(float(order.get('total', 0)) for order in new_orders)
-    recurring_revenue = sum(float(order.get('total', 0)) for order in recurring_orders)
-    
-    # Individual vs Group and detailed breakdowns
-    individual_orders = []
-    group_orders = []
-    individual_monthly = []
-    individual_annual = []
-    group_by_seats = {}
-    
-    for order in course_orders:
-        for item in order.get('line_items', []):
-            if isinstance(item, dict) and 'name' in item:
-                item_name = item['name']
-                
-                # Check if this item is for the course we're analyzing
-                if course_name.lower() in item_name.lower():
-                    # Determine if individual or group based on product name
-                    if 'individual' in item_name.lower():
-                        individual_orders.append(order)
-                        
-                        # Determine monthly vs annual based on payment term or product name
-                        payment_term = None
-                        for meta in item.get('meta_data', []):
-                            if meta.get('key') == 'payment-term':
-                                payment_term = meta.get('value', '').lower()
-                                break
-                        
-                        if payment_term == 'monthly' or 'monthly' in item_name.lower():
-                            individual_monthly.append(order)
-                        elif payment_term == 'annual' or 'annual' in item_name.lower():
-                            individual_annual.append(order)
-                    
-                    elif 'group' in item_name.lower() or 'seats' in item_name.lower():
-                        group_orders.append(order)
-                        
-                        # Extract seat count from product name
-                        import re
-                        seat_match = re.search(r'(\d+)\s*seats?', item_name.lower())
-                        if seat_match:
-                            seats = int(seat_match.group(1))
-                        else:
-                            # Fallback: estimate seats based on total
-                            order_total = float(order.get('total', 0))
-                            if order_total <= 300:
-                                seats = 2
-                            elif order_total <= 500:
-                                seats = 4
-                            elif order_total <= 700:
-                                seats = 6
-                            elif order_total <= 900:
-                                seats = 8
-                            else:
-                                seats = 10
-                        
-                        if seats not in group_by_seats:
-                            group_by_seats[seats] = []
-                        group_by_seats[seats].append(order)
-    
-    # Remove duplicates from lists (same order might have multiple line items)
-    # Use order IDs to remove duplicates since dictionaries aren't hashable
-    individual_order_ids = list(set(order['id'] for order in individual_orders))
-    group_order_ids = list(set(order['id'] for order in group_orders))
-    individual_monthly_ids = list(set(order['id'] for order in individual_monthly))
-    individual_annual_ids = list(set(order['id'] for order in individual_annual))
-    
-    # Get the actual orders back using the unique IDs
-    individual_orders = [order for order in course_orders if order['id'] in individual_order_ids]
-    group_orders = [order for order in course_orders if order['id'] in group_order_ids]
-    individual_monthly = [order for order in course_orders if order['id'] in individual_monthly_ids]
-    individual_annual = [order for order in course_orders if order['id'] in individual_annual_ids]
-    
-    return {
-        'total_orders': total_orders,
-        'total_revenue': total_revenue,
-        'new_orders': len(new_orders),
-        'new_revenue': new_revenue,
-        'recurring_orders': len(recurring_orders),
-        'recurring_revenue': recurring_revenue,
-        'individual_orders': len(individual_orders),
-        'individual_monthly': len(individual_monthly),
-        'individual_annual': len(individual_annual),
-        'individual_revenue': sum(float(o.get('total', 0)) for o in individual_orders),
-        'group_orders': len(group_orders),
-        'group_by_seats': group_by_seats,
-        'group_revenue': sum(float(o.get('total', 0)) for o in group_orders)
-    }
+    change, rate = growth(current, previous)
+    sign = "-" if change < 0 else "+"
+    text = f"{sign}${abs(change):,.2f}" if money else f"{sign}{abs(change):,}"
+    return f"{text} ({rate:+.1%})" if rate is not None else f"{text} (new)"
 
 def main():
     # Header
@@ -543,50 +509,86 @@ def main():
     st.sidebar.title("Navigation")
     page = st.sidebar.selectbox(
         "Choose a page",
-        ["Dashboard", "Monthly Sales", "Users", "Refresh Data"]
+        ["Dashboard", "Orders", "Monthly Sales", "Recurring Revenue", "Users", "Cohorts", "Refresh Data"]
     )
     
     # Refresh options
-    st.sidebar.subheader("🔄 Data Refresh")
-    incremental_refresh = st.sidebar.checkbox("Incremental Update (faster)", value=True, 
-                                             help="Only fetch new orders since last update")
-    
-    # Refresh data button in sidebar
-    if st.sidebar.button("🔄 Refresh Data", type="primary"):
+    with st.sidebar:
+        show_refresh_controls()
+
+    # A refresh requested from the sidebar runs here so its progress shows in the main area
+    if 'refresh_requested' in st.session_state:
         with st.spinner("Fetching latest orders..."):
-            success, message = fetch_orders_from_api(incremental=incremental_refresh)
-            if success:
-                st.sidebar.success(message)
-                st.cache_data.clear()  # Clear cache to reload data
-            else:
-                st.sidebar.error(message)
-    
-    # Load data
-    orders = load_orders()
-    
-    if not orders:
+            incremental = st.session_state.pop('refresh_requested')
+            for success, message in refresh_stores(incremental=incremental):
+                if success:
+                    st.session_state['warm_up_requested'] = True
+                    st.sidebar.success(message)
+                else:
+                    st.sidebar.error(message)
+        if APP_CONFIG['sync_subscriptions']:
+            with st.spinner("Fetching subscriptions..."):
+                success, message = fetch_subscriptions_from_api(incremental=incremental)
+                if success:
+                    st.sidebar.success(message)
+                else:
+                    st.sidebar.error(message)
+
+    # Load data (the new data version after a refresh loads the new orders)
+    inputs = load_session_inputs()
+
+    if inputs is None:
         st.error("No orders found. Please refresh the data or check if Woo.json exists.")
         return
-    
-    stats = calculate_stats(orders)
-    
+
+    data_version = inputs['data_version']
+    orders = inputs['orders']
+    order_index = inputs['order_index']
+    aggregates = inputs['aggregates']
+    
+    # Right after a sync, compute every page's results so other sessions, worker processes and restarts start warm
+    if st.session_state.pop('warm_up_requested', False) and APP_CONFIG['result_cache_warm_up']:
+        with st.spinner("Warming the result cache..."):
+            warm_up(data_version, orders, aggregates)
+
     if page == "Dashboard":
-        show_dashboard(orders, stats)
+        show_dashboard(orders, inputs['stats'], order_index, aggregates, get_daily_revenue_frame(data_version, aggregates))
+    elif page == "Orders":
+        show_orders(orders, order_index, get_search_index(data_version, orders))
     elif page == "Monthly Sales":
-        show_monthly_sales(orders)
+        show_monthly_sales(get_monthly_pivots(data_version, aggregates))
+    elif page == "Recurring Revenue":
+        show_recurring_revenue(get_recurring_revenue_frame(data_version, orders))
     elif page == "Users":
-        show_users(orders)
+        show_users(aggregates['users'], get_user_summary(data_version, aggregates),
+                   get_subscription_index(get_data_version(VERSION_KEY), current_rules().version))
+    elif page == "Cohorts":
+        show_cohorts(get_cohorts(data_version, orders))
     elif page == "Refresh Data":
         show_refresh_page()
 
-def show_dashboard(orders, stats):
+@st.fragment
+def show_refresh_controls():
+    """Sidebar refresh options; toggling them reruns only this fragment"""
+    st.subheader("🔄 Data Refresh")
+    incremental_refresh = st.checkbox("Incremental Update (faster)", value=True,
+                                      help="Only fetch new orders since last update")
+
+    # Refresh data button in sidebar
+    if st.button("🔄 Refresh Data", type="primary"):
+        st.session_state['refresh_requested'] = incremental_refresh
+        st.rerun()
+
+def show_dashboard(orders, stats, order_index, aggregates, daily_revenue):
     """Main dashboard view with course-by-course breakdown"""
     
     # Key metrics at the top
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        st.metric("💰 Total Revenue", f"${stats['total_revenue']:,.2f}")
+        # Net of partial refunds; fully refunded orders aren't completed and never count
+        st.metric("💰 Net Revenue", f"${stats['total_revenue'] - stats['partial_refunds']:,.2f}",
+                  help=f"${stats['total_revenue']:,.2f} from completed orders, less ${stats['partial_refunds']:,.2f} of partial refunds")
     
     with col2:
         st.metric("✅ Completed Orders", f"{stats['completed_orders']:,}")
@@ -597,343 +599,369 @@ def show_dashboard(orders, stats):
     with col4:
         st.metric("👥 Total Customers", f"{stats['customer_count']:,}")
     
-    # Date range info - show fiscal year period instead of entire data range
-    today = datetime.today()
-    current_fy = get_fiscal_year(today)
+    show_course_breakdown(aggregates)
     
-    # Calculate fiscal year start and end dates
-    if today.month >= 9:
-        # Current fiscal year started in September of previous year
-        fy_start = datetime(today.year - 1, 9, 1)
-        fy_end = datetime(today.year, 8, 31)
-    else:
-        # Current fiscal year started in September of current year
-        fy_start = datetime(today.year, 9, 1)
-        fy_end = datetime(today.year + 1, 8, 31)
+    st.write("---")
+    show_revenue_trends(daily_revenue)
     
-    st.info(f"📅 Fiscal Year {current_fy} Period: {fy_start.strftime('%Y-%m-%d')} to {fy_end.strftime('%Y-%m-%d')} (September 1 - August 31)")
+    # Two columns layout for recent orders and status breakdown
+    col1, col2 = st.columns([2, 1])
+    
+    with col1:
+        # Recent orders
+        st.subheader("📋 Recent Orders")
+        recent_orders = get_page(orders, order_index, range(len(orders)), 1, 10)
+        
+        if recent_orders:
+            recent_data = []
+            for order in recent_orders:
+                recent_data.append({
+                    'Order #': order.id,
+                    'Customer': f"{order.first_name} {order.last_name}",
+                    'Date': order.date_created[:10],
+                    'Total': f"${order.total:.2f}" if order.total is not None else "",
+                    'Status': order.status
+                })
+            
+            df_recent = pd.DataFrame(recent_data)
+            st.dataframe(df_recent, use_container_width=True)
+        else:
+            st.write("No recent orders found.")
     
-    # Fiscal year summary
-    fy_orders = filter_orders_fiscal_year(orders, current_fy)
+    with col2:
+        # Order status breakdown
+        st.subheader("📊 Order Status")
+        if aggregates['status_counts']:
+            status_data = status_counts_frame(aggregates)
+            
+            fig = px.pie(status_data, values='Count', names='Status', 
+                        title="Order Status Distribution")
+            st.plotly_chart(fig, use_container_width=True)
+
+@st.fragment
+def show_course_breakdown(aggregates):
+    """Course-by-course breakdown for a selected fiscal year or month, compared with the year before; changing the period reruns only this section"""
+    current_fy = get_fiscal_year(datetime.today())
+    fiscal_years = sorted(set(aggregates['course_metrics']) | {current_fy}, reverse=True)
     
-    # Define your courses
-    courses = ["Living Latin", "Elementa", "Modern Greek for Classicists"]
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        fiscal_year = st.selectbox("Fiscal year", fiscal_years, index=fiscal_years.index(current_fy), key="dashboard_fiscal_year")
+    with col2:
+        comparison = st.selectbox("Compare", ["Fiscal year vs previous", "Month vs same month last year", "No comparison"],
+                                  key="dashboard_comparison")
+    
+    # Fiscal year N runs from September 1 of year N-1 to August 31 of year N
+    fy_start = datetime(fiscal_year - 1, 9, 1)
+    fy_end = datetime(fiscal_year, 8, 31)
+    
+    # Both periods come from the pre-aggregated per-month course metrics, so comparing costs no extra scan
+    if comparison == "Month vs same month last year":
+        months = elapsed_months(fiscal_year) or [f"{fiscal_year - 1}-09"]
+        with col3:
+            month = st.selectbox("Month", months[::-1], format_func=month_label, key="dashboard_month")
+        period_metrics, previous_metrics, previous_label = compare_months(aggregates, month)
+        st.info(f"📅 {month_label(month)} compared with {previous_label}")
+    else:
+        period_metrics, previous_metrics, previous_label = compare_fiscal_years(aggregates, fiscal_year)
+        if comparison == "No comparison":
+            previous_metrics = None
+        st.info(f"📅 Fiscal Year {fiscal_year} Period: {fy_start.strftime('%Y-%m-%d')} to {fy_end.strftime('%Y-%m-%d')} (September 1 - August 31)"
+                + (f", compared with {previous_label}" if previous_metrics is not None else ""))
     
-    for course in courses:
+    for course in COURSES:
         st.write("---")
         st.subheader(f"📚 {course}")
         
-        course_data = analyze_course_orders(fy_orders, course)
+        course_data = period_metrics.get(course)
+        # Metrics of the comparison period (zero if the course had no orders then)
+        previous_data = None if previous_metrics is None else previous_metrics.get(course, {})
+        
+        def delta(key, money=False):
+            return None if previous_data is None else format_delta(course_data[key], previous_data.get(key, 0), money)
         
         if course_data:
             # Course summary metrics
             col1, col2, col3, col4 = st.columns(4)
             with col1:
-                st.metric("📦 Total Orders", f"{course_data['total_orders']:,}")
+                st.metric("📦 Total Orders", f"{course_data['total_orders']:,}", delta("total_orders"))
             with col2:
-                st.metric("💰 Total Revenue", f"${course_data['total_revenue']:,.2f}")
+                st.metric("💰 Total Revenue", f"${course_data['total_revenue']:,.2f}", delta("total_revenue", money=True))
             with col3:
-                st.metric("🆕 New Sales", f"${course_data['new_revenue']:,.2f}")
+                st.metric("🆕 New Sales", f"${course_data['new_revenue']:,.2f}", delta("new_revenue", money=True))
             with col4:
-                st.metric("🔄 Recurring", f"${course_data['recurring_revenue']:,.2f}")
+                st.metric("🔄 Recurring", f"${course_data['recurring_revenue']:,.2f}", delta("recurring_revenue", money=True))
             
             # Individual Orders Breakdown
             st.write("**👤 Individual Orders**")
             col1, col2, col3 = st.columns(3)
             with col1:
-                st.metric("Total Individual", f"{course_data['individual_orders']:,}")
+                st.metric("Total Individual", f"{course_data['individual_orders']:,}", delta("individual_orders"))
             with col2:
-                st.metric("Monthly", f"{course_data['individual_monthly']:,}")
+                st.metric("Monthly", f"{course_data['individual_monthly']:,}", delta("individual_monthly"))
             with col3:
-                st.metric("Annual", f"{course_data['individual_annual']:,}")
+                st.metric("Annual", f"{course_data['individual_annual']:,}", delta("individual_annual"))
             
             # Individual revenue breakdown
-            individual_new_revenue = 0
-            individual_recurring_revenue = 0
-            
-            for order in fy_orders:
-                if order.get('status') != 'completed':
-                    continue
-                for item in order.get('line_items', []):
-                    if isinstance(item, dict) and 'name' in item:
-                        item_name = item['name']
-                        if (course.lower() in item_name.lower() and 
-                            'individual' in item_name.lower()):
-                            item_revenue = float(item.get('total', 0))
-                            if order.get('created_via') == 'subscription':
-                                individual_recurring_revenue += item_revenue
-                            else:
-                                individual_new_revenue += item_revenue
-            
-            st.write(f"*Individual Revenue: ${individual_new_revenue:,.2f} Initial / ${individual_recurring_revenue:,.2f} Recurring*")
+            st.write(f"*Individual Revenue: ${course_data['individual_new_item_revenue']:,.2f} Initial / ${course_data['individual_recurring_item_revenue']:,.2f} Recurring*")
             
             # Group Orders Breakdown
             st.write("**👥 Group Orders**")
-            st.metric("Total Group", f"{course_data['group_orders']:,}")
+            col1, col2 = st.columns(2)
+            with col1:
+                st.metric("Total Group", f"{course_data['group_orders']:,}", delta("group_orders"))
+            with col2:
+                st.metric("Group Revenue", f"${course_data['group_revenue']:,.2f}", delta("group_revenue", money=True))
             
             # Group orders by seat count
             if course_data['group_by_seats']:
                 col1, col2 = st.columns([1, 2])
                 with col1:
-                    for seats, orders_list in sorted(course_data['group_by_seats'].items()):
-                        st.write(f"{seats} seats - {len(orders_list)}")
+                    for seats, seat_orders in sorted(course_data['group_by_seats'].items()):
+                        st.write(f"{seats} seats - {seat_orders}")
                 
                 with col2:
                     # Group revenue breakdown
-                    group_new_revenue = 0
-                    group_recurring_revenue = 0
-                    
-                    for order in fy_orders:
-                        if order.get('status') != 'completed':
-                            continue
-                        for item in order.get('line_items', []):
-                            if isinstance(item, dict) and 'name' in item:
-                                item_name = item['name']
-                                if (course.lower() in item_name.lower() and 
-                                    ('group' in item_name.lower() or 'seats' in item_name.lower())):
-                                    item_revenue = float(item.get('total', 0))
-                                    if order.get('created_via') == 'subscription':
-                                        group_recurring_revenue += item_revenue
-                                    else:
-                                        group_new_revenue += item_revenue
-                    
-                    st.write(f"*Group Revenue: ${group_new_revenue:,.2f} Initial / ${group_recurring_revenue:,.2f} Recurring*")
+                    st.write(f"*Group Revenue: ${course_data['group_new_item_revenue']:,.2f} Initial / ${course_data['group_recurring_item_revenue']:,.2f} Recurring*")
             
             # Course total revenue breakdown
             st.write(f"**💰 Total Revenue: ${course_data['new_revenue']:,.2f} Initial / ${course_data['recurring_revenue']:,.2f} Recurring**")
+            if course_data['refunded_revenue']:
+                st.write(f"*Refunded: ${course_data['refunded_revenue']:,.2f} / Net Revenue: ${course_data['net_revenue']:,.2f}*")
             
         else:
-            st.write(f"No orders found for {course} in this fiscal year.")
+            st.write(f"No orders found for {course} in this period.")
+            if previous_data:
+                st.write(f"*{previous_label}: {previous_data['total_orders']:,} orders, ${previous_data['total_revenue']:,.2f}*")
+
+@st.fragment
+def show_revenue_trends(daily_revenue):
+    """Revenue trend charts per course from the pre-aggregated daily series; the date and bucket inputs rerun only the charts"""
+    st.subheader("📈 Revenue Trends")
     
-    # Two columns layout for recent orders and status breakdown
-    col1, col2 = st.columns([2, 1])
+    if daily_revenue.empty:
+        st.write("No completed orders to chart.")
+        return
     
-    with col1:
-        # Recent orders
-        st.subheader("📋 Recent Orders")
-        recent_orders = sorted(orders, key=lambda x: x['date_created'], reverse=True)[:10]
-        
-        if recent_orders:
-            recent_data = []
-            for order in recent_orders:
-                recent_data.append({
-                    'Order #': order['id'],
-                    'Customer': f"{order['billing']['first_name']} {order['billing']['last_name']}",
-                    'Date': order['date_created'][:10],
-                    'Total': f"${order['total']}",
-                    'Status': order['status']
-                })
-            
-            df_recent = pd.DataFrame(recent_data)
-            st.dataframe(df_recent, use_container_width=True)
-        else:
-            st.write("No recent orders found.")
+    first_day = daily_revenue['Date'].min().date()
+    last_day = daily_revenue['Date'].max().date()
     
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        start_date = st.date_input("Trend from", value=first_day, min_value=first_day, max_value=last_day)
     with col2:
-        # Order status breakdown
-        st.subheader("📊 Order Status")
-        if stats['status_breakdown']:
-            status_data = pd.DataFrame([
-                {'Status': status, 'Count': count}
-                for status, count in stats['status_breakdown'].items()
-            ])
-            
-            fig = px.pie(status_data, values='Count', names='Status', 
-                        title="Order Status Distribution")
+        end_date = st.date_input("Trend to", value=last_day, min_value=first_day, max_value=last_day)
+    with col3:
+        bucket_labels = {label: freq for freq, label, _ in BUCKETS}
+        bucket = st.selectbox("Bucket", ["Auto"] + list(bucket_labels), help="Auto keeps every series within a bounded number of points")
+    with col4:
+        net = st.checkbox("Net of refunds", value=True, help="Subtract refunded line-item amounts from the revenue")
+    revenue = 'Net Revenue' if net else 'Revenue'
+    
+    series, label = revenue_series(
+        daily_revenue,
+        start=start_date,
+        end=end_date,
+        freq=None if bucket == "Auto" else bucket_labels[bucket]
+    )
+    if series.empty:
+        st.write("No completed orders in this date range.")
+        return
+    if bucket not in ("Auto", label):
+        st.caption(f"{bucket} buckets would exceed {APP_CONFIG['chart_max_points']} points over this range; showing {label.lower()} buckets.")
+    
+    # All tracked courses together, then one chart per course
+    tracked = series[series['Course'].isin(COURSES)]
+    fig = px.line(tracked, x='Period', y=revenue, color='Course', markers=len(tracked) < 60,
+                  title=f"{label} {revenue} by Course")
+    st.plotly_chart(fig, use_container_width=True)
+    
+    cols = st.columns(len(COURSES))
+    for col, course in zip(cols, COURSES):
+        with col:
+            course_series = series[series['Course'] == course]
+            if course_series.empty:
+                st.write(f"No revenue for {course} in this date range.")
+                continue
+            fig = px.bar(course_series, x='Period', y=revenue, hover_data=['Orders', 'Refunded'], title=f"{course} ({label})")
             st.plotly_chart(fig, use_container_width=True)
 
-def show_monthly_sales(orders):
+@st.fragment
+def show_orders(orders, order_index, search_index):
+    """Order browser with filters, search and server-side pagination; filtering reruns only the browser"""
+    st.subheader("📋 Orders")
+    
+    # Filters
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        status = st.selectbox("Status", ["All"] + sorted(order_index['by_status'].keys()))
+    with col2:
+        course = st.selectbox("Course", ["All"] + COURSES)
+    with col3:
+        customer = st.text_input("Customer email", help="Exact email address")
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        start_date = st.date_input("From", value=None)
+    with col2:
+        end_date = st.date_input("To", value=None)
+    with col3:
+        search = st.text_input("Search", help="Order number, customer name, email or product (matches as you type)")
+    
+    ranks = query_orders(
+        order_index,
+        status=None if status == "All" else status,
+        course=None if course == "All" else course,
+        customer=customer,
+        start_date=start_date,
+        end_date=end_date,
+        order_ids=search_order_ids(search_index, search)
+    )
+    
+    total_matches = len(ranks)
+    if not total_matches:
+        st.write("No orders match the current filters.")
+        return
+    
+    per_page = APP_CONFIG['items_per_page']
+    total_pages = math.ceil(total_matches / per_page)
+    page = st.number_input(f"Page (of {total_pages:,})", min_value=1, max_value=total_pages, value=1, step=1)
+    
+    # Only the visible page is turned into rows
+    page_data = []
+    for order in get_page(orders, order_index, ranks, page, per_page):
+        row = {'Order #': order.id}
+        if len(WOOCOMMERCE_STORES) > 1:
+            # Show the order number as the store has it
+            row['Store'], row['Order #'] = split_order_id(order.id)
+        row.update({
+            'Customer': f"{order.first_name} {order.last_name}".strip(),
+            'Email': order.email,
+            'Date': order.date_created[:10],
+            'Total': f"${order.total:.2f}" if order.total is not None else "",
+            'Status': order.status,
+            'Products': ', '.join(item.name for item in order.line_items)
+        })
+        page_data.append(row)
+    
+    st.dataframe(pd.DataFrame(page_data), use_container_width=True, hide_index=True)
+    first_shown = (page - 1) * per_page + 1
+    st.caption(f"Showing {first_shown:,}-{first_shown + len(page_data) - 1:,} of {total_matches:,} orders (newest first).")
+    
+    # Export every matching order, not just the visible page
+    show_export_button(
+        f"⬇️ Export {total_matches:,} matching orders",
+        lambda: iter_chunks(order_rows(iter_ranked_orders(orders, order_index, ranks))),
+        "orders",
+        key="export_orders"
+    )
+
+def show_monthly_sales(pivots):
     """Monthly sales view showing total revenue by product and month."""
     st.subheader("Total Revenue by Product and Month")
     
-    # Filter for all completed orders (not just new sales)
-    all_orders = [order for order in orders if order.get('status') == 'completed']
-    if not all_orders:
+    if pivots is None:
         st.write("No sales found.")
         return
     
-    # Gather all unique product names and months
-    product_names = set()
-    months = set()
-    product_course_map = {}
-    courses = ["Living Latin", "Elementa", "Modern Greek for Classicists"]
-    
-    # Exclude demo/beta/test products and specific unwanted products
-    exclude_keywords = [
-        "demo product", "ll test", "this is a course title",
-        "elementa digital student textbook - 1 - 10 seats",
-        "elementa digital student textbook - 100 seats",
-        "elementa digital student textbook - 25 seats",
-        "elementa digital student textbook - 50 seats",
-        "elementa digital student textbook - individual",
-        "elementa digital student textbook - individual - annual",
-        "elementa presentations - 100 seats",
-        "elementa presentations - individual",
-        "aequora",
-        "aequora - 1 - 10 seats",
-        "aequora - 25 seats",
-        "living latin (beta) - 2 seats",
-        "living latin (beta) - 6 seats",
-        "living latin - individual chinese version",
-        "living latin - individual",
-        "living latin in rome - 1 - 10 seats",
-        "living latin in rome - 100 seats",
-        "living latin in rome - 25 seats",
-        "living latin in rome - 50 seats",
-        "elementa - 1 - 10 seats",
-        "elementa - 100 seats",
-        "demo product 2 - 1 - 10 seats",
-        "ll test - 1 - 10 seats",
-        "this is a course title - 1 - 10 seats",
-        "this is a course title - 25 seats"
-    ]
-    exclude_keywords = [
-        ' '.join(e.lower().split()) for e in exclude_keywords
-    ]
-    
-    # Build a mapping of product name to course
-    for order in all_orders:
-        date_str = order.get('date_created')
-        if 'T' in date_str:
-            order_date = datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S")
-        else:
-            order_date = datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S")
-        month_key = order_date.strftime("%Y-%m")
-        months.add(month_key)
-        for item in order.get('line_items', []):
-            if isinstance(item, dict) and 'name' in item:
-                name = item['name'].strip()
-                # Exclude demo/beta/test products
-                if ' '.join(name.lower().split()) in exclude_keywords:
-                    continue
-                product_names.add(name)
-                for course in courses:
-                    if course.lower() in name.lower():
-                        product_course_map[name] = course
-                        break
-                else:
-                    product_course_map[name] = "Other"
-    
-    # Deduplicate product names (case/whitespace insensitive)
-    normalized_names = {}
-    for name in product_names:
-        norm = ' '.join(name.lower().split())
-        if norm not in normalized_names:
-            normalized_names[norm] = name
-    product_names = list(normalized_names.values())
-    
-    # Sort months and product names (grouped by course)
-    months = sorted(months)
-    product_names = sorted(product_names, key=lambda n: (courses.index(product_course_map.get(n, "Other")) if product_course_map.get(n, "Other") in courses else 99, n))
-    
-    # Build the pivot table: rows=product names, columns=months, values=revenue
-    data = {"Product": product_names}
-    for month in months:
-        data[month] = [0 for _ in product_names]
-    
-    # Fill the table
-    product_month_revenue = {(name, month): 0 for name in product_names for month in months}
-    for order in all_orders:
-        date_str = order.get('date_created')
-        if 'T' in date_str:
-            order_date = datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S")
-        else:
-            order_date = datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S")
-        month_key = order_date.strftime("%Y-%m")
-        for item in order.get('line_items', []):
-            if isinstance(item, dict) and 'name' in item:
-                name = item['name'].strip()
-                if ' '.join(name.lower().split()) in exclude_keywords:
-                    continue
-                norm = ' '.join(name.lower().split())
-                if norm in normalized_names:
-                    name = normalized_names[norm]
-                revenue = float(item.get('total', 0))
-                if (name, month_key) in product_month_revenue:
-                    product_month_revenue[(name, month_key)] += revenue
-    
-    # Fill data for DataFrame
-    for i, name in enumerate(product_names):
-        for month in months:
-            data[month][i] = product_month_revenue[(name, month)]
-    
-    # Remove the Course column from the DataFrame
-    df_pivot = pd.DataFrame(data)
-    
-    # Add a Total row at the bottom
-    total_row = {"Product": "Total"}
-    for month in months:
-        total_row[month] = df_pivot[month].sum()
-    # Append the total row
-    df_pivot_with_total = pd.concat([df_pivot, pd.DataFrame([total_row])], ignore_index=True)
+    months = pivots['months']
     
     # Only show the table with the total row
     st.dataframe(
-        df_pivot_with_total,
+        pivots['revenue'],
         use_container_width=True,
         column_order=["Product"] + months,
         hide_index=True,
         column_config={"Product": {"frozen": True}}
     )
     st.caption("Rows: Product names. Columns: Months. Values: Revenue for all completed orders. Demo/beta/test products excluded. Total row at bottom.")
+    show_export_button("⬇️ Export revenue table", lambda: iter_frame_chunks(pivots['revenue']), "monthly_revenue", key="export_monthly_revenue")
 
     # Add a second table for new order counts
     st.subheader("📊 Monthly New Order Counts")
     
-    # Build the order count table: rows=product names, columns=months, values=order count
-    count_data = {"Product": product_names}
-    for month in months:
-        count_data[month] = [0 for _ in product_names]
-    
-    # Fill the order count table (only new orders, not recurring)
-    product_month_count = {(name, month): 0 for name in product_names for month in months}
-    for order in all_orders:
-        # Only count new orders (not recurring/subscription orders)
-        if order.get('created_via') == 'subscription':
-            continue
-            
-        date_str = order.get('date_created')
-        if 'T' in date_str:
-            order_date = datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S")
-        else:
-            order_date = datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S")
-        month_key = order_date.strftime("%Y-%m")
-        
-        for item in order.get('line_items', []):
-            if isinstance(item, dict) and 'name' in item:
-                name = item['name'].strip()
-                if ' '.join(name.lower().split()) in exclude_keywords:
-                    continue
-                norm = ' '.join(name.lower().split())
-                if norm in normalized_names:
-                    name = normalized_names[norm]
-                if (name, month_key) in product_month_count:
-                    product_month_count[(name, month_key)] += 1
-    
-    # Fill count data for DataFrame
-    for i, name in enumerate(product_names):
-        for month in months:
-            count_data[month][i] = product_month_count[(name, month)]
-    
-    # Create DataFrame for order counts
-    df_count = pd.DataFrame(count_data)
-    
-    # Add a Total row at the bottom for counts
-    count_total_row = {"Product": "Total"}
-    for month in months:
-        count_total_row[month] = df_count[month].sum()
-    # Append the total row
-    df_count_with_total = pd.concat([df_count, pd.DataFrame([count_total_row])], ignore_index=True)
-    
     # Show the order count table
     st.dataframe(
-        df_count_with_total,
+        pivots['new_orders'],
         use_container_width=True,
         column_order=["Product"] + months,
         hide_index=True,
         column_config={"Product": {"frozen": True}}
     )
     st.caption("Rows: Product names. Columns: Months. Values: Count of new orders (excluding recurring/subscription orders). Demo/beta/test products excluded. Total row at bottom.")
+    show_export_button("⬇️ Export new order counts", lambda: iter_frame_chunks(pivots['new_orders']), "monthly_new_orders", key="export_monthly_new_orders")
+
+@st.fragment
+def show_recurring_revenue(series):
+    """MRR/ARR trends with new, expansion, contraction and churned MRR per course and tier"""
+    st.subheader("📈 Recurring Revenue")
+    
+    # Months after the current one only hold scheduled churn of subscriptions that haven't renewed yet
+    this_month = pd.Timestamp.today().to_period('M').to_timestamp()
+    series = series[series['Month'] <= this_month]
+    if series.empty:
+        st.write("No subscription orders found.")
+        return
+    
+    col1, col2 = st.columns([1, 2])
+    with col1:
+        course = st.selectbox("Course", ["All courses"] + COURSES, key="mrr_course")
+    if course != "All courses":
+        series = series[series['Course'] == course]
+    tiers = sorted(series['Tier'].unique(), key=tier_sort_key)
+    with col2:
+        selected_tiers = st.multiselect("Tiers", tiers, default=tiers, key="mrr_tiers")
+    series = series[series['Tier'].isin(selected_tiers)]
+    if series.empty:
+        st.write("No subscription revenue for this selection.")
+        return
+    
+    monthly = series.groupby('Month')[['MRR', 'ARR', 'New', 'Expansion', 'Contraction', 'Churned', 'Subscribers']].sum()
+    latest = monthly.iloc[-1]
+    previous_mrr = monthly['MRR'].iloc[-2] if len(monthly) > 1 else 0
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("🔄 MRR", f"${latest['MRR']:,.2f}", delta=f"{latest['MRR'] - previous_mrr:,.2f}")
+    with col2:
+        st.metric("📅 ARR", f"${latest['ARR']:,.2f}")
+    with col3:
+        st.metric("🆕 New + Expansion", f"${latest['New'] + latest['Expansion']:,.2f}")
+    with col4:
+        st.metric("📉 Churned + Contraction", f"${latest['Churned'] + latest['Contraction']:,.2f}")
+    
+    by_tier = series.groupby(['Month', 'Tier'], as_index=False)['MRR'].sum()
+    fig = px.area(by_tier, x='Month', y='MRR', color='Tier', category_orders={'Tier': tiers}, title="MRR by Tier")
+    st.plotly_chart(fig, use_container_width=True)
+    
+    # Gains above the axis, losses below
+    movements = monthly[['New', 'Expansion', 'Contraction', 'Churned']].copy()
+    movements[['Contraction', 'Churned']] *= -1
+    movements = movements.reset_index().melt(id_vars='Month', var_name='Movement', value_name='MRR')
+    fig = px.bar(movements, x='Month', y='MRR', color='Movement', barmode='relative', title="MRR Movements")
+    st.plotly_chart(fig, use_container_width=True)
+    
+    table = monthly.reset_index().sort_values('Month', ascending=False)
+    table['Month'] = table['Month'].dt.strftime('%Y-%m')
+    st.dataframe(table, use_container_width=True, hide_index=True)
+    st.caption("Subscription line items of registered customers, spread over the months they pay for (annual terms over 12 months). "
+               "The current month is still in progress: subscribers who haven't renewed yet this month count as churned until they do.")
+    show_export_button("⬇️ Export MRR table", lambda: iter_frame_chunks(table), "recurring_revenue", key="export_mrr")
+
+@st.fragment
+def show_export_button(label, make_chunks, file_stem, key):
+    """Format picker and download button for an export; the file is only written when the button is clicked"""
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        export_format = st.radio("Format", EXPORT_FORMATS, horizontal=True, key=f"{key}_format", label_visibility="collapsed")
+    with col2:
+        st.download_button(
+            label,
+            data=lambda: write_export(make_chunks(), export_format),
+            file_name=f"{file_stem}.{export_format.lower()}",
+            mime=MIME_TYPES[export_format],
+            key=key
+        )
 
 def show_refresh_page():
     """Refresh data page"""
@@ -945,7 +973,9 @@ def show_refresh_page():
     **What happens when you refresh:**
     - Fetches all orders from WooCommerce API
     - Updates the local Woo.json file
-    - Clears the cache to show fresh data
+    - Fetches the refunds of orders whose refunds changed, so revenue is shown net of partial refunds
+    - Syncs subscriptions modified since the last sync (when enabled)
+    - Reloads the dashboard with the fresh data
     - Shows progress during the fetch
     
     **Note:** The refresh process respects API rate limits and may take a few seconds.
@@ -953,167 +983,53 @@ def show_refresh_page():
     
     if st.button("🔄 Start Data Refresh", type="primary"):
         with st.spinner("Fetching latest orders..."):
-            success, message = fetch_orders_from_api()
-            if success:
-                st.success(message)
-                st.cache_data.clear()  # Clear cache to reload data
-                st.rerun()  # Refresh the page to show new data
-            else:
-                st.error(message)
+            results = refresh_stores()
+            failed = [message for success, message in results if not success]
+            if failed:
+                for message in failed:
+                    st.error(message)
+                return
+            message = " ".join(message for success, message in results)
+        if APP_CONFIG['sync_subscriptions']:
+            with st.spinner("Fetching subscriptions..."):
+                subscriptions_success, subscriptions_message = fetch_subscriptions_from_api()
+                if not subscriptions_success:
+                    st.error(subscriptions_message)
+                    return
+        st.success(message)
+        st.session_state['warm_up_requested'] = True
+        st.rerun()  # Refresh the page to show new data (the new data version reloads the orders)
 
-def show_users(orders):
-    """Users view showing longest subscriptions and lifetime value"""
+def show_users(user_data, summary, subscription_index):
+    """Users view showing longest subscriptions, lifetime value and synced subscription counts"""
     st.subheader("👥 Users Analysis")
     
-    # Filter for completed orders
-    completed_orders = [o for o in orders if o.get('status') == 'completed']
-    if not completed_orders:
-        st.write("No completed orders found.")
-        return
-    
-    # Define the same product exclusions as monthly tables
-    exclude_keywords = [
-        "demo product", "ll test", "this is a course title",
-        "elementa digital student textbook - 1 - 10 seats",
-        "elementa digital student textbook - 100 seats",
-        "elementa digital student textbook - 25 seats",
-        "elementa digital student textbook - 50 seats",
-        "elementa digital student textbook - individual",
-        "elementa digital student textbook - individual - annual",
-        "elementa presentations - 100 seats",
-        "elementa presentations - individual",
-        "aequora",
-        "aequora - 1 - 10 seats",
-        "aequora - 25 seats",
-        "living latin (beta) - 2 seats",
-        "living latin (beta) - 6 seats",
-        "living latin - individual chinese version",
-        "living latin - individual",
-        "living latin in rome - 1 - 10 seats",
-        "living latin in rome - 100 seats",
-        "living latin in rome - 25 seats",
-        "living latin in rome - 50 seats",
-        "elementa - 1 - 10 seats",
-        "elementa - 100 seats",
-        "demo product 2 - 1 - 10 seats",
-        "ll test - 1 - 10 seats",
-        "this is a course title - 1 - 10 seats",
-        "this is a course title - 25 seats"
-    ]
-    exclude_keywords = [' '.join(e.lower().split()) for e in exclude_keywords]
-    
-    # Analyze users
-    user_data = {}
-    
-    for order in completed_orders:
-        customer_id = order.get('customer_id')
-        if not customer_id:
-            continue
-            
-        # Check if order contains any of our included products
-        has_included_product = False
-        for item in order.get('line_items', []):
-            if isinstance(item, dict) and 'name' in item:
-                name = item['name'].strip()
-                if ' '.join(name.lower().split()) not in exclude_keywords:
-                    has_included_product = True
-                    break
-        
-        if not has_included_product:
-            continue
-            
-        # Initialize user data if not exists
-        if customer_id not in user_data:
-            user_data[customer_id] = {
-                'name': f"{order.get('billing', {}).get('first_name', '')} {order.get('billing', {}).get('last_name', '')}".strip(),
-                'email': order.get('billing', {}).get('email', ''),
-                'first_order_date': order.get('date_created'),
-                'last_order_date': order.get('date_created'),
-                'total_revenue': 0,
-                'order_count': 0,
-                'subscription_orders': 0,
-                'new_orders': 0,
-                'products_purchased': set()
-            }
-        
-        # Update user data
-        user = user_data[customer_id]
-        user['total_revenue'] += float(order.get('total', 0))
-        user['order_count'] += 1
-        
-        # Track subscription vs new orders
-        if order.get('created_via') == 'subscription':
-            user['subscription_orders'] += 1
-        else:
-            user['new_orders'] += 1
-        
-        # Update dates
-        order_date = order.get('date_created')
-        if order_date < user['first_order_date']:
-            user['first_order_date'] = order_date
-        if order_date > user['last_order_date']:
-            user['last_order_date'] = order_date
-        
-        # Track products
-        for item in order.get('line_items', []):
-            if isinstance(item, dict) and 'name' in item:
-                name = item['name'].strip()
-                if ' '.join(name.lower().split()) not in exclude_keywords:
-                    user['products_purchased'].add(name)
-    
-    if not user_data:
+    if not summary:
         st.write("No users found with included products.")
         return
     
-    # Calculate subscription duration and convert sets to lists
-    for user_id, user in user_data.items():
-        # Calculate subscription duration in months
-        try:
-            if 'T' in user['first_order_date']:
-                first_date = datetime.strptime(user['first_order_date'], "%Y-%m-%dT%H:%M:%S")
-                last_date = datetime.strptime(user['last_order_date'], "%Y-%m-%dT%H:%M:%S")
-            else:
-                first_date = datetime.strptime(user['first_order_date'], "%Y-%m-%d %H:%M:%S")
-                last_date = datetime.strptime(user['last_order_date'], "%Y-%m-%d %H:%M:%S")
-            
-            months_diff = (last_date.year - first_date.year) * 12 + (last_date.month - first_date.month)
-            user['subscription_months'] = max(0, months_diff)
-        except:
-            user['subscription_months'] = 0
-        
-        # Convert set to list for display
-        user['products_purchased'] = list(user['products_purchased'])
-    
-    # Calculate average lifetime value
-    total_revenue = sum(user['total_revenue'] for user in user_data.values())
-    total_users = len(user_data)
-    avg_lifetime_value = total_revenue / total_users if total_users > 0 else 0
-    
-    # Display metrics
+    # Display metrics (lifetime value is net of refunds)
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        st.metric("👥 Total Users", f"{total_users:,}")
+        st.metric("👥 Total Users", f"{summary['total_users']:,}")
     with col2:
-        st.metric("💰 Total Revenue", f"${total_revenue:,.2f}")
+        st.metric("💰 Net Revenue", f"${summary['net_revenue']:,.2f}")
     with col3:
-        st.metric("📊 Avg Lifetime Value", f"${avg_lifetime_value:,.2f}")
+        st.metric("📊 Avg Lifetime Value", f"${summary['avg_lifetime_value']:,.2f}")
     with col4:
-        st.metric("🔄 Avg Orders/User", f"{sum(user['order_count'] for user in user_data.values()) / total_users:.1f}")
+        st.metric("🔄 Avg Orders/User", f"{summary['avg_orders']:.1f}")
     
-    # Users with longest subscriptions
+    # Users with longest subscriptions (top 20, ranked once per data version)
     st.subheader("🏆 Users with Longest Subscriptions")
     
-    # Sort by subscription months (descending)
-    sorted_users = sorted(user_data.items(), key=lambda x: x[1]['subscription_months'], reverse=True)
-    
     # Create DataFrame for longest subscriptions
     longest_sub_data = []
-    for user_id, user in sorted_users[:20]:  # Top 20
+    for user_id, user in summary['longest']:
         longest_sub_data.append({
             'Customer': user['name'] or f"User {user_id}",
             'Email': user['email'],
             'Months': user['subscription_months'],
-            'Total Revenue': f"${user['total_revenue']:,.2f}",
+            'Net Revenue': f"${user['net_revenue']:,.2f}",
             'Orders': user['order_count'],
             'Subscription Orders': user['subscription_orders'],
             'New Orders': user['new_orders'],
@@ -1129,20 +1045,19 @@ def show_users(orders):
     # Highest lifetime value users
     st.subheader("💰 Users with Highest Lifetime Value")
     
-    # Sort by total revenue (descending)
-    sorted_by_value = sorted(user_data.items(), key=lambda x: x[1]['total_revenue'], reverse=True)
-    
     # Create DataFrame for highest value users
     highest_value_data = []
-    for user_id, user in sorted_by_value[:20]:  # Top 20
+    for user_id, user in summary['highest_value']:
         highest_value_data.append({
             'Customer': user['name'] or f"User {user_id}",
             'Email': user['email'],
-            'Lifetime Value': f"${user['total_revenue']:,.2f}",
+            'Lifetime Value': f"${user['net_revenue']:,.2f}",
+            'Refunded': f"${user['refunded']:,.2f}",
             'Months': user['subscription_months'],
             'Orders': user['order_count'],
             'Subscription Orders': user['subscription_orders'],
             'New Orders': user['new_orders'],
+            'Guest Orders': user['guest_orders'],
             'Products': ', '.join(user['products_purchased']) if user['products_purchased'] else 'None'
         })
     
@@ -1151,6 +1066,69 @@ def show_users(orders):
         st.dataframe(df_value, use_container_width=False, width=1200)
     else:
         st.write("No users with revenue data found.")
+    
+    st.caption("Only the top 20 users are shown; the export contains every customer. "
+               "Guest checkouts count towards the registered customer with the same email, or as customers of their own.")
+    show_export_button("⬇️ Export all customers", lambda: iter_chunks(user_rows(user_data)), "customers", key="export_customers")
+    
+    # Counts and durations from the synced subscriptions table
+    st.subheader("📬 Subscriptions")
+    if not len(subscription_index['id']):
+        st.write("No subscriptions synced yet. Refresh the data to sync the WooCommerce Subscriptions endpoint.")
+        return
+    st.dataframe(subscription_summary(subscription_index), use_container_width=True, hide_index=True)
+    st.caption("Active includes pending-cancel subscriptions, split by plans billed every month, every year or on any other "
+               "period or interval; durations run from the start date to the end date, or to today.")
+
+@st.fragment
+def show_cohorts(cohorts):
+    """Cohort view: acquisition month x months since first order, per course; switching course or measure reruns only this view"""
+    st.subheader("🧭 Customer Cohorts")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        course = st.selectbox("Course", COURSES, key="cohort_course")
+    with col2:
+        measure = st.radio("Show", ["Retention", "Revenue", "Active customers"], horizontal=True, key="cohort_measure")
+    
+    matrices = cohorts.get(course)
+    if matrices is None:
+        st.write(f"No completed orders from registered customers for {course}.")
+        return
+    
+    values = {"Retention": 'retention', "Revenue": 'revenue', "Active customers": 'active'}[measure]
+    matrix = matrices[values] * 100 if values == 'retention' else matrices[values]
+    
+    # Month 0 is the whole cohort; scale the colours to the later months so they stay readable
+    zmax = None
+    if values != 'revenue' and matrix.shape[1] > 1:
+        zmax = float(np.nanmax(matrix[:, 1:])) or None
+    
+    fig = px.imshow(
+        matrix,
+        x=list(range(matrix.shape[1])),
+        y=matrices['cohorts'],
+        aspect='auto',
+        color_continuous_scale='Blues',
+        zmax=zmax,
+        labels={'x': "Months since first order", 'y': "Acquisition month", 'color': {"Retention": "% of cohort", "Revenue": "Revenue ($)", "Active customers": "Customers"}[measure]},
+        title=f"{course}: {measure} by Acquisition Month"
+    )
+    st.plotly_chart(fig, use_container_width=True)
+    
+    frame = cohort_frame(matrices, values)
+    if values == 'retention':
+        frame.iloc[:, 2:] = frame.iloc[:, 2:] * 100
+    st.dataframe(
+        frame,
+        use_container_width=True,
+        hide_index=True,
+        column_config={"Cohort": {"frozen": True}}
+    )
+    st.caption(f"Rows: month of each customer's first completed {course} order. Columns: months since then. "
+               "Retention is the share of the cohort ordering the course in that month (month 0 is always 100%). "
+               "Registered customers only; blank cells are months not reached yet.")
+    show_export_button("⬇️ Export cohort table", lambda: iter_frame_chunks(frame), f"cohorts_{values}", key="export_cohorts")
 
 # Call main function at the end after all functions are defined
 main() 
\ No newline at end of file
@@ -0,0 +1,182 @@
+"""
+WooCommerce Subscriptions table for WooCommerce Dashboard
+
+Subscriptions are synced from the Subscriptions extension's REST endpoint
+(wc/v3/subscriptions) with the same session, limiter and paging as the
+order sync (api_client.py). Each subscription is reduced to one compact row
+(SUBSCRIPTION_COLUMNS) and the rows are kept in their own file next to
+Woo.json, with their own version counter in the store metadata, so a
+subscription sync doesn't invalidate anything built from the orders.
+
+After the first full sync, syncs are incremental: the newest date_modified
+in the table is the cursor, and only subscriptions modified after it are
+fetched and merged by id.
+
+The index holds the table as NumPy arrays (one entry per subscription and
+tracked course), so active counts and durations per course are bincounts
+over the index instead of a reconstruction from the order history.
+"""
+import json
+import os
+from datetime import date
+import numpy as np
+import pandas as pd
+from config import DATA_FILES
+from order_store import bump_data_version
+
+SUBSCRIPTION_COLUMNS = ['id', 'customer_id', 'status', 'start_date', 'next_payment_date', 'end_date',
+                        'billing_period', 'billing_interval', 'total', 'products', 'date_modified']
+
+# Statuses of subscriptions that are still paying (pending-cancel runs until the paid period ends)
+ACTIVE_STATUSES = ('active', 'pending-cancel')
+STATUSES = ['active', 'pending-cancel', 'on-hold', 'pending', 'cancelled', 'expired']
+
+# Billing plans counted separately: every month, every year, and any other period or interval (weekly, quarterly...)
+PLANS = ['Monthly', 'Annual', 'Other Billing']
+
+# Key in the store metadata of the subscriptions table's version
+VERSION_KEY = 'subscriptions_version'
+
+
+def _date(subscription, field):
+    """'YYYY-MM-DD' of a subscription date (GMT field, falling back to the older field names), or None"""
+    value = subscription.get(f"{field}_gmt") or subscription.get(field)
+    if not value or value.startswith('0000'):
+        return None
+    return value[:10]
+
+
+def subscription_row(subscription):
+    """Compact table row of a WooCommerce subscription"""
+    try:
+        interval = int(subscription.get('billing_interval') or 1)
+    except (TypeError, ValueError):
+        interval = 1
+    return [
+        subscription['id'],
+        subscription.get('customer_id') or 0,
+        subscription.get('status') or '',
+        _date(subscription, 'start_date') or _date(subscription, 'date_created'),
+        _date(subscription, 'next_payment_date'),
+        _date(subscription, 'end_date'),
+        subscription.get('billing_period') or '',
+        interval,
+        subscription.get('total'),
+        [item.get('name') or '' for item in subscription.get('line_items') or []],
+        subscription.get('date_modified') or ''
+    ]
+
+
+def merge_subscriptions(existing_rows, new_rows):
+    """Merge rows by id, keeping the copy with the latest date_modified (newest ids first)"""
+    modified = SUBSCRIPTION_COLUMNS.index('date_modified')
+    by_id = {row[0]: row for row in existing_rows}
+    for row in new_rows:
+        existing = by_id.get(row[0])
+        if existing is None or row[modified] >= existing[modified]:
+            by_id[row[0]] = row
+    return sorted(by_id.values(), key=lambda row: row[0], reverse=True)
+
+
+def latest_modified(rows):
+    """Incremental cursor: the newest date_modified in the table, or None if it is empty"""
+    modified = SUBSCRIPTION_COLUMNS.index('date_modified')
+    return max((row[modified] for row in rows if row[modified]), default=None)
+
+
+def load_subscriptions():
+    """Load the subscriptions table rows (empty if it hasn't been synced)"""
+    try:
+        with open(DATA_FILES['subscriptions'], "r") as f:
+            data = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return []
+    if data.get('columns') != SUBSCRIPTION_COLUMNS:
+        return []
+    return data['rows']
+
+
+def save_subscriptions(rows):
+    """Replace the subscriptions table and bump its version (call under store_lock)"""
+    tmp_path = f"{DATA_FILES['subscriptions']}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({'columns': SUBSCRIPTION_COLUMNS, 'rows': rows}, f)
+    os.replace(tmp_path, DATA_FILES['subscriptions'])
+    return bump_data_version(VERSION_KEY)
+
+
+def billing_plan(period, interval):
+    """Index into PLANS of a billing period and interval"""
+    if interval == 1 and period == 'month':
+        return 0
+    if interval == 1 and period == 'year':
+        return 1
+    return 2
+
+
+def build_subscription_index(rows, rules):
+    """NumPy arrays over (subscription, course) pairs: course, status, billing plan, start and end day
+
+    'course' indexes into the rules' courses, 'status' into STATUSES (-1 for any
+    other status) and 'plan' into PLANS; 'end' is NaT while a subscription hasn't ended.
+    """
+    columns = {name: i for i, name in enumerate(SUBSCRIPTION_COLUMNS)}
+    status_codes = {status: code for code, status in enumerate(STATUSES)}
+    course_codes = {course: code for code, course in enumerate(rules.courses)}
+    ids, codes, statuses, plans, starts, ends = [], [], [], [], [], []
+    for row in rows:
+        start = row[columns['start_date']]
+        if not start:
+            continue
+        row_courses = {course_codes.get(rules.course(name)) for name in row[columns['products']]}
+        row_courses.discard(None)
+        for code in row_courses:
+            ids.append(row[columns['id']])
+            codes.append(code)
+            statuses.append(status_codes.get(row[columns['status']], -1))
+            plans.append(billing_plan(row[columns['billing_period']], row[columns['billing_interval']]))
+            starts.append(start)
+            ends.append(row[columns['end_date']] or 'NaT')
+
+    return {
+        'id': np.array(ids, dtype=np.int64),
+        'course': np.array(codes, dtype=np.int32),
+        'status': np.array(statuses, dtype=np.int8),
+        'plan': np.array(plans, dtype=np.int8),
+        'start': np.array(starts, dtype='datetime64[D]'),
+        'end': np.array(ends, dtype='datetime64[D]'),
+        'courses': list(rules.courses)
+    }
+
+
+def subscription_summary(index, today=None):
+    """Per-course counts by status and subscription durations, as a DataFrame
+
+    Durations run from the start date to the end date, or to today for
+    subscriptions that haven't ended; they are given in months.
+    """
+    today = np.datetime64(today or date.today(), 'D')
+    n_courses = len(index['courses'])
+    course = index['course'].astype(np.int64)
+
+    def count(mask):
+        return np.bincount(course[mask], minlength=n_courses)
+
+    active = np.isin(index['status'], [STATUSES.index(status) for status in ACTIVE_STATUSES])
+    ended = np.where(np.isnat(index['end']), today, index['end'])
+    months = (ended - index['start']).astype(np.int64) / 30.4375
+
+    summary = pd.DataFrame({
+        'Course': index['courses'],
+        'Active': count(active),
+        **{plan: count(active & (index['plan'] == code)) for code, plan in enumerate(PLANS)},
+        'On Hold': count(index['status'] == STATUSES.index('on-hold')),
+        'Cancelled': count(index['status'] == STATUSES.index('cancelled')),
+        'Expired': count(index['status'] == STATUSES.index('expired')),
+        'Total': count(np.ones(len(course), dtype=bool))
+    })
+    summary['Avg Months'] = [months[course == code].mean().round(1) if summary['Total'][code] else None
+                             for code in range(n_courses)]
+    summary['Median Months'] = [np.median(months[course == code]).round(1) if summary['Total'][code] else None
+                                for code in range(n_courses)]
+    return summary
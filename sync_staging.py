@@ -0,0 +1,128 @@
+"""
+Staging area for resumable full syncs
+
+A full sync writes every fetched batch of orders to its own file in the
+staging directory and then updates checkpoint.json (query parameters, last
+staged batch, number of orders staged, snapshot time). Batches are fetched
+by offset, so their size can change during the sync. If the sync is
+interrupted, the next full sync with the same query parameters resumes at
+the offset after the last staged batch instead of starting again from the
+first order. When the last batch has been fetched, the staged batches are
+promoted into the store in a single atomic write and the staging directory
+is cleared.
+
+With several stores configured, each store's shard has its own staging
+area ('Woo.<shard>.staging'), so their full syncs run and resume independently.
+
+The snapshot time pins the result set: after the first batch, requests ask
+only for orders created before it, so orders placed while the sync runs
+(or between an interruption and the resume) don't shift the offsets. They are
+picked up by the next incremental sync.
+"""
+import json
+import os
+import shutil
+from datetime import datetime, timedelta
+from config import DATA_FILES
+from order_store import shard_file
+
+CHECKPOINT_FILE = "checkpoint.json"
+
+
+def _staging_dir(shard=None):
+    return shard_file(DATA_FILES['sync_staging'], shard)
+
+
+def _staging_path(name, shard=None):
+    return os.path.join(_staging_dir(shard), name)
+
+
+def _batch_file(batch, shard=None):
+    return _staging_path(f"batch-{batch:06d}.json", shard)
+
+
+def _write_json_atomic(path, data):
+    """Write JSON to a temporary file and move it into place so a crash never leaves a partial file"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(shard=None):
+    """Return the checkpoint of an unfinished full sync of a shard, or None"""
+    try:
+        with open(_staging_path(CHECKPOINT_FILE, shard), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def resumable_checkpoint(params, shard=None):
+    """Return the checkpoint if it was started with the same query parameters (ignoring the snapshot filter), else None"""
+    checkpoint = load_checkpoint(shard)
+    if checkpoint is None:
+        return None
+    staged_params = {k: v for k, v in checkpoint['params'].items() if k != 'before'}
+    if staged_params != params:
+        return None
+    return checkpoint
+
+
+def start_staging(params, shard=None):
+    """Clear the shard's staging area and start a new checkpoint for a full sync"""
+    clear_staging(shard)
+    os.makedirs(_staging_dir(shard), exist_ok=True)
+    checkpoint = {
+        'shard': shard,
+        'params': dict(params),
+        'last_batch': 0,
+        'fetched': 0,
+        'total_estimate': None,
+        'snapshot_time': None,
+        'started_at': datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    }
+    _write_json_atomic(_staging_path(CHECKPOINT_FILE, shard), checkpoint)
+    return checkpoint
+
+
+def set_snapshot(checkpoint, orders):
+    """Pin the sync to orders created no later than the newest order in the first batch
+
+    WooCommerce's 'before' filter is exclusive, so the snapshot is one second
+    after that order. Using the store's own dates keeps the filter in the
+    site's timezone.
+    """
+    dates = [order.get('date_created') for order in orders if order.get('date_created')]
+    if not dates:
+        return
+    newest = datetime.fromisoformat(max(dates).replace(' ', 'T'))
+    checkpoint['snapshot_time'] = (newest + timedelta(seconds=1)).strftime("%Y-%m-%dT%H:%M:%S")
+    checkpoint['params']['before'] = checkpoint['snapshot_time']
+
+
+def stage_batch(checkpoint, orders, total_estimate=None):
+    """Write one fetched batch to the staging area, then advance the checkpoint past it"""
+    batch = checkpoint['last_batch'] + 1
+    shard = checkpoint.get('shard')
+    _write_json_atomic(_batch_file(batch, shard), orders)
+    checkpoint['last_batch'] = batch
+    checkpoint['fetched'] += len(orders)
+    if total_estimate is not None:
+        checkpoint['total_estimate'] = total_estimate
+    _write_json_atomic(_staging_path(CHECKPOINT_FILE, shard), checkpoint)
+    return checkpoint
+
+
+def load_staged_orders(checkpoint):
+    """Read back every staged batch of the checkpoint, in order"""
+    orders = []
+    for batch in range(1, checkpoint['last_batch'] + 1):
+        with open(_batch_file(batch, checkpoint.get('shard')), "r") as f:
+            orders.extend(json.load(f))
+    return orders
+
+
+def clear_staging(shard=None):
+    """Remove the shard's staging directory and everything in it"""
+    shutil.rmtree(_staging_dir(shard), ignore_errors=True)
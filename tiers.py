@@ -0,0 +1,128 @@
+"""
+Hot/cold tiers of the order store for WooCommerce Dashboard
+
+A fiscal year is closed once it has ended and its refund window
+(APP_CONFIG['refund_window_days']) has passed: its orders no longer change.
+When a shard is written (see shards.py), orders of closed fiscal years are
+frozen. They move out of the shard's store file (the hot tier, Woo.json)
+into its cold archive (Woo.archive.json), and are aggregated once into a
+rollup: one aggregate partial per closed fiscal year (Woo.rollup.pkl),
+tagged with the archive's version. A shard's aggregates are the rollup
+merged with a partial of its hot orders, so a sync decodes, rewrites and
+aggregates only the open years, however much history the store holds.
+
+An order of a closed year that changes anyway (a late refund or edit) is
+merged into the archive when it is next written, and only its fiscal
+year's rollup is recomputed.
+
+Positions in the rollup partials ("first seen", see aggregates.py) are
+offset per fiscal year, so every hot order comes before every archived one
+and newer years before older ones, as in the store. Merging the rollup with
+the hot partial therefore gives the same aggregates as aggregating every
+order.
+"""
+import json
+import os
+import pickle
+from datetime import date, timedelta
+from config import APP_CONFIG, DATA_FILES
+from models import loads
+from order_store import shard_file, bump_data_version, get_data_version
+from aggregates import fiscal_year_of, AGGREGATES_FORMAT
+from aggregation_engine import partition_orders, aggregate_partitions
+
+# Positions of archived orders start here (hot positions are always smaller); each fiscal year gets a span
+ARCHIVE_POSITION_OFFSET = 10 ** 15
+FISCAL_YEAR_POSITION_SPAN = 10 ** 10
+
+
+def first_open_fiscal_year(today=None):
+    """Oldest fiscal year that is still open, or None if tiering is off (refund_window_days is None)"""
+    if APP_CONFIG['refund_window_days'] is None:
+        return None
+    # Fiscal year N ends on August 31 of year N and closes refund_window_days later,
+    # so the open years start with the fiscal year of the day the window reaches back to
+    cutoff = (today or date.today()) - timedelta(days=APP_CONFIG['refund_window_days'])
+    return cutoff.year + 1 if cutoff.month >= 9 else cutoff.year
+
+
+def split_tiers(orders, today=None):
+    """Split raw orders into (hot, cold): cold orders belong to closed fiscal years; orders without a date stay hot"""
+    first_open = first_open_fiscal_year(today)
+    if first_open is None:
+        return list(orders), []
+    hot, cold = [], []
+    for order in orders:
+        fiscal_year = fiscal_year_of(order.get('date_created'))
+        (cold if fiscal_year is not None and fiscal_year < first_open else hot).append(order)
+    return hot, cold
+
+
+def archive_version_key(shard=None):
+    """Metadata key of a shard archive's version counter"""
+    return f"archive_version:{shard or ''}"
+
+
+def archive_version(shard=None):
+    """Current version of a shard's archive (0 if nothing has been frozen)"""
+    return get_data_version(archive_version_key(shard))
+
+
+def load_archive(shard=None):
+    """Raw orders of a shard's cold archive, newest first (empty if nothing has been frozen)"""
+    try:
+        with open(shard_file(DATA_FILES['archive'], shard), "rb") as f:
+            return loads(f.read())
+    except FileNotFoundError:
+        return []
+
+
+def save_archive(orders, shard=None):
+    """Replace a shard's archive and bump its version (call under store_lock); returns the new archive version"""
+    path = shard_file(DATA_FILES['archive'], shard)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(orders, f)
+    os.replace(tmp_path, path)
+    return bump_data_version(archive_version_key(shard))
+
+
+def _rebase_positions(partial, positions, offset):
+    """Renumber a partition partial's store positions to offset + rank within the partition"""
+    ranks = {position: rank for rank, position in enumerate(positions)}
+    for norm, (position, name) in partial['product_names'].items():
+        partial['product_names'][norm] = (offset + ranks[position], name)
+    for user in partial['users'].values():
+        user['first_position'] = offset + ranks[user['first_position']]
+
+
+def rollup_partials(records, rules):
+    """Aggregate archived Order records into {fiscal year: partial}, with positions offset per fiscal year"""
+    partitions = partition_orders(records, 'fiscal_year')
+    partials = aggregate_partitions(records, partitions, rules)
+    for fiscal_year, partial in partials.items():
+        offset = ARCHIVE_POSITION_OFFSET + (9999 - (fiscal_year or 0)) * FISCAL_YEAR_POSITION_SPAN
+        _rebase_positions(partial, partitions[fiscal_year], offset)
+    return partials
+
+
+def load_rollup(shard, version):
+    """A shard's rollup partials {fiscal year: partial}, or None if missing or not built from this archive version"""
+    try:
+        with open(shard_file(DATA_FILES['rollup'], shard), "rb") as f:
+            data = pickle.load(f)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return None
+    if data.get('archive_version') != version or data.get('format') != AGGREGATES_FORMAT:
+        return None
+    return data['partials']
+
+
+def save_rollup(partials, shard, version):
+    """Persist a shard's rollup partials, tagged with the archive version they were built from"""
+    path = shard_file(DATA_FILES['rollup'], shard)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump({'format': AGGREGATES_FORMAT, 'archive_version': version, 'partials': partials}, f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
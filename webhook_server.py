@@ -0,0 +1,320 @@
+"""
+Webhook receiver for WooCommerce order events
+
+Point WooCommerce webhooks for order.created, order.updated and
+order.deleted (API version 3) at http://<host>:<port>/webhooks/woocommerce,
+with the secret stored as WOOCOMMERCE_WEBHOOK_SECRET.
+
+Every delivery's X-WC-Webhook-Signature (base64 HMAC-SHA256 of the raw body)
+is checked before anything else. Accepted events are appended to a journal
+file and queued; a background thread writes queued events to the order
+store in batches (upserts keep the newest date_modified, deletes drop the
+order), updates the search index, aggregates and MRR series, and bumps the data
+version so the dashboard's caches reload. With several stores configured,
+deliveries are written to the default store's shard (see shards.py); the
+other stores are kept up to date by the API sync. Events still in the journal when
+the receiver stops are applied when it starts again.
+
+With webhooks in place, the dashboard's API sync is only needed as an
+occasional reconciliation.
+
+Usage:
+    python webhook_server.py                      # run the receiver
+    python webhook_server.py replay events.jsonl  # apply saved deliveries locally
+    python webhook_server.py replay events.jsonl --url http://127.0.0.1:5001/webhooks/woocommerce
+
+Replay files hold one delivery per line: {"topic": "order.updated", "payload": {...}}.
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import requests
+from flask import Flask, request, jsonify
+from config import WEBHOOK_CONFIG, DATA_FILES
+from order_store import load_store_orders, get_data_version, merge_orders, store_lock
+from shards import write_shard
+from alerts import send_alerts
+
+ORDER_TOPICS = {'order.created', 'order.updated', 'order.deleted'}
+
+
+def sign_payload(body, secret):
+    """WooCommerce webhook signature of a raw request body"""
+    digest = hmac.new(secret.encode(), body, hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+
+def verify_signature(body, signature, secret):
+    """Check an X-WC-Webhook-Signature header against the raw body"""
+    if not secret or not signature:
+        return False
+    return hmac.compare_digest(sign_payload(body, secret), signature)
+
+
+def apply_order_events(upserts, deleted_ids):
+    """Write upserted orders and deletions to the store, then refresh the search index and aggregates
+
+    Returns the new data version.
+    """
+    with store_lock():
+        existing_orders = load_store_orders()
+        merged_orders = merge_orders(existing_orders, upserts, deleted_ids)
+
+        # Orders that actually changed (stale deliveries are skipped by merge_orders)
+        existing_by_id = {order['id']: order for order in existing_orders}
+        merged_by_id = {order['id']: order for order in merged_orders}
+        applied_orders = [order for order in upserts if merged_by_id.get(order['id']) is order]
+        changed_ids = [order['id'] for order in applied_orders] + [i for i in deleted_ids if i in existing_by_id]
+        previous_orders = [existing_by_id[i] for i in changed_ids if i in existing_by_id]
+
+        # Refunds of these orders that aren't in the refunds table yet are split over their items until the next sync
+        data_version, alerts = write_shard(None, merged_orders, previous_orders=previous_orders,
+                                           applied_orders=applied_orders, deleted_ids=deleted_ids)
+    # Posted after the lock is released, so a slow alert webhook doesn't hold up syncs and later flushes
+    send_alerts(alerts)
+    return data_version
+
+
+class EventBatcher:
+    """Journals accepted events and writes them to the store in batches
+
+    journal_path defaults to the receiver's journal; another batcher (such
+    as an in-process replay) must use a journal of its own.
+    """
+
+    def __init__(self, flush_interval, max_batch, journal_path=None):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.journal_path = journal_path or DATA_FILES['webhook_journal']
+        self.upserts = {}  # order id -> newest payload received
+        self.deleted_ids = set()
+        self.applied_events = 0
+        self.last_flush = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._journal = open(self.journal_path, "a+")
+        self._replay_journal()
+
+    def _replay_journal(self):
+        """Queue events that were accepted but not yet written before the last shutdown"""
+        self._journal.seek(0)
+        for line in self._journal:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by a crash was never acknowledged
+            self._queue(event['topic'], event['payload'])
+
+    def _queue(self, topic, payload):
+        order_id = payload['id']
+        if topic == 'order.deleted':
+            self.upserts.pop(order_id, None)
+            self.deleted_ids.add(order_id)
+        else:
+            self.deleted_ids.discard(order_id)
+            queued = self.upserts.get(order_id)
+            if queued is None or (payload.get('date_modified') or '') >= (queued.get('date_modified') or ''):
+                self.upserts[order_id] = payload
+
+    def add(self, topic, payload):
+        """Journal and queue one event; returns once it is safe to acknowledge the delivery"""
+        with self._lock:
+            self._journal.write(json.dumps({'topic': topic, 'payload': payload}) + "\n")
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._queue(topic, payload)
+            pending = len(self.upserts) + len(self.deleted_ids)
+        if pending >= self.max_batch:
+            self._wake.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self.upserts) + len(self.deleted_ids)
+
+    def flush(self):
+        """Write everything queued so far to the store; returns the number of orders written"""
+        with self._flush_lock:
+            with self._lock:
+                upserts = list(self.upserts.values())
+                deleted_ids = list(self.deleted_ids)
+                self.upserts = {}
+                self.deleted_ids = set()
+                journal_end = self._journal.tell()
+            if not upserts and not deleted_ids:
+                return 0
+
+            try:
+                apply_order_events(upserts, deleted_ids)
+            except Exception:
+                # Put the batch back (newer events queued meanwhile win); it is still in the journal
+                with self._lock:
+                    for order in upserts:
+                        if order['id'] not in self.deleted_ids:
+                            self._queue('order.updated', order)
+                    for order_id in deleted_ids:
+                        if order_id not in self.upserts:
+                            self._queue('order.deleted', {'id': order_id})
+                raise
+
+            # Rewrite the journal without the written events, keeping any that arrived meanwhile
+            with self._lock:
+                self._journal.seek(journal_end)
+                newer = self._journal.read()
+                tmp_path = f"{self.journal_path}.tmp"
+                with open(tmp_path, "w") as f:
+                    f.write(newer)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._journal.close()
+                os.replace(tmp_path, self.journal_path)
+                self._journal = open(self.journal_path, "a+")
+                self.applied_events += len(upserts) + len(deleted_ids)
+                self.last_flush = time.strftime("%Y-%m-%dT%H:%M:%S")
+            return len(upserts) + len(deleted_ids)
+
+    def run(self):
+        """Background loop: flush every flush_interval seconds, or sooner when a batch fills up"""
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # Events stay in the journal and are retried on the next flush
+                print(f"Webhook flush failed: {e}", file=sys.stderr)
+
+    def start(self):
+        threading.Thread(target=self.run, name="webhook-flush", daemon=True).start()
+
+    def close(self):
+        with self._lock:
+            self._journal.close()
+
+
+def create_app(secret=None, batcher=None):
+    """Flask app receiving WooCommerce order webhooks"""
+    secret = secret or WEBHOOK_CONFIG['secret']
+    batcher = batcher or EventBatcher(WEBHOOK_CONFIG['flush_interval'], WEBHOOK_CONFIG['max_batch'])
+    app = Flask(__name__)
+    app.config['batcher'] = batcher
+
+    @app.post("/webhooks/woocommerce")
+    def receive_webhook():
+        body = request.get_data()
+        topic = request.headers.get('X-WC-Webhook-Topic')
+
+        # WooCommerce pings a new webhook with a form-encoded webhook_id and expects a 2xx
+        if topic is None and body.startswith(b"webhook_id="):
+            return jsonify({'status': 'ok'})
+
+        if not verify_signature(body, request.headers.get('X-WC-Webhook-Signature'), secret):
+            return jsonify({'error': 'invalid signature'}), 401
+
+        # Other topics are acknowledged so WooCommerce doesn't disable the webhook
+        if topic not in ORDER_TOPICS:
+            return jsonify({'status': 'ignored', 'topic': topic})
+
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return jsonify({'error': 'invalid JSON'}), 400
+        if not isinstance(payload, dict) or 'id' not in payload:
+            return jsonify({'error': 'payload has no order id'}), 400
+
+        batcher.add(topic, payload)
+        return jsonify({'status': 'queued', 'pending': batcher.pending()})
+
+    @app.get("/webhooks/health")
+    def health():
+        return jsonify({
+            'pending': batcher.pending(),
+            'applied_events': batcher.applied_events,
+            'last_flush': batcher.last_flush,
+            'data_version': get_data_version()
+        })
+
+    return app
+
+
+def load_replay_file(path):
+    """Read saved deliveries (one {"topic", "payload"} object per line)"""
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def replay_events(events, url=None, secret=None):
+    """Send saved deliveries through the receiver, signed like WooCommerce signs them
+
+    Without a URL they go through an in-process receiver and are written to
+    the store straight away; with a URL they are posted to a running one.
+    The in-process receiver journals to a temporary file of its own, so it
+    never picks up or rewrites the events of a receiver that is running.
+    Returns the HTTP status of each delivery.
+    """
+    secret = secret or WEBHOOK_CONFIG['secret'] or "local-replay"
+    if url is None:
+        journal_dir = os.path.dirname(os.path.abspath(DATA_FILES['webhook_journal']))
+        fd, journal_path = tempfile.mkstemp(prefix="Woo.replay.", suffix=".jsonl", dir=journal_dir)
+        os.close(fd)
+        batcher = EventBatcher(WEBHOOK_CONFIG['flush_interval'], WEBHOOK_CONFIG['max_batch'], journal_path)
+        app = create_app(secret=secret, batcher=batcher)
+        client = app.test_client()
+        post = lambda body, headers: client.post("/webhooks/woocommerce", data=body, headers=headers).status_code
+    else:
+        post = lambda body, headers: requests.post(url, data=body, headers=headers, timeout=30).status_code
+
+    statuses = []
+    try:
+        for event in events:
+            body = json.dumps(event['payload']).encode()
+            headers = {
+                'Content-Type': 'application/json',
+                'X-WC-Webhook-Topic': event['topic'],
+                'X-WC-Webhook-Resource': 'order',
+                'X-WC-Webhook-Event': event['topic'].split('.', 1)[1],
+                'X-WC-Webhook-Signature': sign_payload(body, secret)
+            }
+            statuses.append(post(body, headers))
+
+        if url is None:
+            batcher.flush()
+    finally:
+        # The replay file still holds the deliveries, so its journal is never kept
+        if url is None:
+            batcher.close()
+            os.remove(batcher.journal_path)
+    return statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WooCommerce order webhook receiver")
+    subcommands = parser.add_subparsers(dest="command")
+    replay = subcommands.add_parser("replay", help="apply saved webhook deliveries")
+    replay.add_argument("files", nargs="+", help="JSON Lines files of {\"topic\", \"payload\"} deliveries")
+    replay.add_argument("--url", help="post to a running receiver instead of applying in-process")
+    args = parser.parse_args()
+
+    if args.command == "replay":
+        events = [event for path in args.files for event in load_replay_file(path)]
+        statuses = replay_events(events, url=args.url)
+        accepted = sum(1 for status in statuses if status == 200)
+        print(f"Replayed {len(events)} deliveries: {accepted} accepted, data version {get_data_version()}")
+        return
+
+    if not WEBHOOK_CONFIG['secret']:
+        sys.exit("WOOCOMMERCE_WEBHOOK_SECRET is not set; refusing to accept unsigned webhooks")
+    app = create_app()
+    app.config['batcher'].start()
+    app.run(host=WEBHOOK_CONFIG['host'], port=WEBHOOK_CONFIG['port'], threaded=True)
+
+
+if __name__ == "__main__":
+    main()